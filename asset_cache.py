@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asset Cache Module
+Content-addressed cache of rendered GIF assets
+
+Keys are a SHA-256 over RENDER_CACHE_VERSION, the normalized input (decoded
+image bytes or canonical JSON of pixel data) and the render parameters, so
+the same picture sent to many mugs is rendered once. Bump
+RENDER_CACHE_VERSION whenever rendering output changes, so disk entries
+written by an older release are never served.
+
+Two tiers, both evicted least-recently-used by byte budget:
+1. Memory: GIF bytes and metadata in a ByteBudgetLRU
+2. Disk: one .gif + .json pair per key, read back and promoted to memory
+   on hit; temp files left by an interrupted write are removed on startup
+
+Default on-disk state (this cache and the COS asset index) lives in a
+per-user private directory, <tmp>/pixelmug-<uid>, created with mode 0700.
+A directory with that name owned by someone else, or accessible to
+others, is refused rather than used: the name is predictable, and a
+shared temp dir lets another user plant or read cache entries.
+
+Configuration:
+    ASSET_CACHE_MEMORY_BYTES  memory budget (default 32 MiB, 0 disables)
+    ASSET_CACHE_DIR           disk directory (default asset_cache in the private state dir, empty disables)
+    ASSET_CACHE_DISK_BYTES    disk budget (default 256 MiB)
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Union
+
+# 导入按字节预算的LRU缓存模块
+try:
+    from .byte_lru import ByteBudgetLRU
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    from byte_lru import ByteBudgetLRU
+
+# Part of every asset key: bump when rendering output changes
+RENDER_CACHE_VERSION = 1
+
+
+def private_state_dir() -> str:
+    """
+    Return the per-user private state directory, creating it (mode 0700) if needed
+
+    Raises:
+        OSError: The directory is a symlink, not owned by this user or accessible to others
+    """
+    if not hasattr(os, "getuid"):
+        # Windows: the temp dir is already per-user
+        path = os.path.join(tempfile.gettempdir(), "pixelmug")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    path = os.path.join(tempfile.gettempdir(), f"pixelmug-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise OSError(f"{path} is not a directory")
+    if info.st_uid != os.getuid():
+        raise OSError(f"{path} is owned by uid {info.st_uid}, not {os.getuid()}")
+    if info.st_mode & 0o077:
+        raise OSError(f"{path} is accessible to other users (mode {stat.S_IMODE(info.st_mode):o})")
+    return path
+
+
+def make_asset_key(kind: str, normalized_input: Union[bytes, str, list, dict], **params) -> str:
+    """
+    Build a content-addressed cache key
+
+    Args:
+        kind: Asset kind, e.g. "pixel_image" or "gif_animation"
+        normalized_input: Decoded image bytes, or JSON-serializable pixel data
+        **params: Render parameters (sizes, delays, profile key, ...)
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{RENDER_CACHE_VERSION}".encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(kind.encode("utf-8"))
+    digest.update(b"\0")
+    if isinstance(normalized_input, (bytes, bytearray, memoryview)):
+        digest.update(b"b")
+        digest.update(normalized_input)
+    else:
+        digest.update(b"j")
+        digest.update(json.dumps(normalized_input, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(json.dumps(params, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AssetCache:
+    """Two-tier (memory + disk) cache of rendered GIF bytes and metadata"""
+
+    # Temp files older than this are left over from an interrupted write
+    ORPHAN_TEMP_AGE_SEC = 60
+
+    def __init__(self, memory_bytes: Optional[int] = None, disk_dir: Optional[str] = None,
+                 disk_bytes: Optional[int] = None):
+        """
+        Args:
+            memory_bytes: Memory tier budget (default: ASSET_CACHE_MEMORY_BYTES or 32 MiB)
+            disk_dir: Disk tier directory, "" to disable (default: ASSET_CACHE_DIR or the private state dir)
+            disk_bytes: Disk tier budget (default: ASSET_CACHE_DISK_BYTES or 256 MiB)
+        """
+        self.logger = logging.getLogger(__name__)
+        if memory_bytes is None:
+            memory_bytes = int(os.getenv("ASSET_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+        if disk_dir is None:
+            disk_dir = os.getenv("ASSET_CACHE_DIR")
+        if disk_bytes is None:
+            disk_bytes = int(os.getenv("ASSET_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+
+        self._memory = ByteBudgetLRU(memory_bytes, sizeof=lambda entry: len(entry[0]))
+        self.disk_dir = disk_dir or None
+        if disk_dir is None:
+            try:
+                self.disk_dir = os.path.join(private_state_dir(), "asset_cache")
+            except OSError as e:
+                self.logger.warning(f"Disk asset cache disabled, no private state directory: {str(e)}")
+        self.disk_bytes = disk_bytes
+        self._disk_index = OrderedDict()  # key -> size, least recently used first
+        self._disk_total = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "disk_evictions": 0}
+
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                self._load_disk_index()
+            except OSError as e:
+                self.logger.warning(f"Disk asset cache disabled, cannot use {self.disk_dir}: {str(e)}")
+                self.disk_dir = None
+
+    # ------------------------------------------------------------------
+    # Disk tier
+    # ------------------------------------------------------------------
+
+    def _paths(self, key: str):
+        base = os.path.join(self.disk_dir, key)
+        return base + ".gif", base + ".json"
+
+    def _load_disk_index(self):
+        """Rebuild the LRU index from the files already on disk (oldest access first)
+
+        Orphaned temp files from an interrupted _write_disk are removed; recent ones
+        may belong to another process writing right now and are left alone.
+        """
+        entries = []
+        orphan_before = time.time() - self.ORPHAN_TEMP_AGE_SEC
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".tmp"):
+                try:
+                    if os.stat(path).st_mtime < orphan_before:
+                        os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(".gif"):
+                continue
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, name[:-4], info.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_total += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """Remove least recently used files until the disk tier fits its budget (lock held)"""
+        while self._disk_total > self.disk_bytes and self._disk_index:
+            key, size = self._disk_index.popitem(last=False)
+            self._disk_total -= size
+            self._stats["disk_evictions"] += 1
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        gif_path, meta_path = self._paths(key)
+        try:
+            with open(gif_path, "rb") as gif_file:
+                gif_bytes = gif_file.read()
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                metadata = json.load(meta_file)
+            os.utime(gif_path)
+            return {"gif_bytes": gif_bytes, "metadata": metadata}
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, gif_bytes: bytes, metadata: Dict[str, Any]):
+        gif_path, meta_path = self._paths(key)
+        # Write to temp files and rename so readers never see partial assets
+        for path, data in ((meta_path, json.dumps(metadata).encode("utf-8")), (gif_path, gif_bytes)):
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a rendered asset
+
+        Returns:
+            {"gif_bytes", "metadata", "tier"} or None on miss
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            with self._lock:
+                self._stats["memory_hits"] += 1
+            return {"gif_bytes": entry[0], "metadata": dict(entry[1]), "tier": "memory"}
+
+        if self.disk_dir:
+            with self._lock:
+                on_disk = key in self._disk_index
+                if on_disk:
+                    self._disk_index.move_to_end(key)
+            if on_disk:
+                loaded = self._read_disk(key)
+                if loaded is not None:
+                    self._memory.put(key, (loaded["gif_bytes"], loaded["metadata"]))
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+                    return dict(loaded, tier="disk")
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, gif_bytes: bytes, metadata: Optional[Dict[str, Any]] = None):
+        """Store a rendered asset in both tiers"""
+        metadata = dict(metadata or {})
+        self._memory.put(key, (gif_bytes, metadata))
+        with self._lock:
+            self._stats["puts"] += 1
+
+        if not self.disk_dir or len(gif_bytes) > self.disk_bytes:
+            return
+        try:
+            self._write_disk(key, gif_bytes, metadata)
+        except OSError as e:
+            self.logger.warning(f"Failed to write asset {key[:12]} to disk cache: {str(e)}")
+            return
+        with self._lock:
+            self._disk_total -= self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(gif_bytes)
+            self._disk_total += len(gif_bytes)
+            self._evict_disk()
+
+    def discard(self, key: str):
+        """Drop one cached asset from both tiers (e.g. an unused speculative render)"""
+        self._memory.pop(key)
+        with self._lock:
+            size = self._disk_index.pop(key, None)
+            if size is None:
+                return
+            self._disk_total -= size
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Drop every cached asset from both tiers"""
+        self._memory.clear()
+        with self._lock:
+            keys = list(self._disk_index)
+            self._disk_index.clear()
+            self._disk_total = 0
+        if self.disk_dir:
+            for key in keys:
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes"""
+        memory_stats = self._memory.get_stats()
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats.update({
+                "hit_rate": (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0,
+                "memory_entries": memory_stats["entries"],
+                "memory_bytes": memory_stats["bytes"],
+                "memory_max_bytes": memory_stats["max_bytes"],
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_total,
+                "disk_max_bytes": self.disk_bytes if self.disk_dir else 0
+            })
+        return stats
+
+
+# Global instance
+_asset_cache = None
+_asset_cache_lock = threading.Lock()
+
+
+def get_asset_cache() -> AssetCache:
+    """Get the rendered-asset cache singleton"""
+    global _asset_cache
+    with _asset_cache_lock:
+        if _asset_cache is None:
+            _asset_cache = AssetCache()
+        return _asset_cache
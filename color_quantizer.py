@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Color Quantizer Module
+Maps RGB pixels to a small palette through a precomputed 3D lookup table
+
+Mapping rules:
+1. Colors that are exactly in the palette always map to themselves
+2. Other colors map to the nearest palette entry of their LUT cell
+   (32x32x32 cells by default, nearest by squared RGB distance)
+3. Optional Floyd-Steinberg or ordered (4x4 Bayer) dithering
+
+NumPy is used when installed; otherwise the table is filled lazily and
+looked up in pure Python, which is fine for device-sized frames.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+DITHER_MODES = ("none", "floyd-steinberg", "ordered")
+
+# 4x4 Bayer matrix, values 0-15
+_BAYER_4X4 = (
+    (0, 8, 2, 10),
+    (12, 4, 14, 6),
+    (3, 11, 1, 9),
+    (15, 7, 13, 5),
+)
+
+
+class LUTQuantizer:
+    """Palette mapper backed by a 3D RGB lookup table"""
+
+    def __init__(self, palette: Sequence[Tuple[int, int, int]], bits: int = 5, ordered_spread: int = 32):
+        """
+        Args:
+            palette: List of (r, g, b) colors, at most 256
+            bits: Bits per channel used to address the LUT (5 -> 32x32x32 cells)
+            ordered_spread: Amplitude of the ordered-dither threshold offsets
+        """
+        if not palette:
+            raise ValueError("Palette cannot be empty")
+        if len(palette) > 256:
+            raise ValueError("Palette cannot have more than 256 colors")
+        if bits < 1 or bits > 8:
+            raise ValueError("bits must be between 1 and 8")
+
+        self.logger = logging.getLogger(__name__)
+        self.palette = [tuple(int(c) for c in color[:3]) for color in palette]
+        self.bits = bits
+        self.shift = 8 - bits
+        self.cells = 1 << bits
+        self.ordered_spread = ordered_spread
+
+        # Exact colors win over the LUT; first occurrence keeps its index
+        self._exact = {}
+        for index, (r, g, b) in enumerate(self.palette):
+            self._exact.setdefault((r << 16) | (g << 8) | b, index)
+
+        self._flat_palette = bytes(c for color in self.palette for c in color)
+        self._lock = threading.Lock()
+
+        if NUMPY_AVAILABLE:
+            self._lut = self._build_lut_numpy()
+            self._filled = None
+            exact_keys = sorted(self._exact)
+            self._exact_keys = np.array(exact_keys, dtype=np.int32)
+            self._exact_values = np.array([self._exact[k] for k in exact_keys], dtype=np.uint8)
+        else:
+            # Filled lazily: only cells that are actually hit get computed
+            self._lut = bytearray(self.cells ** 3)
+            self._filled = bytearray(self.cells ** 3)
+
+    # ------------------------------------------------------------------
+    # LUT construction
+    # ------------------------------------------------------------------
+
+    def _cell_center(self, component: int) -> int:
+        """Center value of a LUT cell along one channel"""
+        return (component << self.shift) + ((1 << self.shift) >> 1)
+
+    def _build_lut_numpy(self):
+        """Precompute the whole LUT, one palette entry at a time to bound memory"""
+        axis = np.arange(self.cells, dtype=np.int32)
+        centers = (axis << self.shift) + ((1 << self.shift) >> 1)
+        r, g, b = np.meshgrid(centers, centers, centers, indexing='ij')
+        r, g, b = r.ravel(), g.ravel(), b.ravel()
+
+        best_dist = np.full(r.shape, np.iinfo(np.int32).max, dtype=np.int32)
+        best_index = np.zeros(r.shape, dtype=np.uint8)
+        for index, (pr, pg, pb) in enumerate(self.palette):
+            dist = (r - pr) ** 2 + (g - pg) ** 2 + (b - pb) ** 2
+            closer = dist < best_dist
+            best_dist[closer] = dist[closer]
+            best_index[closer] = index
+        return best_index
+
+    def _nearest(self, r: int, g: int, b: int) -> int:
+        """Nearest palette index by squared RGB distance"""
+        best_index = 0
+        best_dist = None
+        for index, (pr, pg, pb) in enumerate(self.palette):
+            dist = (r - pr) * (r - pr) + (g - pg) * (g - pg) + (b - pb) * (b - pb)
+            if best_dist is None or dist < best_dist:
+                best_dist = dist
+                best_index = index
+        return best_index
+
+    def _lookup(self, r: int, g: int, b: int) -> int:
+        """Map one color: exact palette match first, then the LUT cell"""
+        exact = self._exact.get((r << 16) | (g << 8) | b)
+        if exact is not None:
+            return exact
+        key = ((r >> self.shift) << (2 * self.bits)) | ((g >> self.shift) << self.bits) | (b >> self.shift)
+        if self._filled is not None and not self._filled[key]:
+            with self._lock:
+                self._lut[key] = self._nearest(
+                    self._cell_center(r >> self.shift),
+                    self._cell_center(g >> self.shift),
+                    self._cell_center(b >> self.shift)
+                )
+                self._filled[key] = 1
+        return self._lut[key]
+
+    # ------------------------------------------------------------------
+    # Mapping
+    # ------------------------------------------------------------------
+
+    def map_pixels(self, rgb: bytes, width: int, height: int, dither: str = "none") -> bytes:
+        """
+        Map packed RGB888 pixels to palette indices
+
+        Args:
+            rgb: Packed RGB bytes, row-major
+            width: Image width
+            height: Image height
+            dither: "none", "floyd-steinberg" or "ordered"
+
+        Returns:
+            One palette index byte per pixel
+        """
+        if dither not in DITHER_MODES:
+            raise ValueError(f"dither must be one of: {', '.join(DITHER_MODES)}")
+        if len(rgb) != width * height * 3:
+            raise ValueError("RGB buffer size doesn't match dimensions")
+
+        if dither == "floyd-steinberg":
+            return self._map_floyd_steinberg(rgb, width, height)
+        if self._filled is None:
+            # LUT was fully precomputed with NumPy
+            return self._map_numpy(rgb, width, height, dither == "ordered")
+        if dither == "ordered":
+            return self._map_ordered(rgb, width, height)
+        return bytes(self._lookup(r, g, b) for r, g, b in zip(rgb[0::3], rgb[1::3], rgb[2::3]))
+
+    def _map_numpy(self, rgb: bytes, width: int, height: int, ordered: bool) -> bytes:
+        """Vectorized LUT lookup (with optional ordered dithering)"""
+        pixels = np.frombuffer(rgb, dtype=np.uint8).reshape(height, width, 3).astype(np.int32)
+        colors = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+        if ordered:
+            bayer = np.array(_BAYER_4X4, dtype=np.int32)
+            offsets = np.tile(bayer, (height // 4 + 1, width // 4 + 1))[:height, :width]
+            offsets = (offsets * 2 - 15) * self.ordered_spread // 32
+            pixels = np.clip(pixels + offsets[..., None], 0, 255)
+
+        cells = pixels >> self.shift
+        keys = (cells[..., 0] << (2 * self.bits)) | (cells[..., 1] << self.bits) | cells[..., 2]
+        indices = self._lut[keys]
+
+        # Exact palette colors keep their own index (never dithered)
+        positions = np.clip(np.searchsorted(self._exact_keys, colors), 0, len(self._exact_keys) - 1)
+        matched = self._exact_keys[positions] == colors
+        indices = np.where(matched, self._exact_values[positions], indices)
+        return indices.astype(np.uint8).tobytes()
+
+    def _map_ordered(self, rgb: bytes, width: int, height: int) -> bytes:
+        """Pure Python ordered (Bayer) dithering"""
+        out = bytearray(width * height)
+        spread = self.ordered_spread
+        for y in range(height):
+            bayer_row = _BAYER_4X4[y % 4]
+            for x in range(width):
+                offset = y * width + x
+                r, g, b = rgb[offset * 3], rgb[offset * 3 + 1], rgb[offset * 3 + 2]
+                exact = self._exact.get((r << 16) | (g << 8) | b)
+                if exact is not None:
+                    out[offset] = exact
+                    continue
+                threshold = (bayer_row[x % 4] * 2 - 15) * spread // 32
+                out[offset] = self._lookup(
+                    min(255, max(0, r + threshold)),
+                    min(255, max(0, g + threshold)),
+                    min(255, max(0, b + threshold))
+                )
+        return bytes(out)
+
+    def _map_floyd_steinberg(self, rgb: bytes, width: int, height: int) -> bytes:
+        """Floyd-Steinberg error diffusion; sequential by nature, so plain Python"""
+        out = bytearray(width * height)
+        current = [[0.0, 0.0, 0.0] for _ in range(width + 2)]
+        following = [[0.0, 0.0, 0.0] for _ in range(width + 2)]
+        for y in range(height):
+            for x in range(width):
+                offset = y * width + x
+                error = current[x + 1]
+                r = min(255, max(0, int(round(rgb[offset * 3] + error[0]))))
+                g = min(255, max(0, int(round(rgb[offset * 3 + 1] + error[1]))))
+                b = min(255, max(0, int(round(rgb[offset * 3 + 2] + error[2]))))
+                index = self._lookup(r, g, b)
+                out[offset] = index
+                pr, pg, pb = self.palette[index]
+                diff = (r - pr, g - pg, b - pb)
+                for channel in range(3):
+                    delta = diff[channel]
+                    current[x + 2][channel] += delta * 7 / 16
+                    following[x][channel] += delta * 3 / 16
+                    following[x + 1][channel] += delta * 5 / 16
+                    following[x + 2][channel] += delta * 1 / 16
+            current = following
+            following = [[0.0, 0.0, 0.0] for _ in range(width + 2)]
+        return bytes(out)
+
+    def quantize(self, image: "Image.Image", dither: str = "none") -> "Image.Image":
+        """
+        Quantize a PIL image to this palette
+
+        Args:
+            image: Any-mode PIL image (converted to RGB)
+            dither: "none", "floyd-steinberg" or "ordered"
+
+        Returns:
+            'P' mode image using exactly this palette
+        """
+        if not PIL_AVAILABLE:
+            raise ImportError("PIL not available for quantization")
+        rgb_image = image if image.mode == 'RGB' else image.convert('RGB')
+        width, height = rgb_image.size
+        indices = self.map_pixels(rgb_image.tobytes(), width, height, dither)
+        result = Image.frombytes('P', (width, height), indices)
+        result.putpalette(self._flat_palette)
+        return result
+
+
+def derive_palette(images: Sequence["Image.Image"], max_colors: int = 256) -> List[Tuple[int, int, int]]:
+    """
+    Derive a shared palette for one or more images
+
+    Returns the exact set of colors when there are at most max_colors of
+    them; otherwise runs a single median cut over all images together.
+
+    Args:
+        images: PIL images (any mode)
+        max_colors: Maximum palette size (1-256)
+
+    Returns:
+        List of (r, g, b) colors
+    """
+    if not PIL_AVAILABLE:
+        raise ImportError("PIL not available for palette derivation")
+    if not images:
+        raise ValueError("No images provided for palette derivation")
+    if max_colors < 1 or max_colors > 256:
+        raise ValueError("max_colors must be between 1 and 256")
+
+    rgb_images = [image if image.mode == 'RGB' else image.convert('RGB') for image in images]
+
+    colors = {}
+    for rgb_image in rgb_images:
+        image_colors = rgb_image.getcolors(max_colors)
+        if image_colors is None:
+            colors = None
+            break
+        for count, color in image_colors:
+            colors[color] = colors.get(color, 0) + count
+        if len(colors) > max_colors:
+            colors = None
+            break
+
+    if colors is not None:
+        # Most frequent first so common colors get low indices
+        return [color for color, _ in sorted(colors.items(), key=lambda item: -item[1])]
+
+    # Too many colors: one median cut over all frames stacked vertically
+    width = max(rgb_image.width for rgb_image in rgb_images)
+    height = sum(rgb_image.height for rgb_image in rgb_images)
+    sheet = Image.new('RGB', (width, height))
+    top = 0
+    for rgb_image in rgb_images:
+        sheet.paste(rgb_image, (0, top))
+        top += rgb_image.height
+    quantized = sheet.quantize(colors=max_colors, method=Image.MEDIANCUT)
+    flat = quantized.getpalette()[:3 * max_colors]
+    used = sorted(index for _, index in quantized.getcolors(256))
+    return [tuple(flat[index * 3:index * 3 + 3]) for index in used]
+
+
+# Global LUT cache (fixed device palettes are only built once)
+_quantizer_cache = OrderedDict()
+_quantizer_cache_lock = threading.Lock()
+_QUANTIZER_CACHE_SIZE = 32
+
+
+def get_quantizer(palette: Sequence[Tuple[int, int, int]], bits: int = 5) -> LUTQuantizer:
+    """Get (or build and cache) the LUT quantizer for a palette"""
+    key = (tuple(tuple(color[:3]) for color in palette), bits)
+    with _quantizer_cache_lock:
+        quantizer = _quantizer_cache.get(key)
+        if quantizer is not None:
+            _quantizer_cache.move_to_end(key)
+            return quantizer
+    quantizer = LUTQuantizer(palette, bits)
+    with _quantizer_cache_lock:
+        _quantizer_cache[key] = quantizer
+        while len(_quantizer_cache) > _QUANTIZER_CACHE_SIZE:
+            _quantizer_cache.popitem(last=False)
+    return quantizer
+
+
+def quantize_frames(images: Sequence["Image.Image"], max_colors: int = 256,
+                    palette: Optional[Sequence[Tuple[int, int, int]]] = None,
+                    dither: str = "none") -> List["Image.Image"]:
+    """
+    Convenience function: quantize several frames with one shared palette
+
+    Args:
+        images: PIL images
+        max_colors: Palette size when the palette is derived
+        palette: Fixed palette (e.g. a device palette); derived when None
+        dither: "none", "floyd-steinberg" or "ordered"
+
+    Returns:
+        'P' mode images
+    """
+    if palette is None:
+        palette = derive_palette(images, max_colors)
+    quantizer = get_quantizer(palette)
+    return [quantizer.quantize(image, dither) for image in images]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command Queue Module
+Per-device queue for display commands with last-writer-wins coalescing
+
+A mug shows one thing at a time, so when several display commands for the
+same device pile up only the newest one matters. Each device has its own
+FIFO: commands for one device run strictly in order, one at a time, while
+different devices are drained concurrently on a shared pool. A command that
+has not started yet is dropped (before any rendering or upload) as soon as
+a newer coalescable command for the same device is queued; its caller gets
+CommandSuperseded instead of a result.
+
+Configuration:
+    COMMAND_QUEUE_WORKERS  devices drained at the same time (default 16)
+    COMMAND_COALESCING     drop superseded queued commands (default true)
+"""
+
+import os
+import threading
+import itertools
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Callable, Hashable, Optional
+
+
+class CommandSuperseded(Exception):
+    """Raised to the caller of a queued command dropped in favour of a newer one"""
+
+    def __init__(self, command_id: int, superseded_by: int):
+        super().__init__(f"Command {command_id} superseded by command {superseded_by}")
+        self.command_id = command_id
+        self.superseded_by = superseded_by
+
+
+class DeviceCommandQueue:
+    """Per-key FIFO queues drained one command at a time, different keys in parallel"""
+
+    def __init__(self, max_workers: Optional[int] = None, coalescing: Optional[bool] = None):
+        """
+        Args:
+            max_workers: Keys drained concurrently (default: COMMAND_QUEUE_WORKERS or 16)
+            coalescing: Drop queued commands superseded by newer ones (default: COMMAND_COALESCING)
+        """
+        if max_workers is None:
+            max_workers = int(os.getenv("COMMAND_QUEUE_WORKERS", "16"))
+        if coalescing is None:
+            coalescing = os.getenv("COMMAND_COALESCING", "true").lower() in ("true", "1", "yes")
+
+        self.coalescing = coalescing
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="device-queue")
+        self._lock = threading.Lock()
+        self._queues: Dict[Hashable, deque] = {}  # key -> pending commands, oldest first
+        self._active = set()  # keys currently being drained
+        self._ids = itertools.count(1)
+        self._stats = {"submitted": 0, "executed": 0, "failed": 0, "superseded": 0}
+
+    def submit(self, key: Hashable, fn: Callable[[], Any], coalesce: bool = True) -> Future:
+        """
+        Queue a command for a device
+
+        Args:
+            key: Device key, e.g. (product_id, device_name)
+            fn: Callable doing the work, run on a queue thread
+            coalesce: The command replaces (and may be replaced by) other coalescable commands
+
+        Returns:
+            Future with fn's result, or CommandSuperseded when a newer command replaced it
+        """
+        command = {"id": next(self._ids), "fn": fn, "coalesce": coalesce, "future": Future()}
+        with self._lock:
+            self._stats["submitted"] += 1
+            queue = self._queues.setdefault(key, deque())
+            if coalesce and self.coalescing:
+                # Last writer wins: commands that have not started yet are dropped
+                kept = deque()
+                for pending in queue:
+                    if pending["coalesce"]:
+                        self._stats["superseded"] += 1
+                        pending["future"].set_exception(CommandSuperseded(pending["id"], command["id"]))
+                    else:
+                        kept.append(pending)
+                queue = self._queues[key] = kept
+            queue.append(command)
+            if key not in self._active:
+                self._active.add(key)
+                self._executor.submit(self._drain, key)
+        return command["future"]
+
+    def _drain(self, key: Hashable):
+        """Run a key's commands in order until its queue is empty"""
+        while True:
+            with self._lock:
+                queue = self._queues.get(key)
+                if not queue:
+                    self._queues.pop(key, None)
+                    self._active.discard(key)
+                    return
+                command = queue.popleft()
+            future = command["future"]
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = command["fn"]()
+            except BaseException as e:
+                self._count("failed")
+                future.set_exception(e)
+            else:
+                self._count("executed")
+                future.set_result(result)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return command counters, queued commands and devices being drained"""
+        with self._lock:
+            return dict(self._stats, coalescing=self.coalescing, active_devices=len(self._active),
+                        pending=sum(len(queue) for queue in self._queues.values()))
+
+
+# Global instance
+_command_queue = None
+_command_queue_lock = threading.Lock()
+
+
+def get_command_queue() -> DeviceCommandQueue:
+    """Get the device command queue singleton"""
+    global _command_queue
+    with _command_queue_lock:
+        if _command_queue is None:
+            _command_queue = DeviceCommandQueue()
+        return _command_queue
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Completion Tracker Module
+Learns when asynchronous device actions have actually been carried out
+
+CallDeviceActionAsync only says the command was accepted. A mug confirms
+it fetched and displayed an asset by reporting the acknowledgement event
+(BROADCAST_ACK_EVENT_ID) with the action's client token in its data. The
+tracker keeps every action sent in the last COMPLETION_TIMEOUT_SEC and
+finds those confirmations in two ways:
+1. Batch polling: one background thread lists each product's ack events
+   with ListEventHistory every COMPLETION_POLL_SEC, one query per product
+   however many actions are pending
+2. Pushed events: acknowledgements forwarded to report_device_event
+   complete the action immediately
+
+The time from send to confirmation is recorded as the delivery latency of
+the device.
+
+Tracking is opt-in (COMPLETION_TRACKING): it costs a record per send and
+event listings against the IoT Explorer API quota, which only pays off
+for callers that use wait_for_completion / get_action_result.
+
+Configuration:
+    COMPLETION_TRACKING     track sent actions (default false)
+    COMPLETION_POLL_SEC     interval between batch polls (default 2)
+    COMPLETION_TIMEOUT_SEC  actions not confirmed within this time time out (default 60)
+    COMPLETION_MAX_ENTRIES  finished actions kept for get_action_result (default 10000)
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+
+# Latency samples kept per device
+LATENCY_SAMPLES = 100
+
+
+class CompletionTracker:
+    """client_token -> action record, completed by polled or pushed acknowledgement events"""
+
+    def __init__(self, enabled: Optional[bool] = None, poll_sec: Optional[float] = None,
+                 timeout_sec: Optional[float] = None, max_entries: Optional[int] = None):
+        """
+        Args:
+            enabled: Track sent actions (default: COMPLETION_TRACKING)
+            poll_sec: Seconds between batch polls (default: COMPLETION_POLL_SEC or 2)
+            timeout_sec: Seconds after which an unconfirmed action times out (default: COMPLETION_TIMEOUT_SEC or 60)
+            max_entries: Finished actions kept (default: COMPLETION_MAX_ENTRIES or 10000)
+        """
+        self.logger = logging.getLogger(__name__)
+        if enabled is None:
+            enabled = os.getenv("COMPLETION_TRACKING", "false").lower() in ("true", "1", "yes")
+        if poll_sec is None:
+            poll_sec = float(os.getenv("COMPLETION_POLL_SEC", "2"))
+        if timeout_sec is None:
+            timeout_sec = float(os.getenv("COMPLETION_TIMEOUT_SEC", "60"))
+        if max_entries is None:
+            max_entries = int(os.getenv("COMPLETION_MAX_ENTRIES", "10000"))
+
+        self.enabled = enabled
+        self.poll_sec = poll_sec
+        self.timeout_sec = timeout_sec
+        self.max_entries = max(1, max_entries)
+        self._cond = threading.Condition()
+        self._actions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # product_id -> fetch_events(start_time) yielding (device_name, event data) acknowledgements
+        self._fetchers: Dict[str, Callable[[int], Iterable[Tuple[str, str]]]] = {}
+        self._latencies: Dict[Tuple[str, str], deque] = {}
+        self._stats = {"tracked": 0, "completed": 0, "timed_out": 0, "polls": 0, "poll_errors": 0}
+        self._poller: Optional[threading.Thread] = None
+
+    def register(self, product_id: str, device_name: str, client_token: str, action_id: str,
+                 fetch_events: Callable[[int], Iterable[Tuple[str, str]]]):
+        """
+        Start tracking an action accepted by CallDeviceActionAsync
+
+        Args:
+            fetch_events: Callable listing the product's acknowledgement events since a
+                Unix time as (device_name, data) pairs; used by the batch poller
+        """
+        record = {
+            "client_token": client_token,
+            "product_id": product_id,
+            "device_name": device_name,
+            "action_id": action_id,
+            "status": "pending",
+            "sent_at": time.time(),
+            "completed_at": None,
+            "latency_ms": None,
+            "completed_via": None
+        }
+        with self._cond:
+            self._stats["tracked"] += 1
+            self._actions[client_token] = record
+            self._pending[client_token] = record
+            self._fetchers[product_id] = fetch_events
+            self._trim()
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, name="completion-poller", daemon=True)
+                self._poller.start()
+            self._cond.notify_all()
+
+    def complete_from_event(self, product_id: str, device_name: str, data: str) -> List[str]:
+        """Complete the device's pending actions whose client token appears in pushed event data"""
+        with self._cond:
+            return self._match(product_id, [(device_name, data)], "event")
+
+    def _match(self, product_id: str, events: Iterable[Tuple[str, str]], via: str) -> List[str]:
+        """Complete pending actions acknowledged by the given events (lock held)"""
+        by_device: Dict[str, List[Dict[str, Any]]] = {}
+        for record in self._pending.values():
+            if record["product_id"] == product_id:
+                by_device.setdefault(record["device_name"], []).append(record)
+        if not by_device:
+            return []
+
+        now = time.time()
+        completed = []
+        for device_name, data in events:
+            for record in by_device.get(device_name, ()):
+                if record["status"] == "pending" and record["client_token"] in (data or ""):
+                    latency_ms = round((now - record["sent_at"]) * 1000, 1)
+                    record.update(status="completed", completed_at=now, latency_ms=latency_ms, completed_via=via)
+                    del self._pending[record["client_token"]]
+                    self._latencies.setdefault((product_id, device_name), deque(maxlen=LATENCY_SAMPLES)).append(latency_ms)
+                    self._stats["completed"] += 1
+                    completed.append(record["client_token"])
+        if completed:
+            self._cond.notify_all()
+        return completed
+
+    def _expire(self):
+        """Time out actions that were never confirmed (lock held)"""
+        deadline = time.time() - self.timeout_sec
+        expired = [token for token, record in self._pending.items() if record["sent_at"] < deadline]
+        for token in expired:
+            self._pending.pop(token)["status"] = "timeout"
+            self._stats["timed_out"] += 1
+        if expired:
+            self._cond.notify_all()
+
+    def _trim(self):
+        """Forget the oldest finished actions beyond max_entries (lock held)"""
+        while len(self._actions) > self.max_entries:
+            token = next(iter(self._actions))
+            if token in self._pending:
+                break
+            self._actions.popitem(last=False)
+
+    def poll_once(self):
+        """One batch poll: a single event listing per product with pending actions"""
+        with self._cond:
+            self._expire()
+            since: Dict[str, float] = {}
+            for record in self._pending.values():
+                product_id = record["product_id"]
+                since[product_id] = min(since.get(product_id, record["sent_at"]), record["sent_at"])
+            fetchers = {product_id: self._fetchers[product_id] for product_id in since}
+
+        for product_id, start_time in since.items():
+            try:
+                events = list(fetchers[product_id](int(start_time)))
+            except Exception as e:
+                self.logger.warning(f"Completion poll for product {product_id} failed: {str(e)}")
+                with self._cond:
+                    self._stats["poll_errors"] += 1
+                continue
+            with self._cond:
+                self._stats["polls"] += 1
+                self._match(product_id, events, "poll")
+
+    def _poll_loop(self):
+        while True:
+            with self._cond:
+                # Sleep until there is something to poll for
+                while not self._pending:
+                    self._cond.wait()
+            time.sleep(self.poll_sec)
+            self.poll_once()
+
+    def get(self, client_token: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of an action's record, None if unknown"""
+        with self._cond:
+            self._expire()
+            record = self._actions.get(client_token)
+            return dict(record) if record is not None else None
+
+    def wait(self, client_tokens: List[str], timeout_sec: float) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Wait until none of the actions is pending any more, or the timeout passes
+
+        Returns:
+            client_token -> record copy (None for unknown tokens)
+        """
+        deadline = time.monotonic() + timeout_sec
+        with self._cond:
+            while True:
+                self._expire()
+                if not any(token in self._pending for token in client_tokens):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(min(remaining, self.poll_sec))
+            return {token: dict(self._actions[token]) if token in self._actions else None
+                    for token in client_tokens}
+
+    def get_stats(self, product_id: Optional[str] = None) -> Dict[str, Any]:
+        """Return counters and per-device delivery latency (optionally for one product)"""
+        with self._cond:
+            self._expire()
+            devices = {}
+            for (pid, device_name), samples in self._latencies.items():
+                if product_id is not None and pid != product_id:
+                    continue
+                ordered = sorted(samples)
+                devices[f"{pid}/{device_name}"] = {
+                    "samples": len(ordered),
+                    "last_ms": samples[-1],
+                    "avg_ms": round(sum(ordered) / len(ordered), 1),
+                    "p50_ms": ordered[len(ordered) // 2],
+                    "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max_ms": ordered[-1]
+                }
+            return dict(self._stats, enabled=self.enabled, pending=len(self._pending), poll_sec=self.poll_sec,
+                        timeout_sec=self.timeout_sec, devices=devices)
+
+
+# Global instance
+_completion_tracker = None
+_completion_tracker_lock = threading.Lock()
+
+
+def get_completion_tracker() -> CompletionTracker:
+    """Get the completion tracker singleton"""
+    global _completion_tracker
+    with _completion_tracker_lock:
+        if _completion_tracker is None:
+            _completion_tracker = CompletionTracker()
+        return _completion_tracker
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+COS Asset Index Module
+Local persistent index of assets already uploaded to COS
+
+Maps (bucket, device, content SHA-256, device profile) to the COS key, URL,
+size and upload time, so repeated assets are recognized without a HEAD
+request. Backed by SQLite in WAL mode: crash-safe, warm on restart, and
+safe to share between the server's threads.
+
+Retention:
+1. Entries expire COS_ASSET_INDEX_RETENTION_DAYS after the object was uploaded,
+   however often they are used: COS lifecycle rules delete objects by upload
+   time, so the index must not outlive them. With COS_BUCKET_LIFECYCLE_DAYS set,
+   retention is capped one day below the bucket's lifecycle expiry
+2. Expired entries are reported by lookup() so the caller can forget them and
+   check / upload the object again
+3. At most COS_ASSET_INDEX_MAX_ENTRIES entries, least recently used removed first
+
+Configuration:
+    COS_ASSET_INDEX_PATH            database file (default cos_index.sqlite3 in the private state dir, empty disables)
+    COS_ASSET_INDEX_RETENTION_DAYS  retention after upload in days (default 30)
+    COS_BUCKET_LIFECYCLE_DAYS       the bucket's lifecycle expiry in days (optional, caps retention)
+    COS_ASSET_INDEX_MAX_ENTRIES     entry limit (default 10000)
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+# 导入渲染结果缓存模块（默认数据库位于其私有状态目录）
+try:
+    from . import asset_cache
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import asset_cache
+
+
+class COSAssetIndex:
+    """SQLite (WAL) index of uploaded COS assets"""
+
+    # Prune after this many record() calls, in addition to on open
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path: Optional[str] = None, retention_days: Optional[float] = None,
+                 max_entries: Optional[int] = None, lifecycle_days: Optional[float] = None):
+        """
+        Args:
+            path: Database file, ":memory:" for a private in-memory index
+                (default: COS_ASSET_INDEX_PATH or a file in the per-user private state dir)
+            retention_days: Drop entries this long after upload (default: COS_ASSET_INDEX_RETENTION_DAYS or 30)
+            max_entries: Entry limit (default: COS_ASSET_INDEX_MAX_ENTRIES or 10000)
+            lifecycle_days: Bucket lifecycle expiry; retention is capped one day below it
+                (default: COS_BUCKET_LIFECYCLE_DAYS, unset means no cap)
+        """
+        self.logger = logging.getLogger(__name__)
+        if path is None:
+            path = os.getenv("COS_ASSET_INDEX_PATH") or os.path.join(asset_cache.private_state_dir(), "cos_index.sqlite3")
+        if retention_days is None:
+            retention_days = float(os.getenv("COS_ASSET_INDEX_RETENTION_DAYS", "30"))
+        if max_entries is None:
+            max_entries = int(os.getenv("COS_ASSET_INDEX_MAX_ENTRIES", "10000"))
+        if lifecycle_days is None and os.getenv("COS_BUCKET_LIFECYCLE_DAYS"):
+            lifecycle_days = float(os.getenv("COS_BUCKET_LIFECYCLE_DAYS"))
+        if lifecycle_days is not None:
+            retention_days = min(retention_days, max(0.0, lifecycle_days - 1))
+
+        self.path = path
+        self.retention_sec = retention_days * 86400
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._records_since_prune = 0
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "records": 0, "pruned": 0}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS assets ("
+            " bucket TEXT NOT NULL, device_name TEXT NOT NULL, sha256 TEXT NOT NULL, profile TEXT NOT NULL,"
+            " key TEXT NOT NULL, url TEXT NOT NULL, size INTEGER NOT NULL,"
+            " uploaded_at REAL NOT NULL, last_used_at REAL NOT NULL,"
+            " PRIMARY KEY (bucket, device_name, sha256, profile))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS assets_last_used ON assets (last_used_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS assets_uploaded ON assets (uploaded_at)")
+        self.prune()
+
+    def lookup(self, bucket: str, device_name: str, sha256: str, profile: str) -> Optional[Dict[str, Any]]:
+        """
+        Find an uploaded asset
+
+        Returns:
+            {"key", "url", "size", "uploaded_at", "expired"} or None. An expired entry
+            (uploaded more than the retention ago) may point at an object the bucket's
+            lifecycle already deleted: forget() it and check the object again
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, url, size, uploaded_at FROM assets"
+                " WHERE bucket = ? AND device_name = ? AND sha256 = ? AND profile = ?",
+                (bucket, device_name, sha256, profile)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            if row[3] < now - self.retention_sec:
+                self._stats["expired"] += 1
+                return {"key": row[0], "url": row[1], "size": row[2], "uploaded_at": row[3], "expired": True}
+            self._conn.execute(
+                "UPDATE assets SET last_used_at = ? WHERE bucket = ? AND device_name = ? AND sha256 = ? AND profile = ?",
+                (now, bucket, device_name, sha256, profile)
+            )
+            self._stats["hits"] += 1
+        return {"key": row[0], "url": row[1], "size": row[2], "uploaded_at": row[3], "expired": False}
+
+    def record(self, bucket: str, device_name: str, sha256: str, profile: str,
+               key: str, url: str, size: int, uploaded_at: Optional[float] = None):
+        """Remember that an asset is stored in COS under key
+        
+        uploaded_at should be the object's upload time (e.g. Last-Modified of an existing
+        object), since retention counts from it (default: now)
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO assets"
+                " (bucket, device_name, sha256, profile, key, url, size, uploaded_at, last_used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (bucket, device_name, sha256, profile, key, url, size, uploaded_at or now, now)
+            )
+            self._stats["records"] += 1
+            self._records_since_prune += 1
+            due = self._records_since_prune >= self.PRUNE_INTERVAL
+        if due:
+            self.prune()
+
+    def forget(self, bucket: str, key: str):
+        """Drop entries pointing at a COS key (e.g. after the object was found missing)"""
+        with self._lock:
+            self._conn.execute("DELETE FROM assets WHERE bucket = ? AND key = ?", (bucket, key))
+
+    def prune(self) -> int:
+        """Apply the retention policy, returns the number of removed entries"""
+        with self._lock:
+            self._records_since_prune = 0
+            removed = self._conn.execute(
+                "DELETE FROM assets WHERE uploaded_at < ?", (time.time() - self.retention_sec,)
+            ).rowcount
+            count = self._conn.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+            if count > self.max_entries:
+                removed += self._conn.execute(
+                    "DELETE FROM assets WHERE rowid IN"
+                    " (SELECT rowid FROM assets ORDER BY last_used_at LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+            self._stats["pruned"] += removed
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return lookup counters and the entry count"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+            return dict(self._stats, entries=entries, path=self.path)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Global instance
+_cos_asset_index = None
+_cos_asset_index_lock = threading.Lock()
+# Set when the index could not be opened: stays disabled instead of retrying on every upload
+_cos_asset_index_disabled = False
+
+
+def get_cos_asset_index() -> Optional[COSAssetIndex]:
+    """Get the COS asset index singleton, None when disabled or unavailable"""
+    global _cos_asset_index, _cos_asset_index_disabled
+    with _cos_asset_index_lock:
+        if _cos_asset_index is None:
+            path = os.getenv("COS_ASSET_INDEX_PATH")
+            if path == "" or _cos_asset_index_disabled:
+                return None
+            try:
+                _cos_asset_index = COSAssetIndex(path)
+            except (sqlite3.Error, OSError) as e:
+                _cos_asset_index_disabled = True
+                logging.getLogger(__name__).warning(f"COS asset index disabled until restart: {str(e)}")
+                return None
+        return _cos_asset_index
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Device Presence Module
+Shared TTL cache of device online state
+
+Filled by batch status queries (GetDeviceList pages) and single-device
+DescribeDevice calls, so repeated dashboard refreshes and pre-send checks
+reuse recent answers instead of calling the IoT API per device. Device
+online/offline events overwrite the cached state; any other device event
+invalidates it.
+
+Configuration:
+    DEVICE_PRESENCE_TTL_SEC  how long a device's state is trusted (default 30)
+"""
+
+import os
+import time
+import threading
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+
+class PresenceCache:
+    """(product_id, device_name) -> device state, expiring after a TTL"""
+
+    def __init__(self, ttl_sec: Optional[float] = None):
+        """
+        Args:
+            ttl_sec: Entry lifetime in seconds (default: DEVICE_PRESENCE_TTL_SEC or 30)
+        """
+        if ttl_sec is None:
+            ttl_sec = float(os.getenv("DEVICE_PRESENCE_TTL_SEC", "30"))
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Tuple[Dict[str, Any], float]] = {}
+        self._stats = {"hits": 0, "misses": 0, "updates": 0}
+
+    def get(self, product_id: str, device_name: str, max_age_sec: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Get a device's cached state
+
+        Args:
+            max_age_sec: Accept entries at most this old (default: the TTL)
+
+        Returns:
+            State dict (online, status, ..., age_sec) or None if unknown or expired
+        """
+        max_age = self.ttl_sec if max_age_sec is None else min(max_age_sec, self.ttl_sec)
+        with self._lock:
+            entry = self._entries.get((product_id, device_name))
+            if entry is not None:
+                age = time.monotonic() - entry[1]
+                if age <= max_age:
+                    self._stats["hits"] += 1
+                    return dict(entry[0], age_sec=round(age, 3))
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, product_id: str, device_name: str, state: Dict[str, Any]):
+        """Store a device's state (must contain "online")"""
+        self.put_many(product_id, [(device_name, state)])
+
+    def put_many(self, product_id: str, states: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Store several devices' states at once"""
+        now = time.monotonic()
+        with self._lock:
+            for device_name, state in states:
+                self._entries[(product_id, device_name)] = (dict(state), now)
+                self._stats["updates"] += 1
+            self._prune(now)
+
+    def set_online(self, product_id: str, device_name: str, online: bool):
+        """Record an observed online/offline transition, keeping the other cached fields"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((product_id, device_name))
+            state = dict(entry[0]) if entry is not None else {}
+            state.update(online=online, status=1 if online else 2)
+            self._entries[(product_id, device_name)] = (state, now)
+            self._stats["updates"] += 1
+            self._prune(now)
+
+    def invalidate(self, product_id: str, device_name: Optional[str] = None):
+        """Forget one device, or every device of a product"""
+        with self._lock:
+            if device_name is not None:
+                self._entries.pop((product_id, device_name), None)
+            else:
+                for key in [key for key in self._entries if key[0] == product_id]:
+                    del self._entries[key]
+
+    def _prune(self, now: float):
+        """Drop expired entries once the cache has grown (lock held)"""
+        if len(self._entries) < 4096:
+            return
+        deadline = now - self.ttl_sec
+        for key in [key for key, entry in self._entries.items() if entry[1] < deadline]:
+            del self._entries[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), ttl_sec=self.ttl_sec)
+
+
+# Global instance
+_presence_cache = None
+_presence_cache_lock = threading.Lock()
+
+
+def get_presence_cache() -> PresenceCache:
+    """Get the device presence cache singleton"""
+    global _presence_cache
+    with _presence_cache_lock:
+        if _presence_cache is None:
+            _presence_cache = PresenceCache()
+        return _presence_cache
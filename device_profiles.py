@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Device Profiles Module
+Display capabilities of each mug model, keyed by product ID
+
+A profile describes what the device can decode:
+1. Panel resolution (width x height)
+2. Maximum palette size
+3. Maximum GIF file size
+4. Frame-rate limits (minimum frame delay, maximum frame count)
+
+Products without a registered profile use the default 32x16 profile.
+Extra profiles can be registered in code or through the DEVICE_PROFILES
+environment variable, e.g.
+DEVICE_PROFILES='{"ABCDEF1234": {"name": "mug-64x32", "width": 64, "height": 32, "max_colors": 64}}'
+"""
+
+import os
+import json
+import logging
+import threading
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+
+class DeviceProfile:
+    """Display capabilities of one device model"""
+
+    def __init__(self, name: str, width: int = 32, height: int = 16, max_colors: int = 256,
+                 max_file_bytes: Optional[int] = 256 * 1024, min_frame_delay_ms: int = 20,
+                 max_frames: Optional[int] = 200, palette: Optional[Sequence[Tuple[int, int, int]]] = None):
+        """
+        Args:
+            name: Profile name
+            width: Panel width in pixels
+            height: Panel height in pixels
+            max_colors: Maximum palette size the device decodes (2-256)
+            max_file_bytes: Maximum GIF file size, None for no limit
+            min_frame_delay_ms: Shortest frame delay the device can show
+            max_frames: Maximum number of frames, None for no limit
+            palette: Fixed device palette as (r, g, b) tuples, None to derive per asset
+        """
+        if width < 1 or height < 1:
+            raise ValueError("Profile width and height must be positive")
+        if max_colors < 2 or max_colors > 256:
+            raise ValueError("Profile max_colors must be between 2 and 256")
+        if palette is not None and len(palette) > max_colors:
+            raise ValueError("Profile palette has more colors than max_colors")
+
+        self.name = name
+        self.width = width
+        self.height = height
+        self.max_colors = max_colors
+        self.max_file_bytes = max_file_bytes
+        self.min_frame_delay_ms = min_frame_delay_ms
+        self.max_frames = max_frames
+        self.palette = [tuple(color[:3]) for color in palette] if palette else None
+
+    def get_scale_plan(self, source_width: int, source_height: int) -> Dict[str, Any]:
+        """Precomputed aspect-preserving geometry and nearest-neighbour index maps for a source size"""
+        return compute_scale_plan(source_width, source_height, self.width, self.height)
+
+    def clamp_duration(self, duration_ms: int) -> int:
+        """Raise a frame delay to the shortest one the device can show"""
+        return max(duration_ms, self.min_frame_delay_ms)
+
+    def cache_key(self) -> Tuple:
+        """Hashable identity of the profile settings (stable across processes)"""
+        return (self.name, self.width, self.height, self.max_colors, self.max_file_bytes,
+                self.min_frame_delay_ms, self.max_frames, tuple(self.palette) if self.palette else None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializable view of the profile"""
+        return {
+            "name": self.name,
+            "width": self.width,
+            "height": self.height,
+            "max_colors": self.max_colors,
+            "max_file_bytes": self.max_file_bytes,
+            "min_frame_delay_ms": self.min_frame_delay_ms,
+            "max_frames": self.max_frames,
+            "palette": ["#%02x%02x%02x" % color for color in self.palette] if self.palette else None
+        }
+
+
+@lru_cache(maxsize=256)
+def compute_scale_plan(source_width: int, source_height: int,
+                       target_width: int, target_height: int) -> Dict[str, Any]:
+    """
+    Compute aspect-preserving scaling onto a target canvas
+
+    Args:
+        source_width: Source image width
+        source_height: Source image height
+        target_width: Canvas width
+        target_height: Canvas height
+
+    Returns:
+        Dict with scaled_width/scaled_height, paste_x/paste_y (centered) and
+        x_map/y_map: the source column/row sampled by each scaled pixel,
+        matching PIL's NEAREST filter
+    """
+    if source_width < 1 or source_height < 1:
+        raise ValueError("Source width and height must be positive")
+
+    # Use the smaller scale so the whole image fits
+    scale = min(target_width / source_width, target_height / source_height)
+    scaled_width = max(1, int(source_width * scale))
+    scaled_height = max(1, int(source_height * scale))
+
+    return {
+        "scaled_width": scaled_width,
+        "scaled_height": scaled_height,
+        "paste_x": (target_width - scaled_width) // 2,
+        "paste_y": (target_height - scaled_height) // 2,
+        "x_map": compute_index_map(source_width, scaled_width),
+        "y_map": compute_index_map(source_height, scaled_height)
+    }
+
+
+@lru_cache(maxsize=256)
+def compute_index_map(source_length: int, target_length: int) -> Tuple[int, ...]:
+    """Source index sampled by each target index along one axis, matching PIL's NEAREST filter"""
+    # PIL steps the sample position by the scale from half a step in; accumulating
+    # the same float additions reproduces its rounding exactly
+    scale = source_length / target_length
+    position = scale * 0.5
+    index_map = []
+    for _ in range(target_length):
+        index_map.append(min(source_length - 1, int(position)))
+        position += scale
+    return tuple(index_map)
+
+
+class DeviceProfileRegistry:
+    """Maps product IDs to device profiles"""
+
+    DEFAULT_PROFILE = DeviceProfile("pixelmug-32x16", width=32, height=16)
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._profiles: Dict[str, DeviceProfile] = {}
+        self._load_env_profiles()
+
+    def _load_env_profiles(self):
+        """Register profiles from the DEVICE_PROFILES environment variable"""
+        raw = os.getenv("DEVICE_PROFILES")
+        if not raw:
+            return
+        try:
+            for product_id, settings in json.loads(raw).items():
+                settings = dict(settings)
+                name = settings.pop("name", f"profile-{product_id}")
+                self.register_profile(product_id, DeviceProfile(name, **settings))
+        except Exception as e:
+            self.logger.warning(f"Ignoring invalid DEVICE_PROFILES: {str(e)}")
+
+    def register_profile(self, product_id: str, profile: DeviceProfile) -> DeviceProfile:
+        """Register (or replace) the profile for a product ID"""
+        with self._lock:
+            self._profiles[product_id] = profile
+        self.logger.info(f"Registered device profile {profile.name} ({profile.width}x{profile.height}) for product {product_id}")
+        return profile
+
+    def get_profile(self, product_id: Optional[str] = None) -> DeviceProfile:
+        """Get the profile for a product ID, falling back to the default profile"""
+        if product_id:
+            with self._lock:
+                profile = self._profiles.get(product_id)
+            if profile is not None:
+                return profile
+        return self.DEFAULT_PROFILE
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """List registered profiles with their product IDs"""
+        with self._lock:
+            items = list(self._profiles.items())
+        return [dict(profile.to_dict(), product_id=product_id) for product_id, profile in items]
+
+
+# Global instance
+_registry = None
+
+
+def get_device_profile_registry() -> DeviceProfileRegistry:
+    """Get the device profile registry singleton"""
+    global _registry
+    if _registry is None:
+        _registry = DeviceProfileRegistry()
+    return _registry
+
+
+def get_profile(product_id: Optional[str] = None) -> DeviceProfile:
+    """
+    Convenience function: get the display profile for a product
+
+    Args:
+        product_id: Product ID, None for the default profile
+
+    Returns:
+        DeviceProfile
+    """
+    return get_device_profile_registry().get_profile(product_id)
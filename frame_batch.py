@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Frame Batch Module
+Resizes all frames of an animation at once with NumPy
+
+Frames are stacked into one (N, H, W, 3) uint8 array and resized with a
+precomputed nearest-neighbour index map in a single fancy-indexing step;
+corner-colour fill for letterboxing is computed for all frames together.
+Results are identical to PIL's per-frame NEAREST resize.
+
+NumPy is optional: callers check NUMPY_AVAILABLE and keep their per-frame
+PIL path when it is missing.
+"""
+
+from typing import Dict, Any, List, Sequence
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# 导入设备配置文件模块（索引映射表）
+try:
+    from . import device_profiles
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import device_profiles
+
+
+def _stack_frames(frames: Sequence[bytes], width: int, height: int) -> "np.ndarray":
+    """Stack packed RGB frames into an (N, H, W, 3) array without per-pixel work"""
+    if not NUMPY_AVAILABLE:
+        raise ImportError("NumPy not available for batch frame resizing")
+    stacked = np.frombuffer(b"".join(frames), dtype=np.uint8)
+    return stacked.reshape(len(frames), height, width, 3)
+
+
+def resize_frames(frames: Sequence[bytes], source_width: int, source_height: int,
+                  target_width: int, target_height: int) -> List[bytes]:
+    """
+    Stretch-resize packed RGB frames to the target size (nearest neighbour)
+
+    Args:
+        frames: Packed RGB888 frames, all source_width x source_height
+        source_width: Frame width
+        source_height: Frame height
+        target_width: Output width
+        target_height: Output height
+
+    Returns:
+        Packed RGB888 frames of target_width x target_height
+    """
+    if not frames:
+        return []
+    stack = _stack_frames(frames, source_width, source_height)
+    y_map = np.asarray(device_profiles.compute_index_map(source_height, target_height), dtype=np.intp)
+    x_map = np.asarray(device_profiles.compute_index_map(source_width, target_width), dtype=np.intp)
+    resized = stack[:, y_map[:, None], x_map[None, :]]
+    return [frame.tobytes() for frame in resized]
+
+
+def fit_frames_to_canvas(frames: Sequence[bytes], source_width: int, source_height: int,
+                         scale_plan: Dict[str, Any], canvas_width: int, canvas_height: int) -> List[bytes]:
+    """
+    Aspect-preserving resize onto a canvas filled with each frame's corner colour
+
+    The fill colour follows GIFResizer: the shared colour when all four
+    corners match, otherwise the (floored) average of the four corners.
+
+    Args:
+        frames: Packed RGB888 frames, all source_width x source_height
+        source_width: Frame width
+        source_height: Frame height
+        scale_plan: Result of device_profiles.compute_scale_plan for this size
+        canvas_width: Canvas width
+        canvas_height: Canvas height
+
+    Returns:
+        Packed RGB888 frames of canvas_width x canvas_height
+    """
+    if not frames:
+        return []
+    stack = _stack_frames(frames, source_width, source_height)
+    count = stack.shape[0]
+
+    # Corner colours of every frame at once: (N, 4, 3)
+    corners = stack[:, [0, 0, -1, -1], [0, -1, 0, -1]].astype(np.int32)
+    all_same = (corners == corners[:, :1]).all(axis=(1, 2))
+    fill = np.where(all_same[:, None], corners[:, 0], corners.sum(axis=1) // 4).astype(np.uint8)
+
+    y_map = np.asarray(scale_plan["y_map"], dtype=np.intp)
+    x_map = np.asarray(scale_plan["x_map"], dtype=np.intp)
+    resized = stack[:, y_map[:, None], x_map[None, :]]
+
+    canvas = np.empty((count, canvas_height, canvas_width, 3), dtype=np.uint8)
+    canvas[:] = fill[:, None, None, :]
+    paste_x, paste_y = scale_plan["paste_x"], scale_plan["paste_y"]
+    canvas[:, paste_y:paste_y + resized.shape[1], paste_x:paste_x + resized.shape[2]] = resized
+    return [frame.tobytes() for frame in canvas]
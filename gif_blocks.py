@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+GIF Block Walker Module
+Reads the block structure of raw GIF bytes without decoding any pixels
+
+Used wherever a GIF has to be inspected cheaply: frame counting for the
+image input guard and the resizer, and the resizer's pass-through check.
+PIL's GIF seek() decodes every frame it passes (for disposal), so walking
+the blocks is the only way to learn about later frames for free.
+"""
+
+from typing import Iterator, Optional, Tuple
+
+# Block introducers
+IMAGE_DESCRIPTOR = 0x2C
+EXTENSION = 0x21
+TRAILER = 0x3B
+
+
+def skip_sub_blocks(data: bytes, pos: int) -> int:
+    """Skip a chain of GIF data sub-blocks, returning the position after the terminator"""
+    length = len(data)
+    while pos < length:
+        size = data[pos]
+        pos += 1
+        if size == 0:
+            break
+        pos += size
+    return pos
+
+
+def iter_blocks(data: bytes) -> Iterator[Tuple[int, int]]:
+    """
+    Yield (introducer, position) for each top-level block after the header
+
+    Image descriptors (0x2C) and extensions (0x21) are skipped past, including
+    local color tables and data sub-blocks, after being yielded. The walk ends
+    after the trailer (0x3B), an unknown introducer (yielded so callers can
+    reject it), a truncated image descriptor, or the end of the data.
+    Nothing is yielded for data that is not a GIF.
+    """
+    length = len(data)
+    if length < 13 or data[:6] not in (b"GIF87a", b"GIF89a"):
+        return
+    pos = 13
+    packed = data[10]
+    if packed & 0x80:
+        # Global color table
+        pos += 3 * (2 ** ((packed & 0x07) + 1))
+
+    while pos < length:
+        block = data[pos]
+        yield block, pos
+        if block == IMAGE_DESCRIPTOR:
+            if pos + 10 > length:
+                return
+            packed = data[pos + 9]
+            pos += 10
+            if packed & 0x80:
+                # Local color table
+                pos += 3 * (2 ** ((packed & 0x07) + 1))
+            # LZW minimum code size, then image data sub-blocks
+            pos = skip_sub_blocks(data, pos + 1)
+        elif block == EXTENSION:
+            # Introducer + label, then sub-blocks
+            pos = skip_sub_blocks(data, pos + 2)
+        else:
+            # Trailer or garbage
+            return
+
+
+def count_frames(data: bytes, stop_after: Optional[int] = None) -> int:
+    """Count image descriptors in raw GIF bytes, stopping once stop_after is reached"""
+    frames = 0
+    for block, _ in iter_blocks(data):
+        if block == IMAGE_DESCRIPTOR:
+            frames += 1
+            if stop_after is not None and frames >= stop_after:
+                break
+    return frames
@@ -2,16 +2,21 @@
 # -*- coding: utf-8 -*-
 """
 GIF Resizer Module
-统一处理GIF缩放为标准规格(32x16)
+统一处理GIF缩放为设备规格（默认32x16，按设备配置文件选择）
 
 缩放规则：
 1. 等比例缩放，保持宽高比（如32x32会缩放为16x16）
 2. 缩放后的空白区域，用原图四角像素的颜色填充
+3. 颜色数、帧间隔、帧数和文件大小遵循设备配置文件的限制
+   （超出设备帧数上限的帧被丢弃，记录警告并计入 truncated_count）
 """
 
 import io
+import os
+import hashlib
 import logging
-from typing import Optional, Tuple, List
+import threading
+from typing import Callable, Optional, Tuple, List, Dict, Any
 
 try:
     from PIL import Image
@@ -19,27 +24,93 @@ try:
 except ImportError:
     PIL_AVAILABLE = False
 
+# 导入颜色量化模块
+try:
+    from . import color_quantizer
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import color_quantizer
+
+# 导入按字节预算的LRU缓存模块
+try:
+    from .byte_lru import ByteBudgetLRU
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    from byte_lru import ByteBudgetLRU
+
+# 导入批量帧缩放模块
+try:
+    from . import frame_batch
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import frame_batch
+
+# 导入设备配置文件模块
+try:
+    from . import device_profiles
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import device_profiles
+
+# 导入图像输入守卫模块
+try:
+    from . import image_guard
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import image_guard
+
+# 导入GIF块结构读取模块
+try:
+    from . import gif_blocks
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import gif_blocks
+
 
 class GIFResizer:
-    """GIF缩放器，将GIF统一缩放为32x16标准尺寸"""
+    """GIF缩放器，将GIF统一缩放为设备配置文件规定的尺寸（默认32x16）"""
     
-    # 标准尺寸
+    # 默认标准尺寸（未指定设备配置文件时）
     TARGET_WIDTH = 32
     TARGET_HEIGHT = 16
     
-    def __init__(self):
+    # 超出文件大小限制时依次尝试的颜色数
+    COLOR_STEPS = (256, 64, 16)
+    
+    # NumPy批量缩放时每批的帧数（限制同时驻留内存的原尺寸帧）
+    BATCH_SIZE = 32
+    
+    def __init__(self, cache_bytes: Optional[int] = None, profile: Optional["device_profiles.DeviceProfile"] = None):
         self.logger = logging.getLogger(__name__)
+        self.profile = profile or device_profiles.get_device_profile_registry().DEFAULT_PROFILE
+        self.TARGET_WIDTH = self.profile.width
+        self.TARGET_HEIGHT = self.profile.height
+        # 缩放结果缓存：以原始GIF内容哈希为键，按输出字节数限制总大小
+        if cache_bytes is None:
+            cache_bytes = int(os.getenv("GIF_RESIZE_CACHE_BYTES", str(8 * 1024 * 1024)))
+        self._cache = ByteBudgetLRU(cache_bytes)
+        self.passthrough_count = 0
+        self.truncated_count = 0
     
-    def resize_gif_to_standard(self, gif_bytes: bytes) -> bytes:
+    def resize_gif_to_standard(self, gif_bytes: bytes, image: Optional["Image.Image"] = None,
+                               report: Optional[Dict[str, Any]] = None,
+                               render: Optional[Callable[[bytes], bytes]] = None) -> bytes:
         """
-        将GIF缩放为标准尺寸(32x16)
+        将GIF缩放为设备标准尺寸（默认32x16）
         
         缩放规则：
         1. 等比例缩放，保持宽高比（如32x32会缩放为16x16）
         2. 缩放后的空白区域，用原图四角像素的颜色填充
+        3. 帧间隔不短于设备最小帧间隔，颜色数不超过设备上限
+        4. 只保留设备帧数上限内的帧（不再解码其后的帧），丢弃的帧数记录警告
         
         Args:
             gif_bytes: 原始GIF文件的字节数据
+            image: 已由调用方打开的同一GIF图像（可选，避免重复解析）
+            report: 传入字典时填入 source_frames、frame_count、frames_dropped
+                （由GIF块结构统计，不解码像素）
+            render: 代替 render_resized 完成实际渲染的函数（可选，如交给渲染进程池）；
+                直通判断、结果缓存和统计仍在本缩放器中完成
             
         Returns:
             缩放后的GIF文件字节数据
@@ -50,33 +121,90 @@ class GIFResizer:
         if not gif_bytes or len(gif_bytes) == 0:
             raise ValueError("Empty GIF data")
         
+        # 帧数只读块结构统计；超出设备帧数上限的帧被丢弃
+        frame_report = self._frame_report(gif_bytes)
+        if report is not None:
+            report.update(frame_report)
+        
+        # 已是标准尺寸且满足调色板约束的GIF直接原样返回
+        if self._is_standard_gif(gif_bytes):
+            self.passthrough_count += 1
+            self.logger.info(f"GIF already {self.TARGET_WIDTH}x{self.TARGET_HEIGHT}, passing through unchanged")
+            return gif_bytes
+        
+        # 相同内容的GIF直接返回缓存的缩放结果
+        cache_key = (hashlib.sha256(gif_bytes).digest(), self.profile.name, self.TARGET_WIDTH, self.TARGET_HEIGHT)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self.logger.info(f"Resized GIF served from cache: {len(cached)} bytes")
+            return cached
+        
         try:
-            # 打开GIF文件
+            if render is not None:
+                result_bytes = render(gif_bytes)
+            else:
+                result_bytes = self.render_resized(gif_bytes, image)
+        except Exception as e:
+            self.logger.error(f"Failed to resize GIF: {str(e)}")
+            raise
+        
+        if frame_report["frames_dropped"]:
+            self.truncated_count += 1
+            self.logger.warning(f"GIF has {frame_report['source_frames']} frames, over the {self.profile.max_frames} frame limit "
+                                f"of device profile {self.profile.name}: dropping the last {frame_report['frames_dropped']} frames")
+        
+        self._cache.put(cache_key, result_bytes)
+        return result_bytes
+    
+    def render_resized(self, gif_bytes: bytes, image: Optional["Image.Image"] = None) -> bytes:
+        """
+        解码、缩放并重新编码GIF（不查缓存、不更新统计）
+        
+        resize_gif_to_standard 的实际渲染步骤；渲染进程池的任务直接调用它，
+        缓存和统计留在主进程的缩放器中
+        """
+        # 打开GIF文件（调用方已打开时直接复用）
+        if image is not None:
+            gif_image = image
+            gif_image.seek(0)
+        else:
             gif_image = Image.open(io.BytesIO(gif_bytes))
-            
-            # 获取原始尺寸
-            original_width, original_height = gif_image.size
-            self.logger.info(f"Original GIF size: {original_width}x{original_height}")
-            
-            # 计算等比例缩放尺寸
-            # 使用较小的缩放比例以保持宽高比
-            scale_w = self.TARGET_WIDTH / original_width
-            scale_h = self.TARGET_HEIGHT / original_height
-            scale = min(scale_w, scale_h)
-            
-            scaled_width = int(original_width * scale)
-            scaled_height = int(original_height * scale)
-            
-            self.logger.info(f"Scaled size (maintaining aspect ratio): {scaled_width}x{scaled_height}")
-            self.logger.info(f"Target size: {self.TARGET_WIDTH}x{self.TARGET_HEIGHT}")
-            
-            # 处理所有帧
-            resized_frames = []
-            durations = []
-            
-            frame_index = 0
-            try:
-                while True:
+            # 解码前检查尺寸、帧数和预计内存占用（调用方传入的图像已检查过）
+            image_guard.check_image(gif_image, "gif_resizer", gif_bytes)
+        
+        # 获取原始尺寸
+        original_width, original_height = gif_image.size
+        self.logger.info(f"Original GIF size: {original_width}x{original_height}")
+        
+        # 等比例缩放尺寸和居中位置（按设备配置文件预先计算并缓存）
+        # 使用较小的缩放比例以保持宽高比
+        scale_plan = self.profile.get_scale_plan(original_width, original_height)
+        scaled_width = scale_plan["scaled_width"]
+        scaled_height = scale_plan["scaled_height"]
+        paste_x = scale_plan["paste_x"]
+        paste_y = scale_plan["paste_y"]
+        
+        self.logger.info(f"Scaled size (maintaining aspect ratio): {scaled_width}x{scaled_height}")
+        self.logger.info(f"Target size: {self.TARGET_WIDTH}x{self.TARGET_HEIGHT}")
+        
+        # 处理所有帧
+        resized_frames = []
+        durations = []
+        
+        # 有NumPy时按批次把帧堆叠为(N, H, W, 3)数组，一次完成缩放和四角颜色填充
+        pending_frames = []
+        
+        max_frames = self.profile.max_frames
+        frame_index = 0
+        try:
+            while True:
+                if frame_batch.NUMPY_AVAILABLE:
+                    # 只取当前帧的RGB像素，缩放和填充留到整批处理
+                    pending_frames.append(gif_image.convert('RGB').tobytes())
+                    if len(pending_frames) >= self.BATCH_SIZE:
+                        resized_frames.extend(self._fit_frame_batch(pending_frames, original_width, original_height, scale_plan))
+                        pending_frames = []
+                else:
                     # 获取当前帧
                     frame = gif_image.copy()
                     
@@ -97,64 +225,207 @@ class GIFResizer:
                     # 创建目标尺寸的画布，用四角像素颜色填充
                     canvas = Image.new('RGB', (self.TARGET_WIDTH, self.TARGET_HEIGHT), fill_color)
                     
-                    # 计算居中位置
-                    paste_x = (self.TARGET_WIDTH - scaled_width) // 2
-                    paste_y = (self.TARGET_HEIGHT - scaled_height) // 2
-                    
                     # 将缩放后的帧粘贴到画布中心
                     canvas.paste(resized_frame, (paste_x, paste_y))
                     
-                    # 转换为调色板模式以优化GIF文件大小
-                    canvas_palette = canvas.quantize()
-                    
-                    resized_frames.append(canvas_palette)
-                    
-                    # 获取帧延迟时间
-                    duration = gif_image.info.get('duration', 100)
-                    durations.append(duration)
-                    
-                    frame_index += 1
-                    gif_image.seek(gif_image.tell() + 1)
-                    
-            except EOFError:
-                # 已处理完所有帧
-                pass
+                    # 先保留RGB画布，所有帧处理完后统一转换为调色板模式
+                    resized_frames.append(canvas)
+                
+                # 获取帧延迟时间（不短于设备最小帧间隔）
+                duration = gif_image.info.get('duration', 100)
+                durations.append(self.profile.clamp_duration(duration))
+                
+                frame_index += 1
+                if max_frames is not None and frame_index >= max_frames:
+                    # 达到设备帧数上限：后续帧不再解码（seek会解码经过的每一帧）
+                    break
+                gif_image.seek(gif_image.tell() + 1)
+                
+        except EOFError:
+            # 已处理完所有帧
+            pass
+        
+        if pending_frames:
+            resized_frames.extend(self._fit_frame_batch(pending_frames, original_width, original_height, scale_plan))
+        
+        self.logger.info(f"Processed {len(resized_frames)} frames")
+        
+        if len(resized_frames) > 0:
+            # 获取循环次数
+            loop = gif_image.info.get('loop', 0)
+            
+            result_bytes = self.encode_frames(resized_frames, durations, loop)
+            
+            self.logger.info(f"Resized GIF: {len(resized_frames)} frames, "
+                           f"size: {self.TARGET_WIDTH}x{self.TARGET_HEIGHT}, "
+                           f"output size: {len(result_bytes)} bytes")
+            
+            return result_bytes
+        else:
+            raise ValueError("No frames found in GIF")
+    
+    def _frame_report(self, gif_bytes: bytes) -> Dict[str, int]:
+        """源帧数（块结构统计）、保留的帧数和超出设备帧数上限被丢弃的帧数"""
+        source_frames = gif_blocks.count_frames(gif_bytes)
+        max_frames = self.profile.max_frames
+        frame_count = source_frames if max_frames is None else min(source_frames, max_frames)
+        return {"source_frames": source_frames, "frame_count": frame_count,
+                "frames_dropped": source_frames - frame_count}
+    
+    def _fit_frame_batch(self, frames: List[bytes], width: int, height: int, scale_plan: Dict[str, Any]) -> List["Image.Image"]:
+        """批量缩放一组RGB帧并填充到画布（NumPy），返回RGB画布图像"""
+        canvases = frame_batch.fit_frames_to_canvas(frames, width, height, scale_plan,
+                                                    self.TARGET_WIDTH, self.TARGET_HEIGHT)
+        return [Image.frombytes('RGB', (self.TARGET_WIDTH, self.TARGET_HEIGHT), canvas) for canvas in canvases]
+    
+    def encode_frames(self, frames: List["Image.Image"], durations: List[int], loop: int = 0) -> bytes:
+        """
+        将RGB帧量化并编码为符合设备配置文件的GIF
+        
+        所有帧共用一个调色板（颜色数不超过设备上限时完全保留原色），通过LUT查表映射；
+        设备有固定调色板时直接映射到该调色板。
+        超出设备文件大小限制时逐步减少颜色数重试。
+        
+        Args:
+            frames: 目标尺寸的RGB帧
+            durations: 每帧延迟（毫秒）
+            loop: 循环次数，0为无限循环
             
-            self.logger.info(f"Processed {len(resized_frames)} frames")
+        Returns:
+            GIF文件字节数据
+        """
+        profile = self.profile
+        color_steps = [colors for colors in self.COLOR_STEPS if colors < profile.max_colors]
+        color_steps.insert(0, profile.max_colors)
+        if profile.palette:
+            color_steps = [len(profile.palette)]
+        
+        result_bytes = b""
+        for max_colors in color_steps:
+            # 转换为调色板模式以优化GIF文件大小
+            palette_frames = color_quantizer.quantize_frames(frames, max_colors=max_colors, palette=profile.palette)
             
-            # 创建新的GIF
             output_buffer = io.BytesIO()
+            save_kwargs = {
+                'format': 'GIF',
+                'save_all': True,
+                'append_images': palette_frames[1:] if len(palette_frames) > 1 else [],
+                'duration': durations,
+                'loop': loop,
+                'optimize': False
+            }
+            palette_frames[0].save(output_buffer, **save_kwargs)
+            result_bytes = output_buffer.getvalue()
+            output_buffer.close()
             
-            if len(resized_frames) > 0:
-                # 获取循环次数
-                loop = gif_image.info.get('loop', 0)
-                
-                # 保存GIF
-                save_kwargs = {
-                    'format': 'GIF',
-                    'save_all': True,
-                    'append_images': resized_frames[1:] if len(resized_frames) > 1 else [],
-                    'duration': durations,
-                    'loop': loop,
-                    'optimize': False
-                }
-                
-                resized_frames[0].save(output_buffer, **save_kwargs)
-                
-                result_bytes = output_buffer.getvalue()
-                output_buffer.close()
-                
-                self.logger.info(f"Resized GIF: {len(resized_frames)} frames, "
-                               f"size: {self.TARGET_WIDTH}x{self.TARGET_HEIGHT}, "
-                               f"output size: {len(result_bytes)} bytes")
-                
+            if profile.max_file_bytes is None or len(result_bytes) <= profile.max_file_bytes:
                 return result_bytes
+            self.logger.info(f"GIF with {max_colors} colors is {len(result_bytes)} bytes, "
+                             f"over the {profile.name} limit of {profile.max_file_bytes} bytes")
+        
+        raise ValueError(f"GIF is {len(result_bytes)} bytes, exceeding the {profile.max_file_bytes} byte "
+                         f"limit of device profile {profile.name}")
+    
+    def _is_standard_gif(self, gif_bytes: bytes) -> bool:
+        """
+        判断GIF是否已符合设备配置文件的规格，可以不经解码直接发送
+        
+        只读取块结构，不解码像素：
+        1. 逻辑屏幕尺寸等于设备尺寸，文件大小不超过设备上限，设备没有固定调色板
+        2. 每一帧都有颜色表（全局或局部），颜色表大小不超过设备颜色数上限，且帧区域不超出画布
+        3. 第一帧覆盖整个画布且没有透明色；后续帧的透明色只用于叠加在上一帧之上
+           （上一帧未被清除为背景），不会露出背景
+           （缩放流程会把露出的背景填充为实色，直通时无法保持一致）
+        4. 帧数不超过设备和图像输入守卫的限制（超出时交给常规流程处理）
+        5. 帧延迟不短于设备最小帧间隔
+        
+        Args:
+            gif_bytes: 原始GIF文件的字节数据
+            
+        Returns:
+            是否可以原样返回
+        """
+        profile = self.profile
+        data = gif_bytes
+        length = len(data)
+        if length < 13 or data[:6] not in (b"GIF87a", b"GIF89a"):
+            return False
+        if profile.palette or (profile.max_file_bytes is not None and length > profile.max_file_bytes):
+            return False
+        
+        screen_width = data[6] | (data[7] << 8)
+        screen_height = data[8] | (data[9] << 8)
+        if (screen_width, screen_height) != (self.TARGET_WIDTH, self.TARGET_HEIGHT):
+            return False
+        
+        packed = data[10]
+        has_global_table = bool(packed & 0x80)
+        if has_global_table and 2 ** ((packed & 0x07) + 1) > profile.max_colors:
+            return False
+        
+        frame_limits = [image_guard.get_image_guard().get_limits("gif_resizer")["max_frames"], profile.max_frames]
+        frame_limits = [limit for limit in frame_limits if limit is not None]
+        max_frames = min(frame_limits) if frame_limits else None
+        frames = 0
+        transparent = False
+        disposal = 0
+        previous_disposal = 0
+        for block, pos in gif_blocks.iter_blocks(data):
+            if block == gif_blocks.IMAGE_DESCRIPTOR:
+                # 图像描述符：检查帧数、帧区域和颜色表
+                if max_frames is not None and frames >= max_frames:
+                    return False
+                if pos + 10 > length:
+                    return False
+                left = data[pos + 1] | (data[pos + 2] << 8)
+                top = data[pos + 3] | (data[pos + 4] << 8)
+                width = data[pos + 5] | (data[pos + 6] << 8)
+                height = data[pos + 7] | (data[pos + 8] << 8)
+                if left + width > screen_width or top + height > screen_height:
+                    return False
+                if frames == 0 and (transparent or (left, top, width, height) != (0, 0, screen_width, screen_height)):
+                    return False
+                if transparent and previous_disposal >= 2:
+                    return False
+                previous_disposal = disposal
+                transparent = False
+                disposal = 0
+                packed = data[pos + 9]
+                if packed & 0x80:
+                    if 2 ** ((packed & 0x07) + 1) > profile.max_colors:
+                        return False
+                elif not has_global_table:
+                    return False
+                frames += 1
+            elif block == gif_blocks.EXTENSION:
+                # 扩展块：记录图形控制扩展中的透明色标志和帧处置方式，检查帧延迟（单位10毫秒）
+                if pos + 1 < length and data[pos + 1] == 0xF9:
+                    if pos + 5 >= length:
+                        return False
+                    transparent = bool(data[pos + 3] & 0x01)
+                    disposal = (data[pos + 3] >> 2) & 0x07
+                    delay_ms = (data[pos + 4] | (data[pos + 5] << 8)) * 10
+                    if delay_ms < profile.min_frame_delay_ms:
+                        return False
+            elif block == gif_blocks.TRAILER:
+                # 文件结束符
+                return frames > 0
             else:
-                raise ValueError("No frames found in GIF")
-                
-        except Exception as e:
-            self.logger.error(f"Failed to resize GIF: {str(e)}")
-            raise
+                return False
+        
+        # 缺少文件结束符，视为不完整的GIF
+        return False
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取缩放结果缓存和直通统计"""
+        stats = self._cache.get_stats()
+        stats["passthrough_count"] = self.passthrough_count
+        stats["truncated_count"] = self.truncated_count
+        return stats
+    
+    def clear_cache(self):
+        """清空缩放结果缓存"""
+        self._cache.clear()
     
     def _extract_corner_colors(self, image: Image.Image) -> List[Tuple[int, int, int]]:
         """
@@ -228,28 +499,38 @@ class GIFResizer:
         return avg_color
 
 
-# 全局实例
-_gif_resizer = None
+# 全局实例（每个设备配置文件一个缩放器）
+_gif_resizers = {}
+_gif_resizers_lock = threading.Lock()
 
 
-def get_gif_resizer() -> GIFResizer:
-    """获取GIF缩放器单例"""
-    global _gif_resizer
-    if _gif_resizer is None:
-        _gif_resizer = GIFResizer()
-    return _gif_resizer
+def get_gif_resizer(profile: Optional["device_profiles.DeviceProfile"] = None) -> GIFResizer:
+    """获取设备配置文件对应的GIF缩放器单例（默认配置文件为32x16）"""
+    profile = profile or device_profiles.get_device_profile_registry().DEFAULT_PROFILE
+    key = profile.cache_key()
+    with _gif_resizers_lock:
+        resizer = _gif_resizers.get(key)
+        if resizer is None:
+            resizer = GIFResizer(profile=profile)
+            _gif_resizers[key] = resizer
+        return resizer
 
 
-def resize_gif_to_standard(gif_bytes: bytes) -> bytes:
+def resize_gif_to_standard(gif_bytes: bytes, image: Optional["Image.Image"] = None,
+                           profile: Optional["device_profiles.DeviceProfile"] = None,
+                           report: Optional[Dict[str, Any]] = None) -> bytes:
     """
-    便捷函数：将GIF缩放为标准尺寸(32x16)
+    便捷函数：将GIF缩放为设备标准尺寸（默认32x16）
     
     Args:
         gif_bytes: 原始GIF文件的字节数据
+        image: 已打开的同一GIF图像（可选）
+        profile: 设备配置文件（可选，默认32x16）
+        report: 传入字典时填入源帧数、保留帧数和丢弃帧数（可选）
         
     Returns:
         缩放后的GIF文件字节数据
     """
-    resizer = get_gif_resizer()
-    return resizer.resize_gif_to_standard(gif_bytes)
+    resizer = get_gif_resizer(profile)
+    return resizer.resize_gif_to_standard(gif_bytes, image=image, report=report)
 
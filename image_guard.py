@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Image Input Guard Module
+Rejects oversized image inputs before any pixel data is decoded
+
+Checks run on the header only:
+1. Width / height / pixel count from the image header
+2. Frame count, read from headers (GIF block walk) and capped at the limit
+3. Estimated decoded size (width x height x bands x frames)
+
+Limits are configured per method and can be overridden with the
+IMAGE_GUARD_LIMITS environment variable, e.g.
+IMAGE_GUARD_LIMITS='{"send_gif_animation": {"max_frames": 100}}'
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+# 导入GIF块结构读取模块
+try:
+    from . import gif_blocks
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import gif_blocks
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+class ImageGuard:
+    """Central pixel/frame/byte budget check for all image inputs"""
+
+    # Limits used for any method without its own entry
+    DEFAULT_LIMITS = {
+        "max_width": 4096,
+        "max_height": 4096,
+        "max_pixels": 16 * 1024 * 1024,
+        "max_frames": int(os.getenv("GIF_MAX_FRAMES", "200")),
+        "max_total_pixels": int(os.getenv("GIF_MAX_TOTAL_PIXELS", "50000000")),
+        "max_decoded_bytes": 256 * 1024 * 1024
+    }
+
+    # Per-method overrides of DEFAULT_LIMITS
+    METHOD_LIMITS = {
+        # Photos: large but single frame, JPEG draft decoding keeps the real cost low
+        "convert_image_to_pixels": {
+            "max_width": 12000,
+            "max_height": 12000,
+            "max_pixels": 48 * 1024 * 1024,
+            "max_frames": None,
+            "max_total_pixels": None,
+            "max_decoded_bytes": 192 * 1024 * 1024
+        },
+        "send_gif_animation": {
+            "max_width": 2048,
+            "max_height": 2048,
+            "max_pixels": 4 * 1024 * 1024,
+            "max_decoded_bytes": 128 * 1024 * 1024
+        },
+        "gif_resizer": {
+            "max_width": 2048,
+            "max_height": 2048,
+            "max_pixels": 4 * 1024 * 1024,
+            "max_decoded_bytes": 128 * 1024 * 1024
+        }
+    }
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._method_limits = {method: dict(limits) for method, limits in self.METHOD_LIMITS.items()}
+        self._load_env_overrides()
+
+    def _load_env_overrides(self):
+        """Apply per-method overrides from the IMAGE_GUARD_LIMITS environment variable"""
+        raw = os.getenv("IMAGE_GUARD_LIMITS")
+        if not raw:
+            return
+        try:
+            overrides = json.loads(raw)
+            for method, limits in overrides.items():
+                self.configure_limits(method, **limits)
+        except Exception as e:
+            self.logger.warning(f"Ignoring invalid IMAGE_GUARD_LIMITS: {str(e)}")
+
+    def configure_limits(self, method: str, **limits) -> Dict[str, Any]:
+        """
+        Override limits for one method
+
+        Args:
+            method: Method name, e.g. "send_gif_animation"
+            **limits: Any of the DEFAULT_LIMITS keys; None disables that check
+
+        Returns:
+            The effective limits for the method
+        """
+        unknown = set(limits) - set(self.DEFAULT_LIMITS)
+        if unknown:
+            raise ValueError(f"Unknown image guard limits: {sorted(unknown)}")
+        with self._lock:
+            self._method_limits.setdefault(method, {}).update(limits)
+        return self.get_limits(method)
+
+    def get_limits(self, method: Optional[str] = None) -> Dict[str, Any]:
+        """Return the effective limits for a method"""
+        limits = dict(self.DEFAULT_LIMITS)
+        with self._lock:
+            limits.update(self._method_limits.get(method, {}))
+        return limits
+
+    def check_image(self, image: "Image.Image", method: Optional[str] = None,
+                    data: Optional[bytes] = None) -> Dict[str, Any]:
+        """
+        Check an opened (header-only) PIL image against the method's limits
+
+        Args:
+            image: Image returned by Image.open, not yet loaded
+            method: Method name used to pick limits
+            data: Raw image bytes, used to count GIF frames without decoding
+
+        Returns:
+            Dict with width, height, frames and estimated_bytes
+
+        Raises:
+            ValueError: If any limit is exceeded
+        """
+        limits = self.get_limits(method)
+        width, height = image.size
+        pixels = width * height
+
+        if limits["max_width"] is not None and width > limits["max_width"]:
+            raise ValueError(f"Image width {width} exceeds limit of {limits['max_width']} for {method}")
+        if limits["max_height"] is not None and height > limits["max_height"]:
+            raise ValueError(f"Image height {height} exceeds limit of {limits['max_height']} for {method}")
+        if limits["max_pixels"] is not None and pixels > limits["max_pixels"]:
+            raise ValueError(f"Image size {width}x{height} exceeds pixel limit of {limits['max_pixels']} for {method}")
+
+        frames = self._count_frames(image, limits["max_frames"], data)
+        if limits["max_frames"] is not None and frames > limits["max_frames"]:
+            raise ValueError(f"Image has more than {limits['max_frames']} frames, limit for {method}")
+        if limits["max_total_pixels"] is not None and pixels * frames > limits["max_total_pixels"]:
+            raise ValueError(f"Image total pixels {pixels * frames} exceed limit of {limits['max_total_pixels']} for {method}")
+
+        # Only the frames that will actually be decoded count towards memory
+        decoded_frames = frames if limits["max_frames"] is not None else 1
+        estimated_bytes = pixels * len(image.getbands()) * decoded_frames
+        if limits["max_decoded_bytes"] is not None and estimated_bytes > limits["max_decoded_bytes"]:
+            raise ValueError(f"Image would decode to about {estimated_bytes} bytes, "
+                             f"exceeding limit of {limits['max_decoded_bytes']} for {method}")
+
+        return {
+            "width": width,
+            "height": height,
+            "frames": frames,
+            "estimated_bytes": estimated_bytes
+        }
+
+    def _count_frames(self, image: "Image.Image", max_frames: Optional[int],
+                      data: Optional[bytes] = None) -> int:
+        """
+        Count frames without decoding them, stopping one past max_frames
+
+        PIL's GIF seek() decodes every frame it passes (for disposal), so GIF
+        frames are counted by walking the block structure of the raw bytes.
+        Other formats report n_frames from their headers.
+        """
+        if max_frames is None:
+            return 1
+        if image.format == "GIF" and data is not None:
+            return gif_blocks.count_frames(data, stop_after=max_frames + 1)
+        return getattr(image, "n_frames", 1) if image.format != "GIF" else 1
+
+
+# Global instance
+_image_guard = None
+
+
+def get_image_guard() -> ImageGuard:
+    """Get the image guard singleton"""
+    global _image_guard
+    if _image_guard is None:
+        _image_guard = ImageGuard()
+    return _image_guard
+
+
+def check_image(image: "Image.Image", method: Optional[str] = None,
+                data: Optional[bytes] = None) -> Dict[str, Any]:
+    """
+    Convenience function: check an opened image's size, frame count and decoded size
+
+    Args:
+        image: PIL image with only the header parsed
+        method: Calling method name, used to pick limits
+        data: Raw image bytes (lets GIF frames be counted without decoding)
+
+    Returns:
+        Image dimensions, frame count and estimated decoded bytes
+    """
+    return get_image_guard().check_image(image, method, data)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IoT Explorer Stub Module
+Local stand-in for the Tencent Cloud IoT Explorer API, for offline tests and demos
+
+Speaks the same JSON-over-HTTP protocol as iotexplorer.tencentcloudapi.com
+(action in the X-TC-Action header, result wrapped in "Response"), so the
+real SDK client talks to it unchanged. Signatures are not checked.
+
+Point the service at it with:
+    IOT_EXPLORER_ENDPOINT=127.0.0.1:8765 IOT_EXPLORER_SCHEME=http
+
+Supported actions: CallDeviceActionAsync, PublishBroadcastMessage,
+ListEventHistory, GetDeviceList, DescribeDevice. Devices listed as acknowledging report
+the broadcast ack event (BROADCAST_ACK_EVENT_ID) when a broadcast or an
+action reaches them.
+
+Usage:
+    python iot_stub.py --port 8765 --product H3PI4FBTV5 --devices mug_001,mug_002 --offline mug_002
+"""
+
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Iterable, List, Optional
+
+
+class IoTStubServer:
+    """In-process fake IoT Explorer endpoint with simulated devices"""
+
+    def __init__(self, product_id: str, devices: Iterable[str], offline: Iterable[str] = (),
+                 silent: Iterable[str] = (), host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            product_id: Product the simulated devices belong to
+            devices: Device names
+            offline: Devices reported offline (they never acknowledge)
+            silent: Online devices that ignore broadcasts (but acknowledge direct actions)
+            host: Listen address
+            port: Listen port, 0 for any free port
+        """
+        self.product_id = product_id
+        self.devices = list(devices)
+        self.offline = set(offline)
+        self.silent = set(silent)
+        self.ack_event_id = os.getenv("BROADCAST_ACK_EVENT_ID", "display_ack")
+        self.calls: List[Dict[str, Any]] = []
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> "IoTStubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="iot-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, action: str) -> int:
+        """Number of requests received for an action"""
+        with self._lock:
+            return sum(1 for call in self.calls if call["action"] == action)
+
+    # ------------------------------------------------------------------
+    # Simulated API
+    # ------------------------------------------------------------------
+
+    def _ack(self, device_name: str, client_token: str):
+        self.events.append({
+            "TimeStamp": int(time.time()),
+            "ProductId": self.product_id,
+            "DeviceName": device_name,
+            "EventId": self.ack_event_id,
+            "Type": "info",
+            "Data": json.dumps({"client_token": client_token})
+        })
+
+    def _check_device(self, params: Dict[str, Any]):
+        if params.get("ProductId") != self.product_id or params.get("DeviceName") not in self.devices:
+            raise LookupError("ResourceNotFound.DeviceNotExist", "Device does not exist")
+
+    def CallDeviceActionAsync(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._check_device(params)
+        device_name = params["DeviceName"]
+        if device_name in self.offline:
+            raise LookupError("FailedOperation.DeviceOffline", "Device is offline")
+        client_token = str(uuid.uuid4())
+        self._ack(device_name, client_token)
+        return {"ClientToken": client_token, "Status": "Sent"}
+
+    def PublishBroadcastMessage(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if params.get("ProductId") != self.product_id:
+            raise LookupError("ResourceNotFound.ProductNotExist", "Product does not exist")
+        client_token = json.loads(params.get("Payload") or "{}").get("clientToken", "")
+        for device_name in self.devices:
+            if device_name not in self.offline and device_name not in self.silent:
+                self._ack(device_name, client_token)
+        return {"TaskId": int(time.time() * 1000)}
+
+    def ListEventHistory(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if params.get("ProductId") != self.product_id:
+            raise LookupError("ResourceNotFound.ProductNotExist", "Product does not exist")
+        matches = [
+            event for event in self.events
+            if (not params.get("DeviceName") or event["DeviceName"] == params["DeviceName"])
+            and (not params.get("EventId") or event["EventId"] == params["EventId"])
+            and params.get("StartTime", 0) <= event["TimeStamp"] <= params.get("EndTime", 2 ** 31)
+        ]
+        offset = int(params.get("Context") or 0)
+        size = int(params.get("Size") or 10)
+        page = matches[offset:offset + size]
+        return {
+            "Context": str(offset + len(page)),
+            "Total": len(matches),
+            "Listover": offset + len(page) >= len(matches),
+            "EventHistory": page
+        }
+
+    def _device_info(self, device_name: str) -> Dict[str, Any]:
+        # Status: 1 online, 2 offline
+        return {"DeviceName": device_name, "ProductId": self.product_id, "Status": 2 if device_name in self.offline else 1,
+                "LoginTime": int(time.time()), "Version": "1.0.0", "EnableState": 1}
+
+    def DescribeDevice(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._check_device(params)
+        return {"Device": self._device_info(params["DeviceName"])}
+
+    def GetDeviceList(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if params.get("ProductId") != self.product_id:
+            raise LookupError("ResourceNotFound.ProductNotExist", "Product does not exist")
+        offset = int(params.get("Offset") or 0)
+        limit = int(params.get("Limit") or 10)
+        page = self.devices[offset:offset + limit]
+        return {
+            "Total": len(self.devices),
+            "Devices": [self._device_info(name) for name in page]
+        }
+
+    def _dispatch(self, action: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        request_id = str(uuid.uuid4())
+        with self._lock:
+            self.calls.append({"action": action, "params": params})
+            handler = getattr(self, action, None) if action[:1].isupper() else None
+            try:
+                if handler is None:
+                    raise LookupError("InvalidAction", f"Action {action} is not supported by the stub")
+                result = handler(params)
+            except LookupError as e:
+                code, message = e.args
+                return {"Response": {"Error": {"Code": code, "Message": message}, "RequestId": request_id}}
+        return {"Response": dict(result, RequestId=request_id)}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                params = json.loads(self.rfile.read(length) or b"{}")
+                body = json.dumps(stub._dispatch(self.headers.get("X-TC-Action", ""), params)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local IoT Explorer stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--product", default="H3PI4FBTV5")
+    parser.add_argument("--devices", default="mug_001,mug_002,mug_003", help="Comma-separated device names")
+    parser.add_argument("--offline", default="", help="Comma-separated offline devices")
+    parser.add_argument("--silent", default="", help="Comma-separated devices ignoring broadcasts")
+    args = parser.parse_args()
+
+    split = lambda value: [item for item in value.split(",") if item]
+    stub = IoTStubServer(args.product, split(args.devices), split(args.offline), split(args.silent),
+                         host=args.host, port=args.port)
+    print(f"IoT Explorer stub listening on {stub.endpoint} (product {args.product})")
+    print(f"Use: IOT_EXPLORER_ENDPOINT={stub.endpoint} IOT_EXPLORER_SCHEME=http")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,12 +7,16 @@ Provides MCP interface for PixelMug IoT device control
 
 import json
 import asyncio
+import functools
+import multiprocessing
 import logging
 import time
 import os
 import datetime
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 from mug_service import mug_service
+import render_engine
 
 # 腾讯云IoT Explorer相关依赖
 try:
@@ -29,6 +33,10 @@ class MCPServer:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.setup_logging()
+        # 阻塞的服务调用（排队发送、广播、wait_for_completion 等）使用独立的有界线程池，
+        # 不占用 asyncio 默认线程池，避免慢请求耗尽线程后无法读写 stdio
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(os.getenv("MCP_HANDLER_THREADS", "32"))),
+                                            thread_name_prefix="mcp-handler")
         
     def setup_logging(self):
         """Configure logging"""
@@ -105,12 +113,36 @@ class MCPServer:
                 result = await self._handle_send_pixel_image(params)
             elif method == 'send_gif_animation':
                 result = await self._handle_send_gif_animation(params)
+            elif method == 'broadcast_pixel_image':
+                result = await self._handle_broadcast_pixel_image(params)
+            elif method == 'broadcast_gif_animation':
+                result = await self._handle_broadcast_gif_animation(params)
             elif method == 'convert_image_to_pixels':
                 result = await self._handle_convert_image_to_pixels(params)
             elif method == 'get_device_status':
                 result = await self._handle_get_device_status(params)
+            elif method == 'get_devices_status':
+                result = await self._handle_get_devices_status(params)
+            elif method == 'report_device_event':
+                result = await self._handle_report_device_event(params)
+            elif method == 'wait_for_completion':
+                result = await self._handle_wait_for_completion(params)
+            elif method == 'get_action_result':
+                result = await self._handle_get_action_result(params)
+            elif method == 'get_delivery_stats':
+                result = await self._handle_get_delivery_stats(params)
+            elif method == 'set_playlist':
+                result = await self._handle_set_playlist(params)
+            elif method == 'get_playlist':
+                result = await self._handle_get_playlist(params)
+            elif method == 'clear_playlist':
+                result = await self._handle_clear_playlist(params)
             elif method == 'send_display_text':
                 result = await self._handle_send_display_text(params)
+            elif method == 'get_device_profile':
+                result = await self._handle_get_device_profile(params)
+            elif method == 'get_asset_cache_stats':
+                result = await self._handle_get_asset_cache_stats(params)
             else:
                 return self._create_error_response(
                     request_id,
@@ -159,6 +191,10 @@ class MCPServer:
             self.logger.error(f"Error validating basic parameters: {str(e)}")
             return False
     
+    async def _run_blocking(self, fn, *args, **kwargs) -> Any:
+        """Run a blocking service call on a handler thread (MCP_HANDLER_THREADS) so other requests keep being served"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+    
     async def _handle_help(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Handle help request"""
         return mug_service.get_help()
@@ -200,7 +236,8 @@ class MCPServer:
         if not mug_service._authorize(user_id, product_id, device_name):
             raise ValueError("Device access denied")
         
-        return mug_service.send_pixel_image(product_id, device_name, image_data, target_width, target_height, use_direct_credentials=True)
+        # 在线程中等待设备命令队列，使并发请求可以合并同一设备的显示命令
+        return await self._run_blocking(mug_service.send_pixel_image, product_id, device_name, image_data, target_width, target_height, use_direct_credentials=True, offline_policy=params.get('offline_policy', 'ignore'))
     
     async def _handle_send_gif_animation(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Handle send_gif_animation request"""
@@ -224,7 +261,66 @@ class MCPServer:
         if not mug_service._authorize(user_id, product_id, device_name):
             raise ValueError("Device access denied")
         
-        return mug_service.send_gif_animation(product_id, device_name, gif_data, frame_delay, loop_count, target_width, target_height, use_direct_credentials=True)
+        # 在线程中等待设备命令队列，使并发请求可以合并同一设备的显示命令
+        return await self._run_blocking(mug_service.send_gif_animation, product_id, device_name, gif_data, frame_delay, loop_count, target_width, target_height, use_direct_credentials=True, offline_policy=params.get('offline_policy', 'ignore'))
+    
+    def _authorized_broadcast_targets(self, params: Dict[str, Any], data_param: str) -> Tuple[Optional[List[str]], Optional[List[str]]]:
+        """Validate common broadcast parameters and authorize every target device
+
+        Returns (device_names, product_device_names): the requested devices (None: every device
+        of the product) and, for product_broadcast, the product's device list already listed here
+        """
+        product_id = params.get('product_id')
+        device_names = params.get('device_names')
+        user_id = params.get('user_id', 'alaya_user')
+        
+        if not product_id:
+            raise ValueError("Missing required parameter: product_id")
+        if not params.get(data_param):
+            raise ValueError(f"Missing required parameter: {data_param}")
+        
+        if params.get('delivery') == 'product_broadcast':
+            # 产品广播到达该产品下的全部设备：只接受整个产品，并对全部设备授权
+            if device_names is not None:
+                raise ValueError("delivery=product_broadcast reaches every device of the product; omit device_names")
+            targets = product_device_names = mug_service._list_product_device_names(product_id)
+        else:
+            if not device_names or not isinstance(device_names, list):
+                raise ValueError("Missing required parameter: device_names (list of device names)")
+            targets = device_names
+            product_device_names = None
+        
+        # 简单授权验证（逐台设备）
+        for device_name in targets:
+            if not mug_service._authorize(user_id, product_id, device_name):
+                raise ValueError(f"Device access denied: {device_name}")
+        return device_names, product_device_names
+    
+    async def _handle_broadcast_pixel_image(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle broadcast_pixel_image request"""
+        # 产品设备列表与逐台下发都是阻塞网络调用，在线程中执行以免阻塞事件循环
+        device_names, product_device_names = await self._run_blocking(self._authorized_broadcast_targets, params, 'image_data')
+        return await self._run_blocking(
+            mug_service.broadcast_pixel_image,
+            params['product_id'], device_names, params['image_data'],
+            params.get('target_width', 16), params.get('target_height', 16),
+            params.get('use_cos', True), params.get('ttl_sec', 900), params.get('max_parallel'),
+            use_direct_credentials=True, delivery=params.get('delivery', 'per_device'),
+            product_device_names=product_device_names
+        )
+    
+    async def _handle_broadcast_gif_animation(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle broadcast_gif_animation request"""
+        device_names, product_device_names = await self._run_blocking(self._authorized_broadcast_targets, params, 'gif_data')
+        return await self._run_blocking(
+            mug_service.broadcast_gif_animation,
+            params['product_id'], device_names, params['gif_data'],
+            params.get('frame_delay', 100), params.get('loop_count', 0),
+            params.get('target_width', 16), params.get('target_height', 16),
+            params.get('use_cos', True), params.get('ttl_sec', 900), params.get('max_parallel'),
+            use_direct_credentials=True, delivery=params.get('delivery', 'per_device'),
+            product_device_names=product_device_names
+        )
     
     async def _handle_convert_image_to_pixels(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Handle convert_image_to_pixels request"""
@@ -235,8 +331,23 @@ class MCPServer:
         target_width = params.get('target_width', 16)
         target_height = params.get('target_height', 16)
         resize_method = params.get('resize_method', 'nearest')
+        max_colors = params.get('max_colors')
+        dither = params.get('dither', 'none')
+        output_format = params.get('output_format', 'matrix')
         
-        return mug_service.convert_image_to_pixels(image_data, target_width, target_height, resize_method)
+        # CPU-bound: runs in the render engine's worker pool (inline when disabled); waited for
+        # on a worker thread so concurrent requests overlap instead of queueing on the event loop
+        result = await self._run_blocking(render_engine.get_render_engine().convert_image, image_data, target_width,
+                                          target_height, resize_method, max_colors, dither, output_format)
+        
+        # send_pixel_image usually follows: pre-render it in the background (SPECULATIVE_RENDER);
+        # pre-uploading to the device's COS prefix needs the same authorization as a send
+        product_id = params.get('product_id')
+        device_name = params.get('device_name')
+        if product_id and device_name and not mug_service._authorize(params.get('user_id', 'alaya_user'), product_id, device_name):
+            device_name = None
+        mug_service.speculate_pixel_image(image_data, result, target_width, target_height, product_id, device_name)
+        return result
     
     async def _handle_get_device_status(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Handle get_device_status request"""
@@ -253,7 +364,35 @@ class MCPServer:
         if not mug_service._authorize(user_id, product_id, device_name):
             raise ValueError("Device access denied")
         
-        return mug_service.get_device_status(product_id, device_name, use_direct_credentials=True)
+        return await self._run_blocking(mug_service.get_device_status, product_id, device_name, use_direct_credentials=True)
+    
+    async def _handle_get_devices_status(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle get_devices_status request"""
+        product_id = params.get("product_id")
+        device_names = params.get("device_names")
+        user_id = params.get('user_id', 'alaya_user')
+        
+        if not product_id:
+            raise ValueError("Missing required parameter: product_id")
+        if device_names is not None:
+            if not isinstance(device_names, list):
+                raise ValueError("device_names must be a list of device names")
+            # 简单授权验证（逐台设备）
+            for device_name in device_names:
+                if not mug_service._authorize(user_id, product_id, device_name):
+                    raise ValueError(f"Device access denied: {device_name}")
+        
+        # 可能按批查询 DescribeDevice，在线程中执行以免阻塞事件循环
+        return await self._run_blocking(mug_service.get_devices_status, product_id, device_names,
+                                        params.get("max_age_sec"), use_direct_credentials=True)
+    
+    async def _handle_get_device_profile(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle get_device_profile request"""
+        return mug_service.get_device_profile(params.get('product_id'))
+    
+    async def _handle_get_asset_cache_stats(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle get_asset_cache_stats request"""
+        return mug_service.get_asset_cache_stats()
     
     async def _handle_send_display_text(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Handle send_display_text request"""
@@ -275,7 +414,90 @@ class MCPServer:
         if not mug_service._authorize(user_id, product_id, device_name):
             raise ValueError("Device access denied")
         
-        return mug_service.send_display_text(product_id, device_name, text, use_direct_credentials=True)
+        # 在线程中等待设备命令队列，使并发请求可以合并同一设备的显示命令
+        return await self._run_blocking(mug_service.send_display_text, product_id, device_name, text, use_direct_credentials=True, offline_policy=params.get('offline_policy', 'ignore'))
+    
+    async def _handle_report_device_event(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle report_device_event request"""
+        product_id = params.get('product_id')
+        device_name = params.get('device_name')
+        event = params.get('event')
+        
+        if not product_id:
+            raise ValueError("Missing required parameter: product_id")
+        if not device_name:
+            raise ValueError("Missing required parameter: device_name")
+        if not event:
+            raise ValueError("Missing required parameter: event")
+        
+        return mug_service.handle_device_event(product_id, device_name, event, params.get('data'))
+    
+    async def _handle_wait_for_completion(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle wait_for_completion request"""
+        client_tokens = params.get('client_tokens')
+        if client_tokens is None and params.get('client_token'):
+            client_tokens = [params['client_token']]
+        if not client_tokens:
+            raise ValueError("Missing required parameter: client_tokens")
+        
+        # 等待在线程中进行，不阻塞其他请求
+        return await self._run_blocking(mug_service.wait_for_completion, client_tokens, params.get('timeout_sec', 30))
+    
+    async def _handle_get_action_result(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle get_action_result request"""
+        client_token = params.get('client_token')
+        if not client_token:
+            raise ValueError("Missing required parameter: client_token")
+        
+        return mug_service.get_action_result(client_token)
+    
+    async def _handle_set_playlist(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle set_playlist request"""
+        product_id = params.get('product_id')
+        device_name = params.get('device_name')
+        user_id = params.get('user_id', 'alaya_user')
+        
+        if not product_id:
+            raise ValueError("Missing required parameter: product_id")
+        if not device_name:
+            raise ValueError("Missing required parameter: device_name")
+        if not params.get('items'):
+            raise ValueError("Missing required parameter: items")
+        
+        # 简单授权验证
+        if not mug_service._authorize(user_id, product_id, device_name):
+            raise ValueError("Device access denied")
+        
+        return mug_service.set_playlist(product_id, device_name, params['items'],
+                                        params.get('loop', True), params.get('start_delay_sec', 0))
+    
+    async def _handle_get_playlist(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle get_playlist request"""
+        product_id = params.get('product_id')
+        if not product_id:
+            raise ValueError("Missing required parameter: product_id")
+        
+        return mug_service.get_playlist(product_id, params.get('device_name'))
+    
+    async def _handle_clear_playlist(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle clear_playlist request"""
+        product_id = params.get('product_id')
+        device_name = params.get('device_name')
+        user_id = params.get('user_id', 'alaya_user')
+        
+        if not product_id:
+            raise ValueError("Missing required parameter: product_id")
+        if not device_name:
+            raise ValueError("Missing required parameter: device_name")
+        
+        if not mug_service._authorize(user_id, product_id, device_name):
+            raise ValueError("Device access denied")
+        
+        return mug_service.clear_playlist(product_id, device_name)
+    
+    async def _handle_get_delivery_stats(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Handle get_delivery_stats request"""
+        return mug_service.get_delivery_stats(params.get('product_id'))
     
     def _create_success_response(self, request_id: Any, result: Any) -> str:
         """Create success response"""
@@ -311,40 +533,20 @@ async def query_device_status_from_tencent_iot(product_id: str, device_name: str
         dict: Device status information
     """
     try:
-        if not IOT_EXPLORER_AVAILABLE:
-            raise Exception("Tencent Cloud IoT Explorer SDK not available")
-        
-        # 获取 STS 临时凭证
-        sts_result = mug_service.issue_sts(product_id, device_name)
-        
-        # 创建临时凭证对象
-        sts_credentials = credential.Credential(
-            sts_result["tmpSecretId"],
-            sts_result["tmpSecretKey"],
-            sts_result["token"]
-        )
-        
-        # 创建 IoT Explorer 客户端
-        iot_client = iotexplorer_client.IotExplorerClient(
-            credential=sts_credentials,
-            region=os.getenv("DEFAULT_REGION", "ap-guangzhou")
-        )
-        
-        # 调用 DescribeDevice 接口查询设备信息
-        req = models.DescribeDeviceRequest()
-        req.ProductId = product_id
-        req.DeviceName = device_name
-        
-        resp = iot_client.DescribeDevice(req)
+        # 通过共享的在线状态缓存批量查询（不再为每次查询执行 AssumeRole）
+        result = mug_service.get_devices_status(product_id, [device_name], use_direct_credentials=True)
+        if not result["devices"]:
+            raise ValueError(f"Device {product_id}/{device_name} not found")
+        device = result["devices"][0]
         
         # 解析响应并返回设备状态
         return {
-            "is_online": resp.DeviceInfo.OnlineStatus == 1,  # 1表示在线，0表示离线
-            "last_seen": int(resp.DeviceInfo.LastOnlineTime) if resp.DeviceInfo.LastOnlineTime else 0,
-            "connection_status": "connected" if resp.DeviceInfo.OnlineStatus == 1 else "disconnected",
-            "ip_address": getattr(resp.DeviceInfo, 'IpAddress', None),
-            "signal_strength": getattr(resp.DeviceInfo, 'SignalStrength', None),
-            "battery_level": getattr(resp.DeviceInfo, 'BatteryLevel', None)
+            "is_online": device["online"],
+            "last_seen": int(device["login_time"]) if device.get("login_time") else 0,
+            "connection_status": "connected" if device["online"] else "disconnected",
+            "ip_address": None,
+            "signal_strength": None,
+            "battery_level": None
         }
         
     except Exception as e:
@@ -365,7 +567,7 @@ async def run_server():
     server = MCPServer()
     
     print("MCP PixelMug server started, waiting for requests...")
-    print("Supported methods: help, issue_sts, send_pixel_image, send_gif_animation, convert_image_to_pixels, get_device_status, send_display_text")
+    print("Supported methods: help, issue_sts, send_pixel_image, send_gif_animation, convert_image_to_pixels, get_device_status, send_display_text, get_device_profile, get_asset_cache_stats, broadcast_pixel_image, broadcast_gif_animation, get_devices_status, report_device_event, wait_for_completion, get_action_result, get_delivery_stats, set_playlist, get_playlist, clear_playlist")
     print("Press Ctrl+C to exit")
     
     try:
@@ -393,4 +595,6 @@ async def run_server():
 
 
 if __name__ == "__main__":
+    # Frozen (PyInstaller) builds: spawned render workers must not re-run the server
+    multiprocessing.freeze_support()
     asyncio.run(run_server())
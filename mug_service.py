@@ -14,8 +14,12 @@ import re
 import io
 import os
 import hashlib
+import time
+import email.utils
 import threading
-from typing import Dict, Any, Optional, Union, List, Tuple
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Union, List, Tuple, Iterable, Iterator
 
 # 导入颜色生成器模块
 try:
@@ -31,6 +35,104 @@ except ImportError:
     # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
     import gif_resizer
 
+# 导入批量帧缩放模块
+try:
+    from . import frame_batch
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import frame_batch
+
+# 导入设备配置文件模块
+try:
+    from . import device_profiles
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import device_profiles
+
+# 导入渲染引擎模块（进程池）
+try:
+    from . import render_engine
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import render_engine
+
+# 导入渲染结果缓存模块
+try:
+    from . import asset_cache
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import asset_cache
+
+# 导入按字节预算的LRU缓存
+try:
+    from .byte_lru import ByteBudgetLRU
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    from byte_lru import ByteBudgetLRU
+
+# 导入COS素材本地索引模块
+try:
+    from . import cos_asset_index
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import cos_asset_index
+
+# 导入命令步骤依赖图模块
+try:
+    from . import task_graph
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import task_graph
+
+# 导入预渲染推测执行模块
+try:
+    from . import speculation
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import speculation
+
+# 导入设备在线状态缓存模块
+try:
+    from . import device_presence
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import device_presence
+
+# 导入设备命令队列模块
+try:
+    from . import command_queue
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import command_queue
+
+# 导入设备动作完成跟踪模块
+try:
+    from . import completion_tracker
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import completion_tracker
+
+# 导入播放列表调度模块
+try:
+    from . import playlist_scheduler
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import playlist_scheduler
+
+# 导入颜色量化模块
+try:
+    from . import color_quantizer
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import color_quantizer
+
+# 导入图像输入守卫模块
+try:
+    from . import image_guard
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import image_guard
+
 # 腾讯云STS相关依赖
 try:
     from tencentcloud.common import credential
@@ -51,12 +153,13 @@ except ImportError:
 # 腾讯云COS相关依赖
 try:
     from qcloud_cos import CosConfig, CosS3Client
+    from qcloud_cos.cos_exception import CosServiceError
     COS_AVAILABLE = True
 except ImportError:
     COS_AVAILABLE = False
 
 try:
-    from PIL import Image
+    from PIL import Image, ImageSequence
     PIL_AVAILABLE = True
 except ImportError:
     PIL_AVAILABLE = False
@@ -67,16 +170,47 @@ class MugService:
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # 已签名的COS下载URL缓存: (secret_id, bucket, key) -> (url, expires_at)
+        self._signed_url_cache = ByteBudgetLRU(1024 * 1024, max_entries=self.SIGNED_URL_CACHE_ENTRIES,
+                                               sizeof=lambda entry: len(entry[0]))
+        # 设备离线时暂存的发送: (product_id, device_name) -> (replay, deferred_at)，每台设备只保留最新一条
+        self._deferred_sends: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+        self._deferred_lock = threading.Lock()
+    
+    # 设备文件名长度上限与内容派生文件名的字符集
+    SHORT_NAME_LENGTH = 6
+    SHORT_NAME_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+    # 同名不同内容时最多尝试的候选名个数
+    COS_NAME_ATTEMPTS = 4
+    # 签名URL缓存条目上限；剩余有效期低于此比例（至少60秒）时重新签名
+    SIGNED_URL_CACHE_ENTRIES = 1024
+    SIGNED_URL_REFRESH_RATIO = 0.1
     
-    def _generate_short_filename(self) -> str:
+    def _generate_short_filename(self, asset_data: Optional[bytes] = None, attempt: int = 0) -> str:
         """
         生成短文件名（不超过6字节）
         
-        使用线程ID和timestamp作为因子，通过hash算法生成短文件名
+        传入素材内容时由内容的SHA-256派生（相同素材得到相同文件名，可跳过重复上传）；
+        attempt 用于同名不同内容时顺延到下一个候选名。未传入内容时使用线程ID和timestamp生成
+        
+        Args:
+            asset_data: 素材内容（可选）
+            attempt: 候选序号，0为首选
         
         Returns:
-            不超过6个字符的文件名（只包含字母和数字）
+            不超过6个字符的文件名（只包含小写字母和数字）
         """
+        if asset_data is not None:
+            # SHA-256转为36进制，按顺序取6个字符一段作为候选名（6位36进制约31位熵）
+            digest = int(hashlib.sha256(asset_data).hexdigest(), 16)
+            digits = []
+            while digest:
+                digest, remainder = divmod(digest, 36)
+                digits.append(self.SHORT_NAME_ALPHABET[remainder])
+            encoded = "".join(digits)
+            start = (attempt * self.SHORT_NAME_LENGTH) % (len(encoded) - self.SHORT_NAME_LENGTH + 1)
+            return encoded[start:start + self.SHORT_NAME_LENGTH]
+        
         # 获取当前线程ID
         thread_id = threading.get_ident()
         # 获取当前时间戳
@@ -91,6 +225,51 @@ class MugService:
         short_name = hash_hex[:6]
         
         return short_name
+    
+    def _get_cos_download_url(self, cos_client, secret_id: str, bucket_name: str, key: str,
+                              ttl_sec: int) -> Tuple[str, int]:
+        """
+        Get a download URL for a COS object and the unix time it stops working
+        
+        Signed URLs (HMAC computed locally by the SDK, no network call) are cached per
+        key and reused until shortly before they expire. With COS_SIGNED_URLS=false the
+        plain object URL of a public-read bucket is returned.
+        """
+        now = time.time()
+        if os.getenv("COS_SIGNED_URLS", "true").lower() in ("false", "0", "no"):
+            return cos_client.get_object_url(Bucket=bucket_name, Key=key), int(now + ttl_sec)
+        
+        cache_key = (secret_id, bucket_name, key)
+        cached = self._signed_url_cache.get(cache_key)
+        if cached is not None:
+            url, expires_at = cached
+            if expires_at - now > max(60, ttl_sec * self.SIGNED_URL_REFRESH_RATIO):
+                return url, expires_at
+        
+        url = cos_client.get_presigned_url(Bucket=bucket_name, Key=key, Method="GET", Expired=ttl_sec)
+        expires_at = int(now + ttl_sec)
+        self._signed_url_cache.put(cache_key, (url, expires_at))
+        return url, expires_at
+    
+    def _head_cos_object(self, cos_client, bucket_name: str, key: str) -> Optional[Dict[str, str]]:
+        """Return the headers of an existing COS object (lower-cased names), or None if it does not exist"""
+        try:
+            headers = cos_client.head_object(Bucket=bucket_name, Key=key)
+        except CosServiceError as e:
+            if e.get_status_code() == 404:
+                return None
+            raise
+        return {name.lower(): value for name, value in headers.items()}
+        
+    @staticmethod
+    def _parse_http_date(value: Optional[str]) -> Optional[float]:
+        """Parse an HTTP date header (e.g. Last-Modified) into a Unix time, None if absent or invalid"""
+        if not value:
+            return None
+        try:
+            return email.utils.parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            return None
         
     def get_help(self) -> Dict[str, Any]:
         """Return service help information"""
@@ -118,11 +297,12 @@ class MugService:
                     "params": {
                         "product_id": "Product ID",
                         "device_name": "Device name",
-                        "image_data": "Base64 encoded image or pixel matrix",
+                        "image_data": "Base64 encoded image, pixel matrix, palette format or packed rgb888/rgb565 result of convert_image_to_pixels",
                         "target_width": "Target width (optional, default: 16)",
                         "target_height": "Target height (optional, default: 16)",
                         "use_cos": "Enable COS upload (optional, default: True)",
-                        "ttl_sec": "COS signed URL TTL in seconds (optional, default: 900)"
+                        "ttl_sec": "COS signed URL TTL in seconds (optional, default: 900)",
+                        "offline_policy": "ignore (default), fail or defer: what to do when the device is known to be offline; checked before rendering or upload, defer replays the latest send when the device comes online"
                     }
                 },
                 {
@@ -138,7 +318,40 @@ class MugService:
                         "target_height": "Target height (optional, default: 16)",
                         "use_cos": "Enable COS upload (optional, default: True)",
                         "ttl_sec": "COS signed URL TTL in seconds (optional, default: 900)",
-                        "sta_port": "Port for device communication (optional, default: 80)"
+                        "sta_port": "Port for device communication (optional, default: 80)",
+                        "offline_policy": "ignore (default), fail or defer: what to do when the device is known to be offline; checked before rendering or upload, defer replays the latest send when the device comes online"
+                    }
+                },
+                {
+                    "name": "broadcast_pixel_image",
+                    "description": "Send the same pixel image to many devices of a product: rendered and uploaded once, then sent to each device in parallel",
+                    "params": {
+                        "product_id": "Product ID",
+                        "device_names": "List of device names (must be omitted with delivery=product_broadcast)",
+                        "image_data": "Same formats as send_pixel_image",
+                        "target_width": "Target width (optional, default: 16)",
+                        "target_height": "Target height (optional, default: 16)",
+                        "use_cos": "Enable COS upload (optional, default: True)",
+                        "ttl_sec": "COS signed URL TTL in seconds (optional, default: 900)",
+                        "max_parallel": "Concurrent device calls (optional, default: 16)",
+                        "delivery": "per_device (default) or opt-in product_broadcast: one PublishBroadcastMessage to every device of the product (device_names must be omitted), per-device calls for devices that do not acknowledge; needs firmware reporting the display_ack event, otherwise every device waits BROADCAST_ACK_TIMEOUT_SEC before its per-device send"
+                    }
+                },
+                {
+                    "name": "broadcast_gif_animation",
+                    "description": "Send the same GIF animation to many devices of a product: rendered and uploaded once, then sent to each device in parallel",
+                    "params": {
+                        "product_id": "Product ID",
+                        "device_names": "List of device names (must be omitted with delivery=product_broadcast)",
+                        "gif_data": "Same formats as send_gif_animation",
+                        "frame_delay": "Delay between frames in ms (optional, default: 100)",
+                        "loop_count": "Number of loops (optional, default: 0 for infinite)",
+                        "target_width": "Target width (optional, default: 16)",
+                        "target_height": "Target height (optional, default: 16)",
+                        "use_cos": "Enable COS upload (optional, default: True)",
+                        "ttl_sec": "COS signed URL TTL in seconds (optional, default: 900)",
+                        "max_parallel": "Concurrent device calls (optional, default: 16)",
+                        "delivery": "per_device (default) or opt-in product_broadcast: one PublishBroadcastMessage to every device of the product (device_names must be omitted), per-device calls for devices that do not acknowledge; needs firmware reporting the display_ack event, otherwise every device waits BROADCAST_ACK_TIMEOUT_SEC before its per-device send"
                     }
                 },
                 {
@@ -148,7 +361,12 @@ class MugService:
                         "image_data": "Base64 encoded image (PNG/JPEG)",
                         "target_width": "Target width for pixel matrix (optional, default: 16)",
                         "target_height": "Target height for pixel matrix (optional, default: 16)",
-                        "resize_method": "Resize method: nearest/bilinear/bicubic (optional, default: nearest)"
+                        "resize_method": "Resize method: nearest/bilinear/bicubic/area (optional, default: nearest)",
+                        "max_colors": "Reduce to at most this many colors, 1-256 (optional, default: no reduction)",
+                        "dither": "Dithering when reducing colors: none/floyd-steinberg/ordered (optional, default: none)",
+                        "output_format": "Result encoding: matrix/palette/rgb888/rgb565 (optional, default: matrix); palette and rgb results can be passed back to send_pixel_image as image_data",
+                        "product_id": "Product ID the image will be sent to (optional, used by speculative pre-render)",
+                        "device_name": "Device name the image will be sent to (optional, speculative pre-render also pre-uploads to COS)"
                     }
                 },
                 {
@@ -159,13 +377,94 @@ class MugService:
                         "device_name": "Device name, e.g.: mug_001"
                     }
                 },
+                {
+                    "name": "get_devices_status",
+                    "description": "Query online status of many devices of a product with a few batched IoT calls, served from a shared TTL cache when fresh",
+                    "params": {
+                        "product_id": "Product ID, e.g.: ABC123DEF",
+                        "device_names": "List of device names (optional, default: every device of the product)",
+                        "max_age_sec": "Accept cached states at most this old in seconds (optional, 0 forces a refresh)"
+                    }
+                },
+                {
+                    "name": "get_device_profile",
+                    "description": "Get the display profile (resolution, max colors, max file size, frame limits) used for a product",
+                    "params": {
+                        "product_id": "Product ID (optional, default profile when omitted or unknown)"
+                    }
+                },
+                {
+                    "name": "get_asset_cache_stats",
+                    "description": "Get hit/miss counters and tier sizes of the rendered-asset cache, plus speculative pre-render counters and hit rate and device command queue counters",
+                    "params": {}
+                },
                 {
                     "name": "send_display_text",
                     "description": "Send text to display on smart mug screen via CallDeviceActionAsync",
                     "params": {
                         "product_id": "Product ID, e.g.: H3PI4FBTV5",
                         "device_name": "Device name, e.g.: mug_001",
-                        "text": "Text to display (0-200 characters, empty string allowed)"
+                        "text": "Text to display (0-200 characters, empty string allowed)",
+                        "offline_policy": "ignore (default), fail or defer: what to do when the device is known to be offline; checked before rendering or upload, defer replays the latest send when the device comes online"
+                    }
+                },
+                {
+                    "name": "report_device_event",
+                    "description": "Feed a device event forwarded from IoT Explorer into the presence cache: online/offline set the state, other events invalidate it",
+                    "params": {
+                        "product_id": "Product ID",
+                        "device_name": "Device name",
+                        "event": "online, offline or any other device event ID",
+                        "data": "Event data (optional); an acknowledgement carrying a client_token completes that action"
+                    }
+                },
+                {
+                    "name": "wait_for_completion",
+                    "description": "Wait until devices confirm actions sent by send_* / broadcast_* (acknowledgement events, polled in batches per product; requires COMPLETION_TRACKING=true)",
+                    "params": {
+                        "client_tokens": "List of client_token values returned by the sends",
+                        "timeout_sec": "Longest wait in seconds (optional, default: 30)"
+                    }
+                },
+                {
+                    "name": "get_action_result",
+                    "description": "Get the completion state of one action: pending, completed (with end-to-end latency_ms) or timeout",
+                    "params": {
+                        "client_token": "client_token returned by the send"
+                    }
+                },
+                {
+                    "name": "get_delivery_stats",
+                    "description": "Get completion counters and per-device end-to-end delivery latency (avg/p50/p95/max)",
+                    "params": {
+                        "product_id": "Only devices of this product (optional)"
+                    }
+                },
+                {
+                    "name": "set_playlist",
+                    "description": "Rotate content on a device server-side: each item is pushed when its slot comes due, reusing cached renders and COS URLs",
+                    "params": {
+                        "product_id": "Product ID",
+                        "device_name": "Device name",
+                        "items": "List of {method: send_pixel_image/send_gif_animation/send_display_text, params: {...}, duration_sec}",
+                        "loop": "Start over after the last item (optional, default: True)",
+                        "start_delay_sec": "Delay before the first item (optional, default: 0)"
+                    }
+                },
+                {
+                    "name": "get_playlist",
+                    "description": "Get a device's playlist position and push counters, or scheduler-wide counters without device_name",
+                    "params": {
+                        "product_id": "Product ID",
+                        "device_name": "Device name (optional)"
+                    }
+                },
+                {
+                    "name": "clear_playlist",
+                    "description": "Stop and remove a device's playlist",
+                    "params": {
+                        "product_id": "Product ID",
+                        "device_name": "Device name"
                     }
                 }
             ],
@@ -473,7 +772,9 @@ class MugService:
             
             # Configure HTTP and Client Profile
             httpProfile = HttpProfile()
-            httpProfile.endpoint = "iotexplorer.tencentcloudapi.com"
+            # Endpoint/scheme can point at a local stand-in (see iot_stub.py) for offline testing
+            httpProfile.endpoint = os.getenv("IOT_EXPLORER_ENDPOINT", "iotexplorer.tencentcloudapi.com")
+            httpProfile.scheme = os.getenv("IOT_EXPLORER_SCHEME", "https")
             
             clientProfile = ClientProfile()
             clientProfile.httpProfile = httpProfile
@@ -490,7 +791,8 @@ class MugService:
 
     def _push_asset_to_cos(self, product_id: str, device_name: str, asset_data: bytes, 
                           asset_kind: str, file_name: str, metadata: Dict[str, Any], 
-                          ttl_sec: int = 300, use_direct_credentials: bool = True) -> Dict[str, Any]:
+                          ttl_sec: int = 300, use_direct_credentials: bool = True,
+                          key_prefix: Optional[str] = None) -> Dict[str, Any]:
         """Push asset to COS and get signed URL with proper key pattern and metadata
         
         Args:
@@ -502,6 +804,7 @@ class MugService:
             metadata: Asset metadata
             ttl_sec: TTL in seconds
             use_direct_credentials: Use direct credentials flag
+            key_prefix: COS key prefix (default: device_name), e.g. a shared prefix for broadcasts
             
         Returns:
             Dict containing key, url, file_name (with extension), and other asset info
@@ -547,16 +850,76 @@ class MugService:
             else:
                 ext = "json"
             
-            # Key pattern: pmug/{deviceName}/{YYYYMM}/{file_name}-{sha8}.{ext}
-            # file_name is passed from external, ensuring uniqueness
-            key = f"{device_name}/{file_name}.{ext}"
+            # 4. Set Content-Type based on asset kind
+            content_type = "application/vnd.pmug.pixel+json" if asset_kind == "pixel-json" else "image/gif"
+            bucket_name = os.getenv("COS_BUCKET_NAME", "pixelmug-assets")
+            
+            key_prefix = key_prefix or device_name
+            
+            # The local index knows assets uploaded earlier (including before a restart)
+            # without a HEAD round trip
+            asset_index = cos_asset_index.get_cos_asset_index()
+            profile_name = device_profiles.get_profile(product_id).name
+            indexed = asset_index.lookup(bucket_name, key_prefix, sha256, profile_name) if asset_index else None
+            if indexed is not None and indexed["expired"]:
+                # The bucket lifecycle may have deleted the object: check it again below
+                self.logger.info(f"COS asset index entry for {sha8} is stale: {indexed['key']}, checking COS")
+                asset_index.forget(bucket_name, indexed["key"])
+                indexed = None
+            if indexed is not None:
+                self.logger.info(f"COS asset index hit for {sha8}: {indexed['key']}, skipping upload")
+                download_url, expires_at = self._get_cos_download_url(cos_client, cred.secret_id, bucket_name,
+                                                                      indexed["key"], ttl_sec)
+                return {
+                    "key": indexed["key"],
+                    "sha256": sha256,
+                    "sha8": sha8,
+                    "file_name": indexed["key"].rsplit("/", 1)[-1],
+                    "uploaded": False,
+                    "uploaded_bytes": 0,
+                    "index_hit": True,
+                    "url": download_url,
+                    "bytes": len(asset_data),
+                    "width": metadata.get("width", 0),
+                    "height": metadata.get("height", 0),
+                    "frames": metadata.get("frame_count", 1),
+                    "expiresAt": expires_at,
+                    "contentType": content_type
+                }
+            
+            # Key pattern: {key_prefix}/{file_name}.{ext}, the prefix being the device name by default
+            # Content-derived names map identical assets to the same key; an existing
+            # object with the same SHA-256 is reused instead of uploaded again
+            content_named = file_name == self._generate_short_filename(asset_data)
+            uploaded = True
+            uploaded_at = None
+            for attempt in range(self.COS_NAME_ATTEMPTS):
+                if attempt:
+                    file_name = self._generate_short_filename(asset_data, attempt)
+                key = f"{key_prefix}/{file_name}.{ext}"
+                existing = self._head_cos_object(cos_client, bucket_name, key)
+                if existing is None:
+                    break
+                if existing.get("x-cos-meta-sha256") == sha256:
+                    uploaded_at = self._parse_http_date(existing.get("last-modified"))
+                    if asset_index and uploaded_at is not None and uploaded_at < time.time() - asset_index.retention_sec:
+                        # Close to its lifecycle expiry: upload again to restart its age
+                        self.logger.info(f"COS object {key} holds this asset but is past index retention, uploading again")
+                        uploaded_at = None
+                        break
+                    uploaded = False
+                    self.logger.info(f"COS object {key} already holds this asset, skipping upload")
+                    break
+                if not content_named:
+                    # Caller-chosen name: overwrite as before
+                    break
+                self.logger.info(f"COS key {key} holds a different asset, trying next content-derived name")
+            else:
+                raise ValueError(f"No free content-derived COS name for asset {sha8} after {self.COS_NAME_ATTEMPTS} attempts")
             
             # Generate full file name with extension for sta_file_name
             full_file_name = f"{file_name}.{ext}"
             
-            # 4. Set Content-Type based on asset kind
-            content_type = "application/vnd.pmug.pixel+json" if asset_kind == "pixel-json" else "image/gif"
-            
             # 5. Prepare metadata
             cos_metadata = {
                 "x-cos-meta-sha256": sha256,
@@ -568,33 +931,39 @@ class MugService:
                 "x-cos-meta-product-id": product_id
             }
             
-            # 6. Upload to COS with metadata and cache headers
-            bucket_name = os.getenv("COS_BUCKET_NAME", "pixelmug-assets")
-            cos_client.put_object(
-                Bucket=bucket_name,
-                Body=asset_data,
-                Key=key,
-                ContentType=content_type,
-                Metadata=cos_metadata,
-                CacheControl="public, max-age=31536000, immutable",
-                StorageClass="STANDARD"
-            )
+            # 6. Upload to COS with metadata and cache headers (only when not already present)
+            if uploaded:
+                cos_client.put_object(
+                    Bucket=bucket_name,
+                    Body=asset_data,
+                    Key=key,
+                    ContentType=content_type,
+                    Metadata=cos_metadata,
+                    CacheControl="public, max-age=31536000, immutable",
+                    StorageClass="STANDARD"
+                )
             
-            # 7. Generate public read URL
-            get_url = cos_client.get_object_url(
-                Bucket=bucket_name,
-                Key=key
-            )
+            # 7. Record the object in the local index (as its plain object URL)
+            if asset_index:
+                try:
+                    get_url = cos_client.get_object_url(Bucket=bucket_name, Key=key)
+                    asset_index.record(bucket_name, key_prefix, sha256, profile_name, key, get_url, len(asset_data),
+                                       uploaded_at=None if uploaded else uploaded_at)
+                except Exception as e:
+                    self.logger.warning(f"Failed to record {key} in COS asset index: {str(e)}")
             
-            # 8. Calculate expiration timestamp
-            expires_at = int((datetime.datetime.utcnow() + datetime.timedelta(seconds=ttl_sec)).timestamp())
+            # 8. Download URL valid for ttl_sec (locally signed unless the bucket is public-read)
+            download_url, expires_at = self._get_cos_download_url(cos_client, cred.secret_id, bucket_name, key, ttl_sec)
             
             return {
                 "key": key,
                 "sha256": sha256,
                 "sha8": sha8,
-                "file_name": full_file_name,  # Full file name with extension: {file_name}-{sha8}.{ext}
-                "url": get_url,
+                "file_name": full_file_name,  # Full file name with extension: {file_name}.{ext}
+                "uploaded": uploaded,
+                "uploaded_bytes": len(asset_data) if uploaded else 0,
+                "index_hit": False,
+                "url": download_url,
                 "bytes": len(asset_data),
                 "width": metadata.get("width", 0),
                 "height": metadata.get("height", 0),
@@ -607,114 +976,245 @@ class MugService:
             self.logger.error(f"Failed to push asset to COS: {str(e)}")
             raise
 
-    def send_pixel_image(self, product_id: str, device_name: str, image_data: Union[str, List, Dict], 
-                        target_width: int = 16, target_height: int = 16, 
-                        use_cos: bool = True, ttl_sec: int = 900, use_direct_credentials: bool = True) -> Dict[str, Any]:
-        """Send pixel image to device via Tencent Cloud IoT Explorer with optional COS upload"""
-        try:
-            # Create IoT client with direct credentials for stdio mode
-            client = self._create_iot_client_with_sts(use_direct_credentials=use_direct_credentials)
-            
-            # Process image data
-            if isinstance(image_data, str):
-                # If it's base64 encoded image, convert to pixel matrix
-                conversion_result = self.convert_image_to_pixels(image_data, target_width, target_height)
-                pixel_matrix = conversion_result["pixel_matrix"]
+    def _render_pixel_image(self, product_id: str, image_data: Union[str, List, Dict],
+                            target_width: int = 16, target_height: int = 16,
+                            speculative: bool = False) -> Dict[str, Any]:
+        """Render pixel image input into a device-ready single-frame GIF, through the rendered-asset cache
+
+        Returns:
+            Dict with gif_bytes, width, height, cache ("miss", "hit-memory" or "hit-disk") and cache_key
+        """
+        profile = device_profiles.get_profile(product_id)
+        
+        # Base64 images are keyed by their decoded bytes, pixel data by its canonical JSON
+        if isinstance(image_data, str):
+            image_data = self._decode_image_input(image_data, "send_pixel_image")
+            normalized_input = image_data["bytes"]
+        else:
+            normalized_input = image_data
+        
+        cache = asset_cache.get_asset_cache()
+        cache_key = asset_cache.make_asset_key(
+            "pixel_image", normalized_input, target_width=target_width, target_height=target_height,
+            profile=profile.cache_key()
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            if not speculative and speculation.get_speculator().claim(cache_key):
+                self.logger.info("Pixel image was pre-rendered speculatively")
+            self.logger.info(f"Rendered pixel image served from {cached['tier']} asset cache: {len(cached['gif_bytes'])} bytes")
+            return {
+                "gif_bytes": cached["gif_bytes"],
+                "width": cached["metadata"].get("width", target_width),
+                "height": cached["metadata"].get("height", target_height),
+                "cache": f"hit-{cached['tier']}",
+                "cache_key": cache_key
+            }
+        
+        # Process image data
+        if isinstance(image_data, dict) and "pixels" in image_data:
+            # If it's palette-based pixel art format, keep it as packed palette
+            # indices so the GIF is built directly in 'P' mode
+            palette_result = self._process_palette_pixel_art(image_data, target_width, target_height)
+            width = palette_result["width"]
+            height = palette_result["height"]
+            frame = {
+                "frame_index": 0,
+                "indices": palette_result["indices"],
+                "palette": palette_result["palette"],
+                "width": width,
+                "height": height,
+                "duration": 1000  # 1 second display
+            }
+        else:
+            if isinstance(image_data, dict) and "pixel_data" in image_data:
+                # If it's packed rgb888/rgb565 output of convert_image_to_pixels
+                packed_result = self._decode_packed_pixels(image_data, target_width, target_height)
+                packed_rgb = packed_result["rgb"]
+                width = packed_result["width"]
+                height = packed_result["height"]
+            elif isinstance(image_data, dict) and "bytes" in image_data:
+                # If it's a (decoded) base64 encoded image, convert straight to packed RGB bytes
+                conversion_result = self.convert_image_to_pixels(image_data, target_width, target_height, output_format="rgb888")
+                packed_rgb = base64.b64decode(conversion_result["pixel_data"])
                 width = conversion_result["width"]
                 height = conversion_result["height"]
-            elif isinstance(image_data, dict) and "pixels" in image_data:
-                # If it's palette-based pixel art format
-                palette_result = self._process_palette_pixel_art(image_data, target_width, target_height)
-                pixel_matrix = palette_result["pixel_matrix"]
-                width = palette_result["width"]
-                height = palette_result["height"]
             else:
-                # If it's already a pixel matrix
-                pixel_matrix = image_data
+                # If it's already a pixel matrix, validate it while packing it to RGB bytes
                 width = target_width
                 height = target_height
-                
-            # Validate pixel matrix
-            self._validate_pixel_pattern(pixel_matrix, width, height)
+                packed_rgb = self._pack_pixel_matrix(image_data, width, height)
             
-            # Convert pixel matrix to single frame GIF for display
-            # Since device only supports GIF action, we'll create a single frame GIF
-            frames = [{
+            frame = {
                 "frame_index": 0,
-                "pixel_matrix": pixel_matrix,
+                "rgb": packed_rgb,
+                "width": width,
+                "height": height,
                 "duration": 1000  # 1 second display
-            }]
-            
-            # Create GIF from single frame
-            gif_bytes = self._create_gif_from_frames(frames, 1000, 0)  # No loop
+            }
+        
+        # Convert pixel matrix to single frame GIF for display
+        # Since device only supports GIF action, we'll create a single frame GIF
+        frames = [frame]
+        
+        # Create GIF from single frame
+        gif_bytes = render_engine.get_render_engine().create_gif(frames, 1000, 0, profile)  # No loop
+        
+        cache.put(cache_key, gif_bytes, {"width": width, "height": height, "frame_count": 1, "profile": profile.name})
+        return {"gif_bytes": gif_bytes, "width": width, "height": height, "cache": "miss", "cache_key": cache_key}
+
+    def _upload_gif_asset(self, product_id: str, device_name: str, gif_bytes: bytes, metadata: Dict[str, Any],
+                          ttl_sec: int, use_direct_credentials: bool,
+                          key_prefix: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Upload a rendered GIF to COS under its content-derived name, None on failure (direct transmission fallback)"""
+        try:
+            asset_info = self._push_asset_to_cos(product_id, device_name, gif_bytes, "gif",
+                                                 self._generate_short_filename(gif_bytes), metadata,
+                                                 ttl_sec, use_direct_credentials, key_prefix)
+            self.logger.info(f"Successfully uploaded GIF to COS: {asset_info['key']}")
+            return asset_info
+        except Exception as e:
+            self.logger.warning(f"Failed to upload to COS, falling back to direct transmission: {str(e)}")
+            return None
+
+    def _gif_action_input_params(self, asset_info: Optional[Dict[str, Any]], gif_bytes: bytes,
+                                 temp_prefix: str) -> Tuple[Dict[str, Any], str]:
+        """Build run_display_gif input parameters (device model) and the delivery method
+        
+        Args:
+            asset_info: Result of the COS upload, None for direct transmission
+            gif_bytes: GIF file contents
+            temp_prefix: File name prefix used for direct transmission
+        
+        Returns:
+            (input_params, "cos" or "direct")
+        """
+        if asset_info:
+            # Determine port based on URL protocol
+            url = asset_info["url"]
+            port = 443 if url.startswith("https://") else 80
             
-            # Prepare asset data for COS upload if enabled (only upload GIF, not JSON)
-            asset_info = None
-            if use_cos:
-                try:
-                    # Generate short file_name using hash algorithm (max 6 bytes)
-                    file_name = self._generate_short_filename()
-                    
-                    # Prepare metadata
-                    metadata = {
-                        "width": width,
-                        "height": height,
-                        "frame_count": 1
-                    }
-                    
-                    # Upload GIF to COS (not JSON)
-                    asset_info = self._push_asset_to_cos(product_id, device_name, gif_bytes, "gif", file_name, metadata, ttl_sec, use_direct_credentials)
-                    self.logger.info(f"Successfully uploaded pixel image GIF to COS: {asset_info['key']}")
-                except Exception as e:
-                    self.logger.warning(f"Failed to upload to COS, falling back to direct transmission: {str(e)}")
-                    use_cos = False
+            # Use the file_name from asset_info which matches the COS URL filename
+            return {
+                "sta_file_name": asset_info["file_name"],
+                "sta_file_len": asset_info["bytes"],
+                "sta_file_url": url,
+                "sta_port": port
+            }, "cos"
+        
+        # For direct transmission, use device model parameters with a temporary file name
+        return {
+            "sta_file_name": f"{temp_prefix}_{int(datetime.datetime.utcnow().timestamp())}.gif",
+            "sta_file_len": len(gif_bytes),
+            "sta_file_url": "direct_transmission",  # Placeholder for direct transmission
+            "sta_port": 80
+        }, "direct"
+
+    def _call_display_gif_action(self, client, product_id: str, device_name: str, input_params: Dict[str, Any]):
+        """Call the run_display_gif action on one device via CallDeviceActionAsync, returns the response"""
+        # Create CallDeviceActionAsync request with complete common parameters
+        req = iot_models.CallDeviceActionAsyncRequest()
+        region = os.getenv("DEFAULT_REGION", "ap-guangzhou")
+        params = {
+            "ProductId": product_id,
+            "DeviceName": device_name,
+            "ActionId": "run_display_gif",  # Use device model action ID
+            "InputParams": json.dumps(input_params),
+            # Add common parameters as per Tencent Cloud API documentation
+            "Region": region,
+            "Version": "2019-04-23"  # IoT Explorer API version
+        }
+        req.from_json_string(json.dumps(params))
+        try:
+            resp = client.CallDeviceActionAsync(req)
+        except Exception as e:
+            self._note_action_error(product_id, device_name, e)
+            raise
+        self._track_action(client, product_id, device_name, resp.ClientToken, "run_display_gif")
+        return resp
+
+    def speculate_pixel_image(self, image_data: str, conversion_result: Dict[str, Any],
+                              target_width: int = 16, target_height: int = 16,
+                              product_id: Optional[str] = None, device_name: Optional[str] = None,
+                              ttl_sec: int = 900) -> bool:
+        """Pre-render (and, with a known device, pre-upload) what send_pixel_image will most likely get next
+        
+        Candidates are the original base64 image and the conversion result as it is passed
+        back (the pixel matrix, or the palette/packed result dict). Runs in the background
+        when SPECULATIVE_RENDER is enabled.
+        
+        Returns:
+            True if speculation was queued
+        """
+        if conversion_result.get("output_format", "matrix") == "matrix":
+            pass_back = conversion_result.get("pixel_matrix")
+        else:
+            pass_back = conversion_result
+        candidates = [candidate for candidate in (image_data, pass_back) if candidate]
+        
+        def job(is_cancelled) -> List[str]:
+            produced = []
+            for candidate in candidates:
+                if is_cancelled():
+                    break
+                render_result = self._render_pixel_image(product_id, candidate, target_width, target_height, speculative=True)
+                if render_result["cache"] != "miss":
+                    continue
+                produced.append(render_result["cache_key"])
+                if product_id and device_name and not is_cancelled():
+                    # Warm the COS index and signed-URL cache for this device with exactly this render
+                    gif_bytes, width, height = render_result["gif_bytes"], render_result["width"], render_result["height"]
+                    self._upload_gif_asset(product_id, device_name, gif_bytes,
+                                           {"width": width, "height": height, "frame_count": 1}, ttl_sec, True)
+            return produced
+        
+        return speculation.get_speculator().submit(job, evict=asset_cache.get_asset_cache().discard)
+
+    def send_pixel_image(self, product_id: str, device_name: str, image_data: Union[str, List, Dict], 
+                        target_width: int = 16, target_height: int = 16, 
+                        use_cos: bool = True, ttl_sec: int = 900, use_direct_credentials: bool = True,
+                        offline_policy: str = "ignore") -> Dict[str, Any]:
+        """Send pixel image to device via Tencent Cloud IoT Explorer with optional COS upload
+        
+        offline_policy ("ignore", "fail" or "defer") decides what happens when the presence
+        cache knows the device is offline, before anything is rendered or uploaded. The send
+        goes through the device's command queue (see _queued_send).
+        """
+        deferred = self._check_offline_policy(product_id, device_name, offline_policy, lambda: self.send_pixel_image(
+            product_id, device_name, image_data, target_width, target_height, use_cos, ttl_sec, use_direct_credentials))
+        if deferred:
+            return deferred
+        return self._queued_send(product_id, device_name, lambda: self._send_pixel_image_now(
+            product_id, device_name, image_data, target_width, target_height, use_cos, ttl_sec, use_direct_credentials))
+
+    def _send_pixel_image_now(self, product_id: str, device_name: str, image_data: Union[str, List, Dict],
+                              target_width: int, target_height: int, use_cos: bool, ttl_sec: int,
+                              use_direct_credentials: bool) -> Dict[str, Any]:
+        """Render, upload and send a pixel image right away (runs on the device's queue)"""
+        try:
+            # Client setup, rendering and upload run as a dependency graph (see send_gif_animation)
+            graph = task_graph.TaskGraph()
+            graph.add("client", lambda: self._create_iot_client_with_sts(use_direct_credentials=use_direct_credentials))
+            graph.add("render", lambda: self._render_pixel_image(product_id, image_data, target_width, target_height))
+            graph.add("upload", lambda render_result: self._upload_gif_asset(
+                product_id, device_name, render_result["gif_bytes"],
+                {"width": render_result["width"], "height": render_result["height"], "frame_count": 1},
+                ttl_sec, use_direct_credentials
+            ) if use_cos else None, "render")
+            steps = graph.run()
+            client = steps["client"]
+            render_result = steps["render"]
+            gif_bytes = render_result["gif_bytes"]
+            width = render_result["width"]
+            height = render_result["height"]
+            asset_info = steps["upload"]
+            use_cos = use_cos and asset_info is not None
             
             # Prepare input parameters for GIF action according to device model
-            if use_cos and asset_info:
-                # Use COS upload for GIF
-                # Determine port based on URL protocol
-                url = asset_info["url"]
-                if url.startswith("https://"):
-                    port = 443
-                else:
-                    port = 80
-                
-                # Use the file_name from asset_info which matches the COS URL filename
-                input_params = {
-                    "sta_file_name": asset_info["file_name"],  # This matches the filename in COS URL
-                    "sta_file_len": len(gif_bytes),
-                    "sta_file_url": url,
-                    "sta_port": port
-                }
-                delivery_method = "cos"
-            else:
-                # For direct transmission, use device model parameters
-                temp_filename = f"pixel_{int(datetime.datetime.utcnow().timestamp())}.gif"
-                
-                input_params = {
-                    "sta_file_name": temp_filename,
-                    "sta_file_len": len(gif_bytes),
-                    "sta_file_url": "direct_transmission",  # Placeholder for direct transmission
-                    "sta_port": 80
-                }
-                delivery_method = "direct"
+            input_params, delivery_method = self._gif_action_input_params(asset_info if use_cos else None, gif_bytes, "pixel")
             
-            # Create CallDeviceActionAsync request with complete common parameters
-            req = iot_models.CallDeviceActionAsyncRequest()
-            region = os.getenv("DEFAULT_REGION", "ap-guangzhou")
-            params = {
-                "ProductId": product_id,
-                "DeviceName": device_name,
-                "ActionId": "run_display_gif",  # Use existing GIF action
-                "InputParams": json.dumps(input_params),
-                # Add common parameters as per Tencent Cloud API documentation
-                "Region": region,
-                "Version": "2019-04-23"  # IoT Explorer API version
-            }
-            req.from_json_string(json.dumps(params))
-            
-            # Send request to device
-            resp = client.CallDeviceActionAsync(req)
+            # Send run_display_gif to the device via CallDeviceActionAsync
+            resp = self._call_display_gif_action(client, product_id, device_name, input_params)
             
             result = {
                 "status": "success",
@@ -731,6 +1231,8 @@ class MugService:
                     "converted_to_gif": True,
                     "frame_count": 1
                 },
+                "render_cache": render_result["cache"],
+                "step_timings_ms": graph.get_timings(),
                 "delivery_method": delivery_method,
                 "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
             }
@@ -746,58 +1248,222 @@ class MugService:
             self.logger.error(f"Failed to send pixel image: {str(e)}")
             raise
 
-    def _process_gif_to_frames(self, gif_data: str, target_width: int = 16, target_height: int = 16) -> List[Dict]:
-        """Process GIF data to frame array"""
+    # Magic-byte signatures used to sniff image formats without invoking PIL
+    _IMAGE_SIGNATURES = (
+        (b"GIF87a", "GIF"),
+        (b"GIF89a", "GIF"),
+        (b"\x89PNG\r\n\x1a\n", "PNG"),
+        (b"\xff\xd8\xff", "JPEG"),
+        (b"BM", "BMP"),
+    )
+
+    def _sniff_image_format(self, data: bytes) -> Optional[str]:
+        """Detect image format from magic bytes, returns None if unknown"""
+        for signature, image_format in self._IMAGE_SIGNATURES:
+            if data.startswith(signature):
+                return image_format
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return "WEBP"
+        return None
+
+    def _decode_image_input(self, image_data: Union[str, bytes, Dict[str, Any]],
+                            guard_method: Optional[str] = None) -> Dict[str, Any]:
+        """Normalize image input so it is base64-decoded and parsed only once
+
+        Args:
+            image_data: Base64 string, raw bytes, or an already normalized input
+            guard_method: Method whose image_guard limits are enforced on the
+                header before anything is decoded (None skips the check)
+
+        Returns:
+            Dict with "bytes" (raw image bytes), "format" (sniffed from magic
+            bytes, None if unknown) and "image" (PIL image with only the header
+            parsed, None if PIL is unavailable)
+        """
+        if isinstance(image_data, dict) and "bytes" in image_data:
+            return image_data
+        
+        if isinstance(image_data, bytes):
+            image_bytes = image_data
+        else:
+            try:
+                image_bytes = base64.b64decode(image_data)
+            except Exception as e:
+                raise ValueError(f"Invalid base64 image data: {str(e)}")
+        
+        image_format = self._sniff_image_format(image_bytes)
+        
+        image = None
+        if PIL_AVAILABLE:
+            try:
+                image = Image.open(io.BytesIO(image_bytes))
+            except Exception as e:
+                raise ValueError(f"Cannot open image: {str(e)}")
+            # Trust PIL when the signature table does not know the format
+            image_format = image_format or image.format
+            
+            # Reject oversized dimensions / frame counts before any pixel decode
+            if guard_method:
+                image_guard.check_image(image, guard_method, image_bytes)
+        
+        return {
+            "bytes": image_bytes,
+            "format": image_format,
+            "image": image
+        }
+
+    def _iter_gif_frames(self, gif_image, target_width: int = 16, target_height: int = 16,
+                         max_frames: Optional[int] = None, max_total_pixels: Optional[int] = None,
+                         packed: bool = False) -> Iterator[Dict]:
+        """Lazily decode and resize GIF frames one at a time
+
+        Frames are pulled from ``ImageSequence`` as they are consumed, so an
+        oversized animation is rejected as soon as it crosses a budget instead
+        of after every frame has been decoded.
+
+        Args:
+            gif_image: Opened PIL image (GIF or any single/multi-frame format)
+            target_width: Width each frame is resized to
+            target_height: Height each frame is resized to
+            max_frames: Maximum number of frames (default: image_guard limit
+                for send_gif_animation)
+            max_total_pixels: Maximum source pixels summed over all frames
+                (default: image_guard limit for send_gif_animation)
+            packed: Yield packed RGB bytes ("rgb", "width", "height") instead
+                of a hex pixel_matrix
+
+        Yields:
+            Frame dicts with frame_index, pixel_matrix (or rgb) and duration
+        """
+        limits = image_guard.get_image_guard().get_limits("send_gif_animation")
+        if max_frames is None:
+            max_frames = limits["max_frames"]
+        if max_total_pixels is None:
+            max_total_pixels = limits["max_total_pixels"]
+
+        # Header dimensions are known before any pixel data is decoded
+        frame_pixels = gif_image.width * gif_image.height
+        if max_total_pixels is not None and frame_pixels > max_total_pixels:
+            raise ValueError(f"GIF frame size {gif_image.width}x{gif_image.height} exceeds pixel budget of {max_total_pixels}")
+
+        # With NumPy, frames are resized in small batches with one index-map lookup
+        batch = []
+        for frame_index, frame in enumerate(ImageSequence.Iterator(gif_image)):
+            if max_frames is not None and frame_index >= max_frames:
+                raise ValueError(f"GIF has more than {max_frames} frames")
+            if max_total_pixels is not None and (frame_index + 1) * frame_pixels > max_total_pixels:
+                raise ValueError(f"GIF exceeds total pixel budget of {max_total_pixels} at frame {frame_index}")
+
+            # Get frame duration (default 100ms if not specified)
+            duration = frame.info.get('duration', 100)
+
+            if frame_batch.NUMPY_AVAILABLE:
+                batch.append((frame_index, duration, frame.convert('RGB').tobytes()))
+                if len(batch) >= self.FRAME_BATCH_SIZE:
+                    yield from self._resize_frame_batch(batch, gif_image.width, gif_image.height, target_width, target_height, packed)
+                    batch = []
+                continue
+
+            # Convert to RGB and resize while only this frame is decoded
+            resized_frame = frame.convert('RGB').resize((target_width, target_height), Image.NEAREST)
+
+            yield self._make_resized_frame(frame_index, duration, resized_frame.tobytes(), target_width, target_height, packed)
+
+        if batch:
+            yield from self._resize_frame_batch(batch, gif_image.width, gif_image.height, target_width, target_height, packed)
+
+    # Frames decoded ahead and resized together on the NumPy path
+    FRAME_BATCH_SIZE = 32
+
+    def _resize_frame_batch(self, batch: List, source_width: int, source_height: int,
+                            target_width: int, target_height: int, packed: bool = False) -> Iterator[Dict]:
+        """Resize a batch of (frame_index, duration, rgb_bytes) frames at once and yield frame dicts"""
+        resized = frame_batch.resize_frames([rgb for _, _, rgb in batch], source_width, source_height,
+                                            target_width, target_height)
+        for (frame_index, duration, _), rgb in zip(batch, resized):
+            yield self._make_resized_frame(frame_index, duration, rgb, target_width, target_height, packed)
+
+    def _make_resized_frame(self, frame_index: int, duration: int, rgb: bytes,
+                            width: int, height: int, packed: bool) -> Dict[str, Any]:
+        """Frame dict with packed RGB bytes, or a hex pixel_matrix for the public frame format"""
+        if packed:
+            return {"frame_index": frame_index, "rgb": rgb, "width": width, "height": height, "duration": duration}
+        return {
+            "frame_index": frame_index,
+            "pixel_matrix": self._image_to_pixel_matrix(Image.frombytes('RGB', (width, height), rgb)),
+            "duration": duration
+        }
+
+    def _image_to_pixel_matrix(self, image) -> List[List[str]]:
+        """Convert an RGB PIL image to a matrix of "#rrggbb" strings"""
+        width, height = image.size
+        hex_data = image.tobytes().hex()
+        row_len = width * 6
+        return [
+            ["#" + hex_data[offset:offset + 6] for offset in range(row_start, row_start + row_len, 6)]
+            for row_start in range(0, height * row_len, row_len)
+        ]
+
+    # Output encodings supported by convert_image_to_pixels
+    PIXEL_OUTPUT_FORMATS = ("matrix", "palette", "rgb888", "rgb565")
+
+    def _pack_rgb565(self, rgb: bytes) -> bytes:
+        """Pack RGB888 bytes into big-endian RGB565 (2 bytes per pixel)"""
+        packed = bytearray(len(rgb) // 3 * 2)
+        for i, (r, g, b) in enumerate(zip(rgb[0::3], rgb[1::3], rgb[2::3])):
+            value = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+            packed[2 * i] = value >> 8
+            packed[2 * i + 1] = value & 0xFF
+        return bytes(packed)
+
+    def _unpack_rgb565(self, data: bytes) -> bytes:
+        """Expand big-endian RGB565 back to RGB888, replicating the high bits"""
+        rgb = bytearray(len(data) // 2 * 3)
+        for i in range(len(data) // 2):
+            value = (data[2 * i] << 8) | data[2 * i + 1]
+            r, g, b = value >> 11, (value >> 5) & 0x3F, value & 0x1F
+            rgb[3 * i] = (r << 3) | (r >> 2)
+            rgb[3 * i + 1] = (g << 2) | (g >> 4)
+            rgb[3 * i + 2] = (b << 3) | (b >> 2)
+        return bytes(rgb)
+
+    def _decode_packed_pixels(self, packed_data: Dict[str, Any], target_width: int, target_height: int) -> Dict[str, Any]:
+        """Decode base64 rgb888/rgb565 output of convert_image_to_pixels to RGB888 bytes"""
+        pixel_format = packed_data.get("pixel_format")
+        width = packed_data.get("width", target_width)
+        height = packed_data.get("height", target_height)
+        if pixel_format not in ("rgb888", "rgb565"):
+            raise ValueError("pixel_format must be one of: rgb888, rgb565")
+        
+        try:
+            raw = base64.b64decode(packed_data.get("pixel_data", ""), validate=True)
+        except Exception as e:
+            raise ValueError(f"Invalid base64 pixel_data: {str(e)}")
+        
+        bytes_per_pixel = 3 if pixel_format == "rgb888" else 2
+        if len(raw) != width * height * bytes_per_pixel:
+            raise ValueError(f"pixel_data has {len(raw)} bytes, expected {width * height * bytes_per_pixel} "
+                             f"for {width}x{height} {pixel_format}")
+        
+        rgb = raw if pixel_format == "rgb888" else self._unpack_rgb565(raw)
+        return {"rgb": rgb, "width": width, "height": height}
+
+    def _process_gif_to_frames(self, gif_data: Union[str, Dict[str, Any]], target_width: int = 16, target_height: int = 16,
+                               max_frames: Optional[int] = None, max_total_pixels: Optional[int] = None,
+                               packed: bool = False) -> List[Dict]:
+        """Process GIF data (base64 or normalized input) to frame array (packed RGB frames when packed=True)
+        
+        Collects every frame; rendering straight to a GIF should use _render_frames_to_gif,
+        which streams the frames into the encoder instead.
+        """
         try:
             if not PIL_AVAILABLE:
                 raise ImportError("PIL not available for GIF processing")
                 
-            # Decode base64 GIF data
-            gif_bytes = base64.b64decode(gif_data)
-            
-            # Open GIF with PIL
-            gif_image = Image.open(io.BytesIO(gif_bytes))
-            
-            frames = []
-            frame_index = 0
+            # Reuses the already opened image when given a normalized input
+            gif_image = self._decode_image_input(gif_data, "send_gif_animation")["image"]
             
-            try:
-                while True:
-                    # Get current frame
-                    frame = gif_image.copy()
-                    
-                    # Convert to RGB if necessary
-                    if frame.mode != 'RGB':
-                        frame = frame.convert('RGB')
-                    
-                    # Resize frame
-                    resized_frame = frame.resize((target_width, target_height), Image.NEAREST)
-                    
-                    # Convert to pixel matrix
-                    pixel_matrix = []
-                    for y in range(target_height):
-                        row = []
-                        for x in range(target_width):
-                            r, g, b = resized_frame.getpixel((x, y))
-                            hex_color = f"#{r:02x}{g:02x}{b:02x}"
-                            row.append(hex_color)
-                        pixel_matrix.append(row)
-                    
-                    # Get frame duration (default 100ms if not specified)
-                    duration = gif_image.info.get('duration', 100)
-                    
-                    frames.append({
-                        "frame_index": frame_index,
-                        "pixel_matrix": pixel_matrix,
-                        "duration": duration
-                    })
-                    
-                    frame_index += 1
-                    gif_image.seek(gif_image.tell() + 1)
-                    
-            except EOFError:
-                # End of frames
-                pass
+            frames = list(self._iter_gif_frames(gif_image, target_width, target_height, max_frames, max_total_pixels, packed))
             
             self.logger.info(f"Processed GIF into {len(frames)} frames")
             return frames
@@ -806,29 +1472,63 @@ class MugService:
             self.logger.error(f"Failed to process GIF: {str(e)}")
             raise
 
-    def _create_gif_from_frames(self, frames: List[Dict], frame_delay: int = 100, loop_count: int = 0) -> bytes:
-        """Create GIF file bytes from frame data"""
+    def _render_frames_to_gif(self, image_data: Union[str, Dict[str, Any]], target_width: int, target_height: int,
+                              frame_delay: int = 100, loop_count: int = 0,
+                              profile: Optional["device_profiles.DeviceProfile"] = None) -> Dict[str, Any]:
+        """Decode an image/animation and encode its resized frames into a device GIF in one pass
+        
+        The lazily decoded frames are fed straight into _create_gif_from_frames, so no
+        frame array is built and each source frame is decoded only when the encoder needs it.
+        
+        Returns:
+            Dict with gif_bytes and frame_count
+        """
+        gif_image = self._decode_image_input(image_data, "send_gif_animation")["image"]
+        counted = {"frames": 0}
+        
+        def count(frames: Iterator[Dict]) -> Iterator[Dict]:
+            for frame in frames:
+                counted["frames"] += 1
+                yield frame
+        
+        frames = self._iter_gif_frames(gif_image, target_width, target_height, packed=True)
+        gif_bytes = self._create_gif_from_frames(count(frames), frame_delay, loop_count, profile)
+        self.logger.info(f"Rendered {counted['frames']} frames into a {len(gif_bytes)} byte GIF")
+        return {"gif_bytes": gif_bytes, "frame_count": counted["frames"]}
+
+    def _create_gif_from_frames(self, frames: Iterable[Dict], frame_delay: int = 100, loop_count: int = 0,
+                                profile: Optional["device_profiles.DeviceProfile"] = None) -> bytes:
+        """Create GIF file bytes from frame data
+        
+        frames may be a list or a lazy iterator (e.g. _iter_gif_frames); it is consumed
+        once and each frame dict is released as soon as its image is built.
+        """
         try:
             if not PIL_AVAILABLE:
                 raise ImportError("PIL not available for GIF creation")
             
-            if not frames:
+            frames = iter(frames)
+            first_frame = next(frames, None)
+            if first_frame is None:
                 raise ValueError("No frames provided for GIF creation")
             
             # Get dimensions from first frame
-            first_frame = frames[0]
-            pixel_matrix = first_frame["pixel_matrix"]
-            height = len(pixel_matrix)
-            width = len(pixel_matrix[0]) if pixel_matrix else 0
+            if "width" in first_frame and "height" in first_frame:
+                width = first_frame["width"]
+                height = first_frame["height"]
+            else:
+                pixel_matrix = first_frame["pixel_matrix"]
+                height = len(pixel_matrix)
+                width = len(pixel_matrix[0]) if pixel_matrix else 0
             
             # Create PIL images for each frame
             pil_frames = []
             durations = []
+            rgb_frame_positions = []
             
-            self.logger.info(f"Creating GIF from {len(frames)} frames, width={width}, height={height}")
+            self.logger.info(f"Creating GIF from frames, width={width}, height={height}")
             
-            for idx, frame in enumerate(frames):
-                pixel_matrix = frame["pixel_matrix"]
+            for idx, frame in enumerate(itertools.chain([first_frame], frames)):
                 duration = frame.get("duration", frame_delay)
                 
                 # Convert duration from milliseconds to seconds (PIL uses seconds)
@@ -836,41 +1536,47 @@ class MugService:
                 # Actually, PIL's duration parameter expects milliseconds
                 duration_ms = duration
                 
-                # Create PIL image from pixel matrix
-                # Use 'P' mode (palette) for better GIF compatibility
-                img = Image.new('RGB', (width, height))
-                
-                for y in range(height):
-                    for x in range(width):
-                        color_hex = pixel_matrix[y][x]
-                        # Convert hex color to RGB
-                        if color_hex.startswith('#'):
-                            color_hex = color_hex[1:]
-                        r = int(color_hex[0:2], 16)
-                        g = int(color_hex[2:4], 16)
-                        b = int(color_hex[4:6], 16)
-                        img.putpixel((x, y), (r, g, b))
+                if "indices" in frame:
+                    # Palette fast path: indices were validated while packing,
+                    # so the frame goes straight to 'P' mode with the author's exact colors
+                    img_p = self._palette_frame_to_image(frame)
+                    pil_frames.append(img_p)
+                    durations.append(duration_ms)
+                    self.logger.debug(f"Frame {idx}: duration={duration_ms}ms, size={img_p.size}, mode={img_p.mode}, palette={len(frame['palette'])} colors")
+                    continue
                 
-                # Convert to palette mode BEFORE appending
-                # This is critical for multi-frame GIFs - each frame must be in palette mode
-                # Convert each frame to palette mode independently
-                img_p = img.quantize()
+                if "rgb" in frame:
+                    # Already validated and packed by the caller
+                    packed_rgb = frame["rgb"]
+                else:
+                    # Validation is merged into packing the hex matrix into RGB bytes
+                    packed_rgb = self._pack_pixel_matrix(frame["pixel_matrix"], width, height, require_hash=False)
                 
-                # Make a copy to ensure frame independence
-                img_copy = img_p.copy()
+                # Create PIL image from packed RGB pixels
+                img = Image.frombytes('RGB', (width, height), packed_rgb)
                 
-                pil_frames.append(img_copy)
+                # RGB frames are converted to palette mode together after the loop
+                rgb_frame_positions.append(len(pil_frames))
+                pil_frames.append(img)
                 durations.append(duration_ms)
                 
                 # Log first few pixels to verify frames are different
                 if idx < 3:
-                    sample_pixels = []
-                    for sy in range(min(3, height)):
-                        for sx in range(min(3, width)):
-                            sample_pixels.append(pixel_matrix[sy][sx])
-                    self.logger.debug(f"Frame {idx}: duration={duration_ms}ms, size={img_copy.size}, mode={img_copy.mode}, sample_pixels={sample_pixels[:9]}")
+                    sample_pixels = [f"#{packed_rgb[i:i + 3].hex()}" for i in range(0, min(len(packed_rgb), 27), 3)]
+                    self.logger.debug(f"Frame {idx}: duration={duration_ms}ms, size={img.size}, sample_pixels={sample_pixels}")
                 else:
-                    self.logger.debug(f"Frame {idx}: duration={duration_ms}ms, size={img_copy.size}, mode={img_copy.mode}")
+                    self.logger.debug(f"Frame {idx}: duration={duration_ms}ms, size={img.size}")
+            
+            # Convert RGB frames to palette mode BEFORE saving
+            # This is critical for multi-frame GIFs - each frame must be in palette mode.
+            # One palette is derived for all frames (exact when they share <= 256 colors)
+            # and each frame is mapped through its cached LUT instead of a median cut per frame
+            if rgb_frame_positions:
+                quantized_frames = color_quantizer.quantize_frames(
+                    [pil_frames[position] for position in rgb_frame_positions], max_colors=256
+                )
+                for position, img_p in zip(rgb_frame_positions, quantized_frames):
+                    pil_frames[position] = img_p
             
             self.logger.info(f"Created {len(pil_frames)} PIL images, durations: {durations}")
             
@@ -949,18 +1655,18 @@ class MugService:
                             frame_count += 1
                     except EOFError:
                         pass
-                    self.logger.info(f"Created GIF with {len(frames)} input frames, {frame_count} frames in output file, {len(gif_bytes)} bytes")
-                    if frame_count != len(frames):
-                        self.logger.warning(f"Frame count mismatch: expected {len(frames)} frames, but GIF contains {frame_count} frames")
+                    self.logger.info(f"Created GIF with {len(pil_frames)} input frames, {frame_count} frames in output file, {len(gif_bytes)} bytes")
+                    if frame_count != len(pil_frames):
+                        self.logger.warning(f"Frame count mismatch: expected {len(pil_frames)} frames, but GIF contains {frame_count} frames")
                 except Exception as e:
                     self.logger.warning(f"Could not verify GIF frame count: {str(e)}")
             else:
-                self.logger.info(f"Created GIF with {len(frames)} frames, {len(gif_bytes)} bytes")
+                self.logger.info(f"Created GIF with {len(pil_frames)} frames, {len(gif_bytes)} bytes")
             
-            # 缩放GIF为标准尺寸(32x16)
+            # 缩放GIF为设备标准尺寸（按设备配置文件，默认32x16）
             try:
-                gif_bytes = gif_resizer.resize_gif_to_standard(gif_bytes)
-                self.logger.info(f"GIF resized to standard size (32x16), final size: {len(gif_bytes)} bytes")
+                gif_bytes = gif_resizer.resize_gif_to_standard(gif_bytes, profile=profile)
+                self.logger.info(f"GIF resized to device standard size, final size: {len(gif_bytes)} bytes")
             except Exception as e:
                 self.logger.warning(f"Failed to resize GIF to standard size: {str(e)}, using original size")
                 # 如果缩放失败，继续使用原始GIF
@@ -971,195 +1677,199 @@ class MugService:
             self.logger.error(f"Failed to create GIF from frames: {str(e)}")
             raise
 
-    def send_gif_animation(self, product_id: str, device_name: str, gif_data: Union[str, List, Dict], 
-                          frame_delay: int = 100, loop_count: int = 0, 
-                          target_width: int = 16, target_height: int = 16,
-                          use_cos: bool = True, ttl_sec: int = 900, sta_port: int = 80, use_direct_credentials: bool = True) -> Dict[str, Any]:
-        """Send GIF pixel animation to device via Tencent Cloud IoT Explorer with optional COS upload"""
-        try:
-            # Create IoT client with direct credentials for stdio mode
-            client = self._create_iot_client_with_sts(use_direct_credentials=use_direct_credentials)
-            
-            # Process GIF data
-            frames = None
-            gif_bytes = None
-            
-            self.logger.info(f"Processing GIF data, type: {type(gif_data).__name__}")
-            
-            if isinstance(gif_data, str):
-                # If it's base64 encoded GIF, we can use it directly or process to frames
-                self.logger.info("Branch: gif_data is string, attempting base64 decode")
-                try:
-                    # Try to decode as base64 GIF first
-                    gif_bytes = base64.b64decode(gif_data)
-                    self.logger.info(f"Successfully decoded base64, size: {len(gif_bytes)} bytes")
-                    
-                    # Validate it's a GIF by trying to open it
-                    if PIL_AVAILABLE:
-                        test_img = Image.open(io.BytesIO(gif_bytes))
-                        self.logger.info(f"Image opened successfully, format: {test_img.format}")
-                        if test_img.format != 'GIF':
-                            # Not a GIF, process as frames
-                            self.logger.warning(f"Image format is {test_img.format}, not GIF. Processing as frames")
-                            frames = self._process_gif_to_frames(gif_data, target_width, target_height)
-                            gif_bytes = None
-                            self.logger.info(f"Processed to frames, frame count: {len(frames) if frames else 0}")
-                        else:
-                            self.logger.info("Valid GIF format detected, using gif_bytes directly")
-                            # 缩放GIF为标准尺寸(32x16)
-                            try:
-                                gif_bytes = gif_resizer.resize_gif_to_standard(gif_bytes)
-                                self.logger.info(f"GIF resized to standard size (32x16), final size: {len(gif_bytes)} bytes")
-                            except Exception as e:
-                                self.logger.warning(f"Failed to resize GIF to standard size: {str(e)}, using original size")
-                    else:
-                        self.logger.warning("PIL not available, cannot validate GIF format. Assuming valid GIF")
-                        # 即使PIL不可用，也尝试缩放（gif_resizer内部会处理）
-                        try:
-                            gif_bytes = gif_resizer.resize_gif_to_standard(gif_bytes)
-                            self.logger.info(f"GIF resized to standard size (32x16), final size: {len(gif_bytes)} bytes")
-                        except Exception as e:
-                            self.logger.warning(f"Failed to resize GIF to standard size: {str(e)}, using original size")
-                except Exception as e:
-                    # If base64 decode fails, treat as frame data
-                    self.logger.warning(f"Base64 decode failed: {str(e)}, treating as frame data")
-                    frames = self._process_gif_to_frames(gif_data, target_width, target_height)
-                    self.logger.info(f"Processed to frames, frame count: {len(frames) if frames else 0}")
-            elif isinstance(gif_data, dict) and "frames" in gif_data:
-                # If it's palette-based GIF format
-                self.logger.info("Branch: gif_data is dict with 'frames' key, processing as palette-based GIF format")
-                frames = self._process_palette_gif_animation(gif_data, target_width, target_height)
-                self.logger.info(f"Processed palette-based GIF, frame count: {len(frames) if frames else 0}")
-            elif isinstance(gif_data, list):
-                # If it's already frame array
-                self.logger.info(f"Branch: gif_data is list, treating as frame array")
-                
-                # Validate frame structure
-                if len(gif_data) == 0:
-                    raise ValueError("gif_data list is empty")
-                
-                # Check first frame structure
-                first_frame = gif_data[0]
-                if not isinstance(first_frame, dict):
-                    raise ValueError(f"Frame must be a dict, got {type(first_frame).__name__}")
-                
-                if "pixel_matrix" not in first_frame:
-                    raise ValueError("Frame missing required 'pixel_matrix' field")
-                
-                self.logger.info(f"Frame array structure validated: {len(gif_data)} frames")
-                self.logger.info(f"First frame keys: {list(first_frame.keys())}")
-                self.logger.info(f"First frame has duration: {'duration' in first_frame}")
-                
-                frames = gif_data
-                self.logger.info(f"Using frames directly, frame count: {len(frames)}")
-                
-                # Log frame details
-                for idx, frame in enumerate(frames):
-                    frame_duration = frame.get("duration", "not set")
-                    pixel_matrix = frame.get("pixel_matrix", [])
-                    matrix_height = len(pixel_matrix) if pixel_matrix else 0
-                    matrix_width = len(pixel_matrix[0]) if pixel_matrix and len(pixel_matrix) > 0 else 0
-                    self.logger.debug(f"Frame {idx}: duration={frame_duration}, size={matrix_width}x{matrix_height}")
-            else:
-                # Unknown type
-                raise ValueError(f"Unsupported gif_data type: {type(gif_data).__name__}, expected str, dict, or list")
-                
-            # Validate we have either frames or GIF bytes
-            self.logger.info(f"Validation: frames={frames is not None}, gif_bytes={gif_bytes is not None}")
-            if not frames and not gif_bytes:
-                self.logger.error("No valid GIF data found: both frames and gif_bytes are None")
-                raise ValueError("No valid GIF data found")
+    def _render_gif_animation(self, product_id: str, gif_data: Union[str, List, Dict],
+                              frame_delay: int = 100, loop_count: int = 0,
+                              target_width: int = 16, target_height: int = 16) -> Dict[str, Any]:
+        """Render GIF animation input into device-ready GIF bytes, through the rendered-asset cache
+
+        Returns:
+            Dict with gif_bytes, frame_count, frames_dropped (frames over the profile's max_frames),
+            cache ("miss", "hit-memory" or "hit-disk") and cache_key
+        """
+        # Display profile of this product (resolution, colors, file size, frame rate)
+        profile = device_profiles.get_profile(product_id)
+        
+        # Normalize the input once: decoded bytes key the cache and feed the renderer
+        decoded_input = None
+        if isinstance(gif_data, str):
+            decoded_input = self._decode_image_input(gif_data, "send_gif_animation")
+            normalized_input = decoded_input["bytes"]
+        else:
+            normalized_input = gif_data
+        
+        cache = asset_cache.get_asset_cache()
+        cache_key = asset_cache.make_asset_key(
+            "gif_animation", normalized_input, frame_delay=frame_delay, loop_count=loop_count,
+            target_width=target_width, target_height=target_height, profile=profile.cache_key()
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            self.logger.info(f"Rendered GIF served from {cached['tier']} asset cache: {len(cached['gif_bytes'])} bytes")
+            return {
+                "gif_bytes": cached["gif_bytes"],
+                "frame_count": cached["metadata"].get("frame_count", 1),
+                "frames_dropped": cached["metadata"].get("frames_dropped", 0),
+                "cache": f"hit-{cached['tier']}",
+                "cache_key": cache_key
+            }
+        
+        # Process GIF data
+        frames = None
+        gif_bytes = None
+        source_frames = None
+        cacheable = True
+        
+        self.logger.info(f"Processing GIF data, type: {type(gif_data).__name__}")
+        
+        if isinstance(gif_data, str):
+            # If it's base64 encoded GIF, we can use it directly or process to frames
+            self.logger.info("Branch: gif_data is string, normalizing input")
+            # Base64 was decoded and sniffed once up front; later stages reuse the result
+            gif_bytes = decoded_input["bytes"]
+            self.logger.info(f"Successfully decoded base64, size: {len(gif_bytes)} bytes, format: {decoded_input['format']}")
+            
+            if decoded_input["format"] != 'GIF' and PIL_AVAILABLE:
+                # Not a GIF: its frames are decoded, resized and encoded in one streaming pass
+                self.logger.warning(f"Image format is {decoded_input['format']}, not GIF. Processing as frames")
+                rendered = render_engine.get_render_engine().render_frames_gif(
+                    decoded_input, target_width, target_height, frame_delay, loop_count, profile)
+                gif_bytes = rendered["gif_bytes"]
+                source_frames = rendered["frame_count"]
+                self.logger.info(f"Rendered frames to GIF, frame count: {source_frames}")
             else:
-                if frames:
-                    self.logger.info(f"Using frames data, count: {len(frames)}")
-                if gif_bytes:
-                    self.logger.info(f"Using gif_bytes data, size: {len(gif_bytes)} bytes")
-            
-            # Prepare asset data for COS upload if enabled
-            asset_info = None
-            # Prepare input parameters according to device model
-            self.logger.info(f"use_cos: {use_cos} - asset_info: {asset_info}")
-            if use_cos:
+                if not PIL_AVAILABLE:
+                    self.logger.warning("PIL not available, cannot validate GIF format. Assuming valid GIF")
+                else:
+                    self.logger.info("Valid GIF format detected, using gif_bytes directly")
+                # 缩放GIF为设备标准尺寸，复用已打开的图像；帧数由缩放器从块结构统计
+                resize_report = {}
                 try:
-                    # Generate short file_name using hash algorithm (max 6 bytes)
-                    file_name = self._generate_short_filename()
-                    
-                    # Create GIF file if we have frames
-                    if frames and not gif_bytes:
-                        gif_bytes = self._create_gif_from_frames(frames, frame_delay, loop_count)
-                    
-                    # Prepare metadata
-                    metadata = {
-                        "width": target_width,
-                        "height": target_height,
-                        "frame_count": len(frames) if frames else 1
-                    }
-                    
-                    # Upload actual GIF file to COS
-                    asset_info = self._push_asset_to_cos(product_id, device_name, gif_bytes, "gif", file_name, metadata, ttl_sec, use_direct_credentials)
-                    self.logger.info(f"Successfully uploaded GIF file to COS: {asset_info['key']}")
+                    gif_bytes = render_engine.get_render_engine().resize_gif(gif_bytes, profile, image=decoded_input["image"],
+                                                                             report=resize_report)
+                    source_frames = resize_report.get("source_frames")
+                    self.logger.info(f"GIF resized to {profile.width}x{profile.height} ({profile.name}), final size: {len(gif_bytes)} bytes")
                 except Exception as e:
-                    self.logger.warning(f"Failed to upload to COS, falling back to direct transmission: {str(e)}")
-                    use_cos = False
-            
-            
-            if use_cos and asset_info:
-                # Use device model parameters: sta_file_name, sta_file_len, sta_file_url, sta_port
-                # Determine port based on URL protocol
-                self.logger.info(f"COS success - asset_info: {asset_info}")
-                url = asset_info["url"]
-                if url.startswith("https://"):
-                    port = 443
-                else:
-                    port = 80
-                
-                # Use the file_name from asset_info which matches the COS URL filename
-                input_params = {
-                    "sta_file_name": asset_info["file_name"],  # This matches the filename in COS URL: {file_name}-{sha8}.gif
-                    "sta_file_len": asset_info["bytes"],
-                    "sta_file_url": url,
-                    "sta_port": port
-                }
-                self.logger.info(f"COS success URL: {url}")
-                delivery_method = "cos"
-            else:
-                # For direct transmission, we need to create a temporary GIF and upload it
-                # Since device model only accepts COS parameters, we'll create a minimal GIF
-                self.logger.info(f"COS failed - frames: {frames}")
-                if not frames:
-                    raise ValueError("Cannot send GIF without frames when COS is disabled")
-                
-                # Create GIF from frames
-                gif_bytes = self._create_gif_from_frames(frames, frame_delay, loop_count)
-                
-                # For direct transmission, we'll use a simple approach
-                # Generate a temporary filename
-                temp_filename = f"temp_gif_{int(datetime.datetime.utcnow().timestamp())}.gif"
-                
-                input_params = {
-                    "sta_file_name": temp_filename,
-                    "sta_file_len": len(gif_bytes),
-                    "sta_file_url": "direct_transmission",  # Placeholder for direct transmission
-                    "sta_port": 80
-                }
-                delivery_method = "direct"
+                    self.logger.warning(f"Failed to resize GIF to standard size: {str(e)}, using original size")
+                    # 原尺寸的回退结果不写入缓存
+                    cacheable = False
+        elif isinstance(gif_data, dict) and "frames" in gif_data:
+            # If it's palette-based GIF format
+            self.logger.info("Branch: gif_data is dict with 'frames' key, processing as palette-based GIF format")
+            frames = self._process_palette_gif_animation(gif_data, target_width, target_height)
+            self.logger.info(f"Processed palette-based GIF, frame count: {len(frames) if frames else 0}")
+        elif isinstance(gif_data, list):
+            # If it's already frame array
+            self.logger.info(f"Branch: gif_data is list, treating as frame array")
+            
+            # Validate frame structure
+            if len(gif_data) == 0:
+                raise ValueError("gif_data list is empty")
+            
+            # Check first frame structure
+            first_frame = gif_data[0]
+            if not isinstance(first_frame, dict):
+                raise ValueError(f"Frame must be a dict, got {type(first_frame).__name__}")
+            
+            if "pixel_matrix" not in first_frame:
+                raise ValueError("Frame missing required 'pixel_matrix' field")
+            
+            self.logger.info(f"Frame array structure validated: {len(gif_data)} frames")
+            self.logger.info(f"First frame keys: {list(first_frame.keys())}")
+            self.logger.info(f"First frame has duration: {'duration' in first_frame}")
+            
+            frames = gif_data
+            self.logger.info(f"Using frames directly, frame count: {len(frames)}")
+            
+            # Log frame details
+            for idx, frame in enumerate(frames):
+                frame_duration = frame.get("duration", "not set")
+                pixel_matrix = frame.get("pixel_matrix", [])
+                matrix_height = len(pixel_matrix) if pixel_matrix else 0
+                matrix_width = len(pixel_matrix[0]) if pixel_matrix and len(pixel_matrix) > 0 else 0
+                self.logger.debug(f"Frame {idx}: duration={frame_duration}, size={matrix_width}x{matrix_height}")
+        else:
+            # Unknown type
+            raise ValueError(f"Unsupported gif_data type: {type(gif_data).__name__}, expected str, dict, or list")
+            
+        # Validate we have either frames or GIF bytes
+        self.logger.info(f"Validation: frames={frames is not None}, gif_bytes={gif_bytes is not None}")
+        if not frames and not gif_bytes:
+            self.logger.error("No valid GIF data found: both frames and gif_bytes are None")
+            raise ValueError("No valid GIF data found")
+        else:
+            if frames:
+                self.logger.info(f"Using frames data, count: {len(frames)}")
+            if gif_bytes:
+                self.logger.info(f"Using gif_bytes data, size: {len(gif_bytes)} bytes")
+        
+        # Create GIF file if we have frames
+        if frames and not gif_bytes:
+            gif_bytes = render_engine.get_render_engine().create_gif(frames, frame_delay, loop_count, profile)
+        
+        frame_count = len(frames) if frames else (source_frames or 1)
+        # The resizer keeps only the profile's first max_frames frames (and logs the truncation)
+        frames_dropped = 0
+        if cacheable and profile.max_frames is not None and frame_count > profile.max_frames:
+            frames_dropped = frame_count - profile.max_frames
+            frame_count = profile.max_frames
+        if cacheable:
+            cache.put(cache_key, gif_bytes, {
+                "width": target_width,
+                "height": target_height,
+                "frame_count": frame_count,
+                "frames_dropped": frames_dropped,
+                "profile": profile.name
+            })
+        return {"gif_bytes": gif_bytes, "frame_count": frame_count, "frames_dropped": frames_dropped,
+                "cache": "miss", "cache_key": cache_key}
+
+    def send_gif_animation(self, product_id: str, device_name: str, gif_data: Union[str, List, Dict], 
+                          frame_delay: int = 100, loop_count: int = 0, 
+                          target_width: int = 16, target_height: int = 16,
+                          use_cos: bool = True, ttl_sec: int = 900, sta_port: int = 80, use_direct_credentials: bool = True,
+                          offline_policy: str = "ignore") -> Dict[str, Any]:
+        """Send GIF pixel animation to device via Tencent Cloud IoT Explorer with optional COS upload
+        
+        offline_policy and queueing work as in send_pixel_image.
+        """
+        deferred = self._check_offline_policy(product_id, device_name, offline_policy, lambda: self.send_gif_animation(
+            product_id, device_name, gif_data, frame_delay, loop_count, target_width, target_height,
+            use_cos, ttl_sec, sta_port, use_direct_credentials))
+        if deferred:
+            return deferred
+        return self._queued_send(product_id, device_name, lambda: self._send_gif_animation_now(
+            product_id, device_name, gif_data, frame_delay, loop_count, target_width, target_height,
+            use_cos, ttl_sec, use_direct_credentials))
+
+    def _send_gif_animation_now(self, product_id: str, device_name: str, gif_data: Union[str, List, Dict],
+                                frame_delay: int, loop_count: int, target_width: int, target_height: int,
+                                use_cos: bool, ttl_sec: int, use_direct_credentials: bool) -> Dict[str, Any]:
+        """Render, upload and send a GIF animation right away (runs on the device's queue)"""
+        try:
+            # Client setup, rendering and upload run as a dependency graph: the IoT
+            # client is built while the GIF renders, and the upload starts as soon
+            # as the bytes exist
+            graph = task_graph.TaskGraph()
+            graph.add("client", lambda: self._create_iot_client_with_sts(use_direct_credentials=use_direct_credentials))
+            graph.add("render", lambda: self._render_gif_animation(product_id, gif_data, frame_delay, loop_count, target_width, target_height))
+            graph.add("upload", lambda render_result: self._upload_gif_asset(
+                product_id, device_name, render_result["gif_bytes"],
+                {"width": target_width, "height": target_height, "frame_count": render_result["frame_count"]},
+                ttl_sec, use_direct_credentials
+            ) if use_cos else None, "render")
+            steps = graph.run()
+            client = steps["client"]
+            render_result = steps["render"]
+            gif_bytes = render_result["gif_bytes"]
+            frame_count = render_result["frame_count"]
+            asset_info = steps["upload"]
+            use_cos = use_cos and asset_info is not None
             
-            # Create CallDeviceActionAsync request with complete common parameters
-            req = iot_models.CallDeviceActionAsyncRequest()
-            region = os.getenv("DEFAULT_REGION", "ap-guangzhou")
-            params = {
-                "ProductId": product_id,
-                "DeviceName": device_name,
-                "ActionId": "run_display_gif",  # Use device model action ID
-                "InputParams": json.dumps(input_params),
-                # Add common parameters as per Tencent Cloud API documentation
-                "Region": region,
-                "Version": "2019-04-23"  # IoT Explorer API version
-            }
-            req.from_json_string(json.dumps(params))
+            # Prepare input parameters according to device model
+            input_params, delivery_method = self._gif_action_input_params(asset_info if use_cos else None, gif_bytes, "temp_gif")
             
-            # Send request to device
-            resp = client.CallDeviceActionAsync(req)
+            # Send run_display_gif to the device via CallDeviceActionAsync
+            resp = self._call_display_gif_action(client, product_id, device_name, input_params)
             
             result = {
                 "status": "success",
@@ -1170,13 +1880,16 @@ class MugService:
                 "device_name": device_name,
                 "action_id": "run_display_gif",
                 "animation_info": {
-                    "frame_count": len(frames) if frames else 1,
+                    "frame_count": frame_count,
+                    "frames_dropped": render_result["frames_dropped"],
                     "frame_delay": frame_delay,
                     "loop_count": loop_count,
                     "width": target_width,
                     "height": target_height,
                     "total_pixels": target_width * target_height
                 },
+                "render_cache": render_result["cache"],
+                "step_timings_ms": graph.get_timings(),
                 "delivery_method": delivery_method,
                 "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
             }
@@ -1192,6 +1905,717 @@ class MugService:
             self.logger.error(f"Failed to send GIF animation: {str(e)}")
             raise
 
+    # 广播时并发调用 CallDeviceActionAsync 的默认上限（可由 BROADCAST_MAX_PARALLEL 覆盖）
+    BROADCAST_MAX_PARALLEL = 16
+    BROADCAST_DELIVERY_MODES = ("per_device", "product_broadcast")
+    
+    def _fan_out_display_gif(self, client, product_id: str, device_names: List[str], input_params: Dict[str, Any],
+                             max_parallel: int, via: str = "action") -> List[Dict[str, Any]]:
+        """Call run_display_gif on each device with bounded parallelism; results keep the order of device_names"""
+        def send_one(device_name: str) -> Dict[str, Any]:
+            try:
+                resp = self._call_display_gif_action(client, product_id, device_name, input_params)
+                return {
+                    "device_name": device_name,
+                    "status": "success",
+                    "via": via,
+                    "client_token": resp.ClientToken,
+                    "call_status": resp.Status,
+                    "request_id": resp.RequestId
+                }
+            except Exception as e:
+                self.logger.warning(f"Sending run_display_gif to {product_id}/{device_name} failed: {str(e)}")
+                return {"device_name": device_name, "status": "error", "via": via, "error": str(e)}
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(device_names))),
+                                thread_name_prefix="broadcast") as executor:
+            return list(executor.map(send_one, device_names))
+    
+    def _deliver_by_product_broadcast(self, client, product_id: str, device_names: List[str],
+                                      input_params: Dict[str, Any], max_parallel: int) -> List[Dict[str, Any]]:
+        """Publish run_display_gif once to the product broadcast topic, then fall back per device
+        
+        Devices acknowledge by reporting the BROADCAST_ACK_EVENT_ID event carrying the
+        broadcast's client token. Devices without an acknowledgement within
+        BROADCAST_ACK_TIMEOUT_SEC get a regular CallDeviceActionAsync.
+        
+        Requires device firmware that handles the broadcast topic and reports the ack
+        event; without it every device waits out the timeout and is then sent to one by one.
+        """
+        client_token = str(uuid.uuid4())
+        payload = {
+            "method": "action",
+            "actionId": "run_display_gif",
+            "clientToken": client_token,
+            "timestamp": int(time.time()),
+            "params": input_params
+        }
+        started = int(time.time())
+        acked = set()
+        try:
+            req = iot_models.PublishBroadcastMessageRequest()
+            req.from_json_string(json.dumps({"ProductId": product_id, "Payload": json.dumps(payload), "Qos": 1}))
+            resp = client.PublishBroadcastMessage(req)
+            self.logger.info(f"Published broadcast {client_token} to product {product_id}, task {resp.TaskId}")
+            acked = self._wait_for_broadcast_acks(client, product_id, device_names, client_token, started)
+        except Exception as e:
+            self.logger.warning(f"Product broadcast to {product_id} failed, sending to every device: {str(e)}")
+        
+        pending = [name for name in device_names if name not in acked]
+        fallback = {}
+        if pending:
+            self.logger.info(f"{len(pending)}/{len(device_names)} devices did not acknowledge the broadcast, falling back to per-device calls")
+            fallback = {item["device_name"]: item for item in
+                        self._fan_out_display_gif(client, product_id, pending, input_params, max_parallel, via="fallback")}
+        return [
+            fallback[name] if name in fallback else
+            {"device_name": name, "status": "success", "via": "broadcast", "client_token": client_token}
+            for name in device_names
+        ]
+    
+    def _wait_for_broadcast_acks(self, client, product_id: str, device_names: List[str], client_token: str,
+                                 start_time: int) -> set:
+        """Poll ListEventHistory for acknowledgement events of one broadcast until all arrive or time runs out"""
+        timeout = float(os.getenv("BROADCAST_ACK_TIMEOUT_SEC", "5"))
+        interval = float(os.getenv("BROADCAST_ACK_POLL_SEC", "1"))
+        expected = set(device_names)
+        acked = set()
+        deadline = time.monotonic() + timeout
+        while True:
+            for device_name, data in self._list_ack_events(client, product_id, start_time):
+                if device_name in expected and client_token in (data or ""):
+                    acked.add(device_name)
+            if acked >= expected or time.monotonic() + interval > deadline:
+                return acked
+            time.sleep(interval)
+    
+    def _list_ack_events(self, client, product_id: str, start_time: int) -> Iterator[Tuple[str, str]]:
+        """Page through a product's acknowledgement events (BROADCAST_ACK_EVENT_ID) since start_time
+        
+        Yields:
+            (device_name, event data) pairs
+        """
+        event_id = os.getenv("BROADCAST_ACK_EVENT_ID", "display_ack")
+        context = ""
+        while True:
+            req = iot_models.ListEventHistoryRequest()
+            query = {"ProductId": product_id, "EventId": event_id, "StartTime": start_time - 1,
+                     "EndTime": int(time.time()) + 1, "Size": 100}
+            if context:
+                query["Context"] = context
+            req.from_json_string(json.dumps(query))
+            resp = client.ListEventHistory(req)
+            for item in resp.EventHistory or []:
+                yield item.DeviceName, item.Data
+            if resp.Listover or not resp.EventHistory:
+                return
+            context = resp.Context
+    
+    def _track_action(self, client, product_id: str, device_name: str, client_token: Optional[str], action_id: str):
+        """Hand an accepted action to the completion tracker, polled through this client (COMPLETION_TRACKING only)"""
+        tracker = completion_tracker.get_completion_tracker()
+        if not client_token or not tracker.enabled:
+            return
+        tracker.register(
+            product_id, device_name, client_token, action_id,
+            lambda start_time: self._list_ack_events(client, product_id, start_time)
+        )
+    
+    def wait_for_completion(self, client_tokens: List[str], timeout_sec: float = 30) -> Dict[str, Any]:
+        """Wait until the devices confirm the given actions (by client_token) or the timeout passes
+        
+        Args:
+            client_tokens: client_token values returned by send_* / broadcast_*
+            timeout_sec: Longest time to wait (capped at COMPLETION_TIMEOUT_SEC)
+        """
+        if not client_tokens or not isinstance(client_tokens, list):
+            raise ValueError("client_tokens must be a non-empty list")
+        tracker = completion_tracker.get_completion_tracker()
+        if not tracker.enabled:
+            raise ValueError("Completion tracking is disabled; set COMPLETION_TRACKING=true")
+        timeout_sec = max(0.0, min(float(timeout_sec), tracker.timeout_sec))
+        records = tracker.wait(list(dict.fromkeys(client_tokens)), timeout_sec)
+        
+        results = [record if record is not None else {"client_token": token, "status": "unknown"}
+                   for token, record in records.items()]
+        counts = {state: sum(1 for record in results if record["status"] == state)
+                  for state in ("completed", "pending", "timeout", "unknown")}
+        return {
+            "status": "success" if counts["completed"] == len(results) else "incomplete",
+            **counts,
+            "results": results,
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
+        }
+    
+    def get_action_result(self, client_token: str) -> Dict[str, Any]:
+        """Return the completion record of one action: pending, completed (with latency_ms) or timeout"""
+        tracker = completion_tracker.get_completion_tracker()
+        if not tracker.enabled:
+            raise ValueError("Completion tracking is disabled; set COMPLETION_TRACKING=true")
+        record = tracker.get(client_token)
+        if record is None:
+            raise ValueError(f"Unknown client_token: {client_token}")
+        return record
+    
+    def get_delivery_stats(self, product_id: Optional[str] = None) -> Dict[str, Any]:
+        """Return completion counters and per-device end-to-end delivery latency"""
+        return completion_tracker.get_completion_tracker().get_stats(product_id)
+    
+    # 播放列表可用的发送方法及其参数（第一个为必需参数）
+    PLAYLIST_METHODS = {
+        "send_pixel_image": ("image_data", "target_width", "target_height", "use_cos", "ttl_sec"),
+        "send_gif_animation": ("gif_data", "frame_delay", "loop_count", "target_width", "target_height", "use_cos", "ttl_sec"),
+        "send_display_text": ("text",)
+    }
+    # 播放列表条目数上限与单条最短显示时长（秒）
+    PLAYLIST_MAX_ITEMS = 100
+    PLAYLIST_MIN_DURATION_SEC = 1
+    
+    def set_playlist(self, product_id: str, device_name: str, items: List[Dict[str, Any]],
+                     loop: bool = True, start_delay_sec: float = 0) -> Dict[str, Any]:
+        """Install a rotating playlist on a device, replacing any previous one
+        
+        Each item is pushed when its slot comes due, through the regular send path, so
+        repeated items reuse the rendered-asset cache, the COS index and signed URLs.
+        Devices known to be offline are skipped for that slot (offline_policy "fail").
+        
+        Args:
+            product_id: Product ID
+            device_name: Device name
+            items: [{"method": "send_gif_animation", "params": {"gif_data": ...}, "duration_sec": 30}, ...]
+            loop: Start over after the last item
+            start_delay_sec: Delay before the first item
+        """
+        if not product_id or not device_name:
+            raise ValueError("product_id and device_name are required")
+        if not isinstance(items, list) or not items:
+            raise ValueError("items must be a non-empty list")
+        if len(items) > self.PLAYLIST_MAX_ITEMS:
+            raise ValueError(f"Too many playlist items: {len(items)} > {self.PLAYLIST_MAX_ITEMS}")
+        
+        normalized = []
+        for position, item in enumerate(items):
+            method = item.get("method") if isinstance(item, dict) else None
+            if method not in self.PLAYLIST_METHODS:
+                raise ValueError(f"Item {position}: method must be one of {', '.join(self.PLAYLIST_METHODS)}")
+            params = item.get("params") or {}
+            allowed = self.PLAYLIST_METHODS[method]
+            unknown = sorted(set(params) - set(allowed))
+            if unknown:
+                raise ValueError(f"Item {position}: unsupported params for {method}: {', '.join(unknown)}")
+            if allowed[0] not in params:
+                raise ValueError(f"Item {position}: missing required param {allowed[0]}")
+            try:
+                duration_sec = float(item.get("duration_sec"))
+            except (TypeError, ValueError):
+                raise ValueError(f"Item {position}: duration_sec must be a number")
+            if duration_sec < self.PLAYLIST_MIN_DURATION_SEC:
+                raise ValueError(f"Item {position}: duration_sec must be at least {self.PLAYLIST_MIN_DURATION_SEC}")
+            normalized.append({"method": method, "params": dict(params), "duration_sec": duration_sec})
+        
+        def dispatch(item: Dict[str, Any]) -> Dict[str, Any]:
+            return getattr(self, item["method"])(product_id, device_name, offline_policy="fail", **item["params"])
+        
+        playlist_scheduler.get_playlist_scheduler().set_playlist(
+            (product_id, device_name), normalized, dispatch, loop=bool(loop), start_delay_sec=float(start_delay_sec or 0)
+        )
+        self.logger.info(f"Playlist of {len(normalized)} items set for {product_id}/{device_name}")
+        return self.get_playlist(product_id, device_name)
+    
+    def get_playlist(self, product_id: str, device_name: Optional[str] = None) -> Dict[str, Any]:
+        """Return a device's playlist state, or scheduler-wide counters when device_name is omitted"""
+        scheduler = playlist_scheduler.get_playlist_scheduler()
+        if device_name is None:
+            return scheduler.get_stats()
+        state = scheduler.get_playlist((product_id, device_name))
+        if state is None:
+            raise ValueError(f"No playlist for device {product_id}/{device_name}")
+        return dict(state, product_id=product_id, device_name=device_name)
+    
+    def clear_playlist(self, product_id: str, device_name: str) -> Dict[str, Any]:
+        """Stop a device's playlist"""
+        removed = playlist_scheduler.get_playlist_scheduler().clear_playlist((product_id, device_name))
+        return {
+            "status": "success",
+            "product_id": product_id,
+            "device_name": device_name,
+            "removed": removed,
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
+        }
+    
+    def _list_product_device_names(self, product_id: str, use_direct_credentials: bool = True) -> List[str]:
+        """List every device name of a product via GetDeviceList paging"""
+        client = self._create_iot_client_with_sts(use_direct_credentials=use_direct_credentials)
+        return [device.DeviceName for device in self._list_product_devices(client, product_id)[0]]
+    
+    # GetDeviceList 每页设备数与并发翻页数（可由 DEVICE_LIST_PAGE_SIZE / DEVICE_LIST_PARALLEL 覆盖）
+    DEVICE_LIST_PAGE_SIZE = 100
+    DEVICE_LIST_PARALLEL = 8
+    # 缺失设备不超过该数量时逐台 DescribeDevice，否则整体翻页 GetDeviceList
+    DEVICE_STATUS_DESCRIBE_THRESHOLD = 3
+    
+    def _list_product_devices(self, client, product_id: str) -> Tuple[List[Any], int]:
+        """Fetch every device of a product with GetDeviceList: the first page gives the total,
+        the remaining pages are requested concurrently. Fills the presence cache.
+        
+        Returns:
+            (DeviceInfo list, number of API calls)
+        """
+        page_size = int(os.getenv("DEVICE_LIST_PAGE_SIZE", str(self.DEVICE_LIST_PAGE_SIZE)))
+        parallel = int(os.getenv("DEVICE_LIST_PARALLEL", str(self.DEVICE_LIST_PARALLEL)))
+        
+        def fetch(offset: int):
+            req = iot_models.GetDeviceListRequest()
+            req.from_json_string(json.dumps({"ProductId": product_id, "Offset": offset, "Limit": page_size}))
+            return client.GetDeviceList(req)
+        
+        first = fetch(0)
+        devices = list(first.Devices or [])
+        offsets = list(range(page_size, first.Total or 0, page_size))
+        if offsets:
+            with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(offsets))), thread_name_prefix="device-list") as executor:
+                for page in executor.map(fetch, offsets):
+                    devices.extend(page.Devices or [])
+        
+        self._record_presence(product_id, [(device.DeviceName, self._presence_state(device)) for device in devices])
+        return devices, 1 + len(offsets)
+    
+    def _presence_state(self, device) -> Dict[str, Any]:
+        """Online state of a DeviceInfo / DescribeDevice result, as stored in the presence cache"""
+        return {
+            "online": device.Status == 1,  # 1表示在线
+            "status": device.Status,
+            "login_time": getattr(device, 'LoginTime', None),
+            "first_online_time": getattr(device, 'FirstOnlineTime', None),
+            "version": getattr(device, 'Version', None),
+            "enable_state": getattr(device, 'EnableState', None)
+        }
+    
+    # 发送前的离线处理策略：ignore 不检查，fail 立即失败，defer 暂存到设备上线后补发
+    OFFLINE_POLICIES = ("ignore", "fail", "defer")
+    # 暂存发送的有效期（秒，可由 DEFERRED_SEND_TTL_SEC 覆盖）
+    DEFERRED_SEND_TTL_SEC = 600
+    
+    def _record_presence(self, product_id: str, states: List[Tuple[str, Dict[str, Any]]]):
+        """Store freshly queried device states and replay deferred sends of devices found online"""
+        device_presence.get_presence_cache().put_many(product_id, states)
+        if self._deferred_sends:
+            for device_name, state in states:
+                if state["online"]:
+                    self._replay_deferred_send(product_id, device_name)
+    
+    def _check_offline_policy(self, product_id: str, device_name: str, offline_policy: str,
+                              replay) -> Optional[Dict[str, Any]]:
+        """Consult the presence cache before any rendering or COS work
+        
+        Only cached knowledge is used (no API call): unknown devices are treated as online.
+        
+        Args:
+            offline_policy: "ignore", "fail" or "defer"
+            replay: Callable re-running the send, kept when the send is deferred
+        
+        Returns:
+            None to go ahead with the send, or the "deferred" result
+        
+        Raises:
+            ValueError: Unknown policy, or the device is known to be offline under "fail"
+        """
+        if offline_policy not in self.OFFLINE_POLICIES:
+            raise ValueError(f"Unsupported offline_policy: {offline_policy}, expected one of {', '.join(self.OFFLINE_POLICIES)}")
+        if offline_policy == "ignore":
+            return None
+        
+        state = device_presence.get_presence_cache().get(product_id, device_name)
+        if state is None or state["online"]:
+            return None
+        if offline_policy == "fail":
+            raise ValueError(f"Device {product_id}/{device_name} is offline")
+        
+        # 每台设备只保留最新一条暂存的发送（新的显示内容覆盖旧的）
+        with self._deferred_lock:
+            replaced = (product_id, device_name) in self._deferred_sends
+            self._deferred_sends[(product_id, device_name)] = (replay, time.monotonic())
+        self.logger.info(f"Device {product_id}/{device_name} is offline, send deferred until it comes online")
+        return {
+            "status": "deferred",
+            "product_id": product_id,
+            "device_name": device_name,
+            "reason": "device_offline",
+            "presence_age_sec": state["age_sec"],
+            "replaced_deferred": replaced,
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
+        }
+    
+    def _replay_deferred_send(self, product_id: str, device_name: str) -> Optional[str]:
+        """Start the deferred send of a device that came online
+        
+        Returns:
+            "replayed", "expired" or None when nothing was deferred
+        """
+        with self._deferred_lock:
+            entry = self._deferred_sends.pop((product_id, device_name), None)
+        if entry is None:
+            return None
+        replay, deferred_at = entry
+        ttl = float(os.getenv("DEFERRED_SEND_TTL_SEC", str(self.DEFERRED_SEND_TTL_SEC)))
+        if time.monotonic() - deferred_at > ttl:
+            self.logger.info(f"Deferred send for {product_id}/{device_name} expired")
+            return "expired"
+        
+        def run():
+            try:
+                replay()
+                self.logger.info(f"Replayed deferred send for {product_id}/{device_name}")
+            except Exception as e:
+                self.logger.warning(f"Deferred send for {product_id}/{device_name} failed: {str(e)}")
+        
+        threading.Thread(target=run, name="deferred-send", daemon=True).start()
+        return "replayed"
+    
+    def _queued_send(self, product_id: str, device_name: str, send) -> Dict[str, Any]:
+        """Run a display command on the device's command queue and wait for it
+        
+        Commands for one device run in order; a queued command replaced by a newer one
+        before it started is dropped without rendering and reported as "superseded".
+        """
+        try:
+            return command_queue.get_command_queue().submit((product_id, device_name), send).result()
+        except command_queue.CommandSuperseded as e:
+            self.logger.info(f"Command for {product_id}/{device_name} superseded by a newer one")
+            return {
+                "status": "superseded",
+                "product_id": product_id,
+                "device_name": device_name,
+                "command_id": e.command_id,
+                "superseded_by": e.superseded_by,
+                "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
+            }
+    
+    def _note_action_error(self, product_id: str, device_name: str, error: Exception):
+        """Mark a device offline in the presence cache when an action call says so"""
+        if "DeviceOffline" in str(getattr(error, "code", "") or ""):
+            device_presence.get_presence_cache().set_online(product_id, device_name, False)
+    
+    def handle_device_event(self, product_id: str, device_name: str, event: str,
+                            data: Optional[Union[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Apply a device event forwarded from IoT Explorer (rule engine / message forwarding)
+        
+        "online" and "offline" status events overwrite the cached presence. An event whose
+        data carries the client_token of a tracked action completes that action and marks
+        the device online; any other event invalidates the cached presence. A device coming
+        online gets its deferred send replayed.
+        
+        Args:
+            product_id: Product ID
+            device_name: Device name
+            event: Event type, e.g. "online", "offline" or a device model event ID
+            data: Event data (optional)
+        """
+        if not product_id or not device_name:
+            raise ValueError("product_id and device_name are required")
+        
+        presence = device_presence.get_presence_cache()
+        event_type = (event or "").lower()
+        completed = []
+        if data and event_type not in ("online", "offline"):
+            data_text = data if isinstance(data, str) else json.dumps(data)
+            completed = completion_tracker.get_completion_tracker().complete_from_event(product_id, device_name, data_text)
+        if completed:
+            # 设备刚确认执行了动作，必然在线
+            presence.set_online(product_id, device_name, True)
+        
+        deferred_send = None
+        if event_type in ("online", "offline"):
+            presence.set_online(product_id, device_name, event_type == "online")
+            if event_type == "online":
+                deferred_send = self._replay_deferred_send(product_id, device_name)
+        elif not completed:
+            presence.invalidate(product_id, device_name)
+        
+        return {
+            "status": "success",
+            "product_id": product_id,
+            "device_name": device_name,
+            "event": event_type,
+            "presence": event_type if event_type in ("online", "offline") else "online" if completed else "invalidated",
+            "deferred_send": deferred_send,
+            "completed_actions": completed,
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
+        }
+    
+    def get_devices_status(self, product_id: str, device_names: Optional[List[str]] = None,
+                           max_age_sec: Optional[float] = None, use_direct_credentials: bool = True) -> Dict[str, Any]:
+        """Query online state of many devices of a product with few API calls
+        
+        Fresh answers come from the shared presence cache (DEVICE_PRESENCE_TTL_SEC). Up to
+        DEVICE_STATUS_DESCRIBE_THRESHOLD missing devices are looked up with DescribeDevice
+        in parallel; more trigger one concurrent GetDeviceList sweep of the whole product,
+        which also refreshes the cache for every other device.
+        
+        Args:
+            product_id: Product ID
+            device_names: Devices to report (default: every device of the product)
+            max_age_sec: Accept cached states at most this old (0 forces a refresh)
+            use_direct_credentials: Use direct credentials flag
+        """
+        try:
+            presence = device_presence.get_presence_cache()
+            states = {}
+            api_calls = 0
+            
+            if device_names is not None:
+                device_names = list(dict.fromkeys(device_names))
+                for device_name in device_names:
+                    state = presence.get(product_id, device_name, max_age_sec)
+                    if state is not None:
+                        states[device_name] = dict(state, cached=True)
+                missing = [name for name in device_names if name not in states]
+            else:
+                missing = None
+            
+            if missing is None or missing:
+                client = self._create_iot_client_with_sts(use_direct_credentials=use_direct_credentials)
+                if missing is not None and len(missing) <= self.DEVICE_STATUS_DESCRIBE_THRESHOLD:
+                    def describe(device_name: str):
+                        req = iot_models.DescribeDeviceRequest()
+                        req.from_json_string(json.dumps({"ProductId": product_id, "DeviceName": device_name}))
+                        try:
+                            return device_name, client.DescribeDevice(req).Device
+                        except Exception as e:
+                            self.logger.warning(f"DescribeDevice {product_id}/{device_name} failed: {str(e)}")
+                            return device_name, None
+                    with ThreadPoolExecutor(max_workers=len(missing), thread_name_prefix="device-status") as executor:
+                        described = list(executor.map(describe, missing))
+                    api_calls += len(missing)
+                    found = [(name, self._presence_state(device)) for name, device in described if device is not None]
+                    self._record_presence(product_id, found)
+                    states.update((name, dict(state, cached=False)) for name, state in found)
+                else:
+                    devices, calls = self._list_product_devices(client, product_id)
+                    api_calls += calls
+                    listed = {device.DeviceName: self._presence_state(device) for device in devices}
+                    if device_names is None:
+                        device_names = list(listed)
+                    states.update((name, dict(listed[name], cached=False)) for name in missing or listed if name in listed)
+            
+            devices = [dict(states[name], device_name=name) for name in device_names if name in states]
+            online_count = sum(1 for device in devices if device["online"])
+            result = {
+                "status": "success",
+                "product_id": product_id,
+                "device_count": len(devices),
+                "online_count": online_count,
+                "offline_count": len(devices) - online_count,
+                "devices": devices,
+                "not_found": [name for name in device_names if name not in states],
+                "api_calls": api_calls,
+                "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
+            }
+            self.logger.info(f"Resolved status of {len(devices)} devices of {product_id} with {api_calls} API calls")
+            return result
+            
+        except Exception as e:
+            self.logger.error(f"Failed to get devices status: {str(e)}")
+            raise
+    
+    def _broadcast_rendered_gif(self, product_id: str, device_names: Optional[List[str]], render, metadata_of,
+                                use_cos: bool, ttl_sec: int, max_parallel: Optional[int],
+                                use_direct_credentials: bool, temp_prefix: str,
+                                delivery: str = "per_device",
+                                product_device_names: Optional[List[str]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Render and upload one GIF, then deliver run_display_gif to every device
+        
+        Args:
+            product_id: Product ID shared by the devices
+            device_names: Target devices (duplicates are sent once); must be None with
+                product_broadcast delivery, which always reaches every device of the product
+            render: Callable returning the render result (gif_bytes, cache, ...)
+            metadata_of: Callable mapping the render result to COS metadata
+            use_cos: Upload to COS (shared key broadcast/{product_id}/...)
+            ttl_sec: Signed URL lifetime
+            max_parallel: Concurrent device calls (default: BROADCAST_MAX_PARALLEL)
+            use_direct_credentials: Use direct credentials flag
+            temp_prefix: File name prefix for direct transmission
+            delivery: "per_device" (default, one CallDeviceActionAsync per device, bounded
+                parallelism) or the opt-in "product_broadcast" (one PublishBroadcastMessage to the
+                whole product, per-device calls only for devices that do not acknowledge; needs
+                firmware reporting BROADCAST_ACK_EVENT_ID)
+            product_device_names: Every device of the product, when the caller already listed
+                them (product_broadcast only; listed here otherwise)
+        
+        Returns:
+            (broadcast result with per-device results, render result)
+        """
+        if delivery not in self.BROADCAST_DELIVERY_MODES:
+            raise ValueError(f"Unsupported delivery: {delivery}, expected one of {', '.join(self.BROADCAST_DELIVERY_MODES)}")
+        if delivery == "product_broadcast":
+            # 产品广播会到达该产品下的全部设备，不能只针对部分设备
+            if device_names is not None:
+                raise ValueError("delivery=product_broadcast reaches every device of the product; omit device_names")
+            if product_device_names is None:
+                product_device_names = self._list_product_device_names(product_id, use_direct_credentials)
+            device_names = product_device_names
+        device_names = list(dict.fromkeys(device_names or []))
+        if not device_names:
+            raise ValueError("device_names must be a non-empty list")
+        if max_parallel is None:
+            max_parallel = int(os.getenv("BROADCAST_MAX_PARALLEL", str(self.BROADCAST_MAX_PARALLEL)))
+        max_parallel = max(1, min(max_parallel, len(device_names)))
+        
+        # Render and upload once: every device downloads the same shared object
+        graph = task_graph.TaskGraph()
+        graph.add("client", lambda: self._create_iot_client_with_sts(use_direct_credentials=use_direct_credentials))
+        graph.add("render", render)
+        graph.add("upload", lambda render_result: self._upload_gif_asset(
+            product_id, device_names[0], render_result["gif_bytes"], metadata_of(render_result),
+            ttl_sec, use_direct_credentials, key_prefix=f"broadcast/{product_id}"
+        ) if use_cos else None, "render")
+        steps = graph.run()
+        client = steps["client"]
+        render_result = steps["render"]
+        asset_info = steps["upload"]
+        input_params, delivery_method = self._gif_action_input_params(asset_info, render_result["gif_bytes"], temp_prefix)
+        
+        if delivery == "product_broadcast":
+            device_results = self._deliver_by_product_broadcast(client, product_id, device_names, input_params, max_parallel)
+        else:
+            device_results = self._fan_out_display_gif(client, product_id, device_names, input_params, max_parallel)
+        
+        succeeded = sum(1 for item in device_results if item["status"] == "success")
+        if succeeded == len(device_results):
+            status = "success"
+        elif succeeded:
+            status = "partial"
+        else:
+            status = "error"
+        
+        result = {
+            "status": status,
+            "product_id": product_id,
+            "action_id": "run_display_gif",
+            "delivery": delivery,
+            "device_count": len(device_results),
+            "succeeded": succeeded,
+            "failed": len(device_results) - succeeded,
+            "results": device_results,
+            "render_cache": render_result["cache"],
+            "step_timings_ms": graph.get_timings(),
+            "delivery_method": delivery_method,
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
+        }
+        if asset_info:
+            result["asset"] = asset_info
+        self.logger.info(f"Broadcast run_display_gif to {succeeded}/{len(device_results)} devices of {product_id}")
+        return result, render_result
+
+    def broadcast_gif_animation(self, product_id: str, device_names: Optional[List[str]], gif_data: Union[str, List, Dict],
+                                frame_delay: int = 100, loop_count: int = 0,
+                                target_width: int = 16, target_height: int = 16,
+                                use_cos: bool = True, ttl_sec: int = 900, max_parallel: Optional[int] = None,
+                                use_direct_credentials: bool = True, delivery: str = "per_device",
+                                product_device_names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Send the same GIF animation to many devices: render and upload once, then fan out"""
+        try:
+            result, render_result = self._broadcast_rendered_gif(
+                product_id, device_names,
+                lambda: self._render_gif_animation(product_id, gif_data, frame_delay, loop_count, target_width, target_height),
+                lambda render_result: {"width": target_width, "height": target_height, "frame_count": render_result["frame_count"]},
+                use_cos, ttl_sec, max_parallel, use_direct_credentials, "temp_gif", delivery,
+                product_device_names
+            )
+            result["animation_info"] = {
+                "frame_count": render_result["frame_count"],
+                "frames_dropped": render_result["frames_dropped"],
+                "frame_delay": frame_delay,
+                "loop_count": loop_count,
+                "width": target_width,
+                "height": target_height,
+                "total_pixels": target_width * target_height
+            }
+            return result
+        except Exception as e:
+            self.logger.error(f"Failed to broadcast GIF animation: {str(e)}")
+            raise
+
+    def broadcast_pixel_image(self, product_id: str, device_names: Optional[List[str]], image_data: Union[str, List, Dict],
+                              target_width: int = 16, target_height: int = 16,
+                              use_cos: bool = True, ttl_sec: int = 900, max_parallel: Optional[int] = None,
+                              use_direct_credentials: bool = True, delivery: str = "per_device",
+                              product_device_names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Send the same pixel image to many devices: render and upload once, then fan out"""
+        try:
+            result, render_result = self._broadcast_rendered_gif(
+                product_id, device_names,
+                lambda: self._render_pixel_image(product_id, image_data, target_width, target_height),
+                lambda render_result: {"width": render_result["width"], "height": render_result["height"], "frame_count": 1},
+                use_cos, ttl_sec, max_parallel, use_direct_credentials, "pixel", delivery,
+                product_device_names
+            )
+            result["image_info"] = {
+                "width": render_result["width"],
+                "height": render_result["height"],
+                "total_pixels": render_result["width"] * render_result["height"],
+                "converted_to_gif": True,
+                "frame_count": 1
+            }
+            return result
+        except Exception as e:
+            self.logger.error(f"Failed to broadcast pixel image: {str(e)}")
+            raise
+
+    def _pack_palette_indices(self, rows: List, width: int, height: int, palette_size: int,
+                              row_label: str = "Pixels row", index_label: str = "") -> bytes:
+        """Validate palette index rows and pack them into a flat 'P' mode buffer
+
+        The common case is checked with bulk operations (``bytes()`` rejects
+        non-integers and values outside 0-255, ``max()`` checks the palette
+        bound). Only when that fails are the rows re-scanned one index at a
+        time to report the exact offending position.
+
+        Args:
+            rows: 2D list of palette indices (already checked to have ``height`` rows)
+            width: Expected row width
+            height: Expected row count
+            palette_size: Number of colors in the palette
+            row_label: Prefix for row errors, e.g. "Frame 2 row"
+            index_label: Infix for index errors, e.g. " in frame 2"
+
+        Returns:
+            Packed indices, one byte per pixel, row-major
+        """
+        try:
+            packed_rows = []
+            for row in rows:
+                if not isinstance(row, list) or len(row) != width:
+                    raise ValueError
+                packed_rows.append(bytes(row))
+            packed = b"".join(packed_rows)
+            if len(packed) != width * height or (packed and max(packed) >= palette_size):
+                raise ValueError
+            return packed
+        except (TypeError, ValueError):
+            pass
+        
+        # Slow path only to locate the first error precisely
+        for row_idx, row in enumerate(rows):
+            if not isinstance(row, list):
+                raise ValueError(f"{row_label} {row_idx} is not a list")
+            
+            if len(row) != width:
+                raise ValueError(f"{row_label} {row_idx} width {len(row)} doesn't match specified width {width}")
+            
+            for col_idx, pixel_index in enumerate(row):
+                if not isinstance(pixel_index, int) or pixel_index < 0 or pixel_index >= palette_size:
+                    raise ValueError(f"Invalid pixel index{index_label} at [{row_idx}][{col_idx}]: {pixel_index}")
+        
+        raise ValueError(f"Invalid palette pixel data{index_label}")
+
+    def _palette_frame_to_image(self, frame: Dict[str, Any]):
+        """Build a 'P' mode PIL image from a packed palette frame without quantization"""
+        img = Image.frombytes('P', (frame["width"], frame["height"]), frame["indices"])
+        img.putpalette(b"".join(bytes.fromhex(color[1:]) for color in frame["palette"]))
+        return img
+
     def _process_palette_gif_animation(self, gif_data: Dict[str, Any], target_width: int, target_height: int) -> List[Dict]:
         """Process palette-based GIF animation format to frame array"""
         try:
@@ -1230,29 +2654,18 @@ class MugService:
                 if not frame_pixels or len(frame_pixels) != height:
                     raise ValueError(f"Frame {frame_idx} pixels height {len(frame_pixels)} doesn't match specified height {height}")
                 
-                # Convert palette indices to hex colors for this frame
-                pixel_matrix = []
-                for row_idx, row in enumerate(frame_pixels):
-                    if not isinstance(row, list):
-                        raise ValueError(f"Frame {frame_idx} row {row_idx} is not a list")
-                    
-                    if len(row) != width:
-                        raise ValueError(f"Frame {frame_idx} row {row_idx} width {len(row)} doesn't match specified width {width}")
-                    
-                    pixel_row = []
-                    for col_idx, pixel_index in enumerate(row):
-                        if not isinstance(pixel_index, int) or pixel_index < 0 or pixel_index >= len(palette):
-                            raise ValueError(f"Invalid pixel index in frame {frame_idx} at [{row_idx}][{col_idx}]: {pixel_index}")
-                        
-                        # Get color from palette
-                        color = palette[pixel_index]
-                        pixel_row.append(color)
-                    
-                    pixel_matrix.append(pixel_row)
+                # Validate and pack palette indices for this frame
+                indices = self._pack_palette_indices(
+                    frame_pixels, width, height, len(palette),
+                    row_label=f"Frame {frame_idx} row", index_label=f" in frame {frame_idx}"
+                )
                 
                 frames.append({
                     "frame_index": frame_idx,
-                    "pixel_matrix": pixel_matrix,
+                    "indices": indices,
+                    "palette": palette,
+                    "width": width,
+                    "height": height,
                     "duration": frame_duration
                 })
             
@@ -1263,7 +2676,7 @@ class MugService:
             raise
 
     def _process_palette_pixel_art(self, pixel_art_data: Dict[str, Any], target_width: int, target_height: int) -> Dict[str, Any]:
-        """Process palette-based pixel art format to hex color matrix"""
+        """Process palette-based pixel art format to packed palette indices"""
         try:
             # Extract data from pixel art format
             title = pixel_art_data.get("title", "unknown")
@@ -1289,28 +2702,11 @@ class MugService:
             if not pixels or len(pixels) != height:
                 raise ValueError(f"Pixels array height {len(pixels)} doesn't match specified height {height}")
             
-            # Convert palette indices to hex colors
-            pixel_matrix = []
-            for row_idx, row in enumerate(pixels):
-                if not isinstance(row, list):
-                    raise ValueError(f"Pixels row {row_idx} is not a list")
-                
-                if len(row) != width:
-                    raise ValueError(f"Pixels row {row_idx} width {len(row)} doesn't match specified width {width}")
-                
-                pixel_row = []
-                for col_idx, pixel_index in enumerate(row):
-                    if not isinstance(pixel_index, int) or pixel_index < 0 or pixel_index >= len(palette):
-                        raise ValueError(f"Invalid pixel index at [{row_idx}][{col_idx}]: {pixel_index}")
-                    
-                    # Get color from palette
-                    color = palette[pixel_index]
-                    pixel_row.append(color)
-                
-                pixel_matrix.append(pixel_row)
+            # Validate and pack palette indices
+            indices = self._pack_palette_indices(pixels, width, height, len(palette))
             
             return {
-                "pixel_matrix": pixel_matrix,
+                "indices": indices,
                 "width": width,
                 "height": height,
                 "palette": palette,
@@ -1323,6 +2719,97 @@ class MugService:
             self.logger.error(f"Failed to process palette pixel art: {str(e)}")
             raise
 
+    # One regex per row: comma-joined "#rrggbb" tokens ("#" optional when packing raw frames,
+    # which also accept "#rrggbbaa" with the alpha ignored)
+    _HEX_ROW_RE = re.compile(r'#[0-9A-Fa-f]{6}(?:,#[0-9A-Fa-f]{6})*')
+    _LOOSE_HEX_ROW_RE = re.compile(r'#?[0-9A-Fa-f]{6}(?:,#?[0-9A-Fa-f]{6})*')
+    _LOOSE_HEX8_ROW_RE = re.compile(r'#?[0-9A-Fa-f]{8}(?:,#?[0-9A-Fa-f]{8})*')
+
+    def _pack_pixel_matrix(self, pattern: List, width: int, height: int, require_hash: bool = True) -> bytes:
+        """Validate a 2D pixel array and pack it into RGB888 bytes
+
+        Each row is checked in bulk: hex rows with a single regex match over
+        the joined row, RGB/RGBA rows with ``bytes()`` over the flattened
+        components. Rows that fail the bulk check (or mix formats) fall back to
+        a per-pixel scan that reports the exact [row][col] position.
+
+        Args:
+            pattern: 2D array of "#rrggbb" strings or RGB/RGBA lists
+            width: Expected width
+            height: Expected height
+            require_hash: Whether hex colors must start with "#"; without it
+                "#rrggbbaa" is accepted too (alpha ignored), as raw frames always were
+
+        Returns:
+            Packed RGB bytes, row-major, 3 bytes per pixel
+        """
+        if len(pattern) != height:
+            raise ValueError(f"Pattern height {len(pattern)} doesn't match specified height {height}")
+        
+        hex_row_re = self._HEX_ROW_RE if require_hash else self._LOOSE_HEX_ROW_RE
+        packed_rows = []
+        for row_idx, row in enumerate(pattern):
+            if not isinstance(row, list):
+                raise ValueError(f"Row {row_idx} is not a list")
+            if len(row) != width:
+                raise ValueError(f"Row {row_idx} width {len(row)} doesn't match specified width {width}")
+            
+            packed_row = None
+            try:
+                if width and isinstance(row[0], str):
+                    joined = ",".join(row)
+                    # The comma count guarantees no single pixel spans several tokens
+                    if joined.count(",") == width - 1 and hex_row_re.fullmatch(joined):
+                        packed_row = bytes.fromhex(joined.replace(",", "").replace("#", ""))
+                    elif not require_hash and joined.count(",") == width - 1 and self._LOOSE_HEX8_ROW_RE.fullmatch(joined):
+                        rgba = bytes.fromhex(joined.replace(",", "").replace("#", ""))
+                        packed_row = bytearray(width * 3)
+                        packed_row[0::3] = rgba[0::4]
+                        packed_row[1::3] = rgba[1::4]
+                        packed_row[2::3] = rgba[2::4]
+                elif width:
+                    component_counts = set(map(len, row))
+                    if component_counts == {3}:
+                        packed_row = bytes(itertools.chain.from_iterable(row))
+                    elif component_counts == {4}:
+                        rgba = bytes(itertools.chain.from_iterable(row))
+                        packed_row = bytearray(width * 3)
+                        packed_row[0::3] = rgba[0::4]
+                        packed_row[1::3] = rgba[1::4]
+                        packed_row[2::3] = rgba[2::4]
+                else:
+                    packed_row = b""
+            except (TypeError, ValueError):
+                packed_row = None
+            
+            if packed_row is None:
+                packed_row = self._pack_pixel_row_slow(row, row_idx, require_hash)
+            packed_rows.append(packed_row)
+        
+        return b"".join(packed_rows)
+
+    def _pack_pixel_row_slow(self, row: List, row_idx: int, require_hash: bool = True) -> bytes:
+        """Per-pixel validation and packing, used for mixed rows and error reporting"""
+        hex_re = r'^#[0-9A-Fa-f]{6}$' if require_hash else r'^#?[0-9A-Fa-f]{6}(?:[0-9A-Fa-f]{2})?$'
+        packed_row = bytearray()
+        for col_idx, pixel in enumerate(row):
+            if isinstance(pixel, str):
+                # Hex color validation
+                if not re.match(hex_re, pixel):
+                    raise ValueError(f"Invalid color format at [{row_idx}][{col_idx}]: {pixel}")
+                packed_row += bytes.fromhex(pixel.lstrip('#')[:6])
+            elif isinstance(pixel, (list, tuple)):
+                # RGB/RGBA values
+                if len(pixel) not in [3, 4]:
+                    raise ValueError(f"Invalid RGB/RGBA format at [{row_idx}][{col_idx}]: {pixel}")
+                for component in pixel:
+                    if not isinstance(component, int) or component < 0 or component > 255:
+                        raise ValueError(f"Invalid RGB component at [{row_idx}][{col_idx}]: {component}")
+                packed_row += bytes(pixel[:3])
+            else:
+                raise ValueError(f"Invalid pixel format at [{row_idx}][{col_idx}]: {type(pixel)}")
+        return bytes(packed_row)
+
     def _validate_pixel_pattern(self, pattern: Union[List, str], width: int, height: int) -> bool:
         """Validate pixel art pattern"""
         if isinstance(pattern, str):
@@ -1337,30 +2824,8 @@ class MugService:
                 raise ValueError(f"Invalid base64 pattern: {str(e)}")
         
         elif isinstance(pattern, list):
-            # 2D array of colors
-            if len(pattern) != height:
-                raise ValueError(f"Pattern height {len(pattern)} doesn't match specified height {height}")
-            
-            for row_idx, row in enumerate(pattern):
-                if not isinstance(row, list):
-                    raise ValueError(f"Row {row_idx} is not a list")
-                if len(row) != width:
-                    raise ValueError(f"Row {row_idx} width {len(row)} doesn't match specified width {width}")
-                
-                for col_idx, pixel in enumerate(row):
-                    if isinstance(pixel, str):
-                        # Hex color validation
-                        if not re.match(r'^#[0-9A-Fa-f]{6}$', pixel):
-                            raise ValueError(f"Invalid color format at [{row_idx}][{col_idx}]: {pixel}")
-                    elif isinstance(pixel, (list, tuple)):
-                        # RGB/RGBA values
-                        if len(pixel) not in [3, 4]:
-                            raise ValueError(f"Invalid RGB/RGBA format at [{row_idx}][{col_idx}]: {pixel}")
-                        for component in pixel:
-                            if not isinstance(component, int) or component < 0 or component > 255:
-                                raise ValueError(f"Invalid RGB component at [{row_idx}][{col_idx}]: {component}")
-                    else:
-                        raise ValueError(f"Invalid pixel format at [{row_idx}][{col_idx}]: {type(pixel)}")
+            # 2D array of colors, validated row by row while packing
+            self._pack_pixel_matrix(pattern, width, height)
             return True
         
         else:
@@ -1509,16 +2974,32 @@ class MugService:
         
         return True
 
-    def convert_image_to_pixels(self, image_data: str, target_width: int = 16, target_height: int = 16, resize_method: str = "nearest") -> Dict[str, Any]:
-        """Convert base64 image to pixel matrix"""
+    def convert_image_to_pixels(self, image_data: Union[str, Dict[str, Any]], target_width: int = 16, target_height: int = 16, resize_method: str = "nearest",
+                                max_colors: Optional[int] = None, dither: str = "none", output_format: str = "matrix") -> Dict[str, Any]:
+        """Convert base64 image to pixel matrix, optionally reduced to max_colors via the LUT quantizer
+
+        output_format selects the encoding of the result:
+        - "matrix": pixel_matrix of "#rrggbb" strings
+        - "palette": palette + pixels indices (at most 16 colors), accepted as-is by send_pixel_image
+        - "rgb888" / "rgb565": base64 pixel_data, row-major (rgb565 is big-endian),
+          also accepted as-is by send_pixel_image
+        """
         try:
             # Validate parameters
             if target_width < 1 or target_width > 128:
                 raise ValueError("target_width must be between 1 and 128")
             if target_height < 1 or target_height > 128:
                 raise ValueError("target_height must be between 1 and 128")
-            if resize_method not in ["nearest", "bilinear", "bicubic"]:
-                raise ValueError("resize_method must be one of: nearest, bilinear, bicubic")
+            if resize_method not in ["nearest", "bilinear", "bicubic", "area"]:
+                raise ValueError("resize_method must be one of: nearest, bilinear, bicubic, area")
+            if max_colors is not None and (max_colors < 1 or max_colors > 256):
+                raise ValueError("max_colors must be between 1 and 256")
+            if dither not in color_quantizer.DITHER_MODES:
+                raise ValueError(f"dither must be one of: {', '.join(color_quantizer.DITHER_MODES)}")
+            if output_format not in self.PIXEL_OUTPUT_FORMATS:
+                raise ValueError(f"output_format must be one of: {', '.join(self.PIXEL_OUTPUT_FORMATS)}")
+            if output_format == "palette" and max_colors is not None and max_colors > 16:
+                raise ValueError("max_colors cannot exceed 16 for palette output")
             
             # Check if PIL is available
             if not PIL_AVAILABLE:
@@ -1526,17 +3007,16 @@ class MugService:
                 self.logger.warning("PIL not available, using fallback pattern generation")
                 return self._generate_fallback_pattern(target_width, target_height, image_data)
             
-            # Decode base64 image
-            try:
-                image_bytes = base64.b64decode(image_data)
-            except Exception as e:
-                raise ValueError(f"Invalid base64 image data: {str(e)}")
+            # Decode base64 image and open it with PIL (skipped for normalized input)
+            image = self._decode_image_input(image_data, "convert_image_to_pixels")["image"]
             
-            # Open image with PIL
-            try:
-                image = Image.open(io.BytesIO(image_bytes))
-            except Exception as e:
-                raise ValueError(f"Cannot open image: {str(e)}")
+            # Get original image info (header only, nothing decoded yet)
+            original_size = image.size
+            
+            # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding;
+            # draft never goes below the requested size
+            if image.format == 'JPEG':
+                image.draft('RGB', (target_width, target_height))
             
             # Convert to RGB if necessary
             if image.mode != 'RGB':
@@ -1546,26 +3026,33 @@ class MugService:
             resize_filters = {
                 "nearest": Image.NEAREST,
                 "bilinear": Image.BILINEAR, 
-                "bicubic": Image.BICUBIC
+                "bicubic": Image.BICUBIC,
+                "area": Image.BOX
             }
             
+            # Staged downscaling: a cheap integer box reduce() first, keeping at
+            # least 2x the target so the final filter still has pixels to work with.
+            # Nearest keeps plain point sampling.
+            if resize_method != "nearest":
+                reduce_factor = min(image.width // (target_width * 2), image.height // (target_height * 2))
+                if reduce_factor > 1:
+                    image = image.reduce(reduce_factor)
+            
             resized_image = image.resize((target_width, target_height), resize_filters[resize_method])
             
-            # Convert to pixel matrix
-            pixel_matrix = []
-            for y in range(target_height):
-                row = []
-                for x in range(target_width):
-                    r, g, b = resized_image.getpixel((x, y))
-                    hex_color = f"#{r:02x}{g:02x}{b:02x}"
-                    row.append(hex_color)
-                pixel_matrix.append(row)
-            
-            # Get original image info
-            original_size = image.size
+            # Palette output always reduces colors (16 at most, the palette format limit)
+            if output_format == "palette" and max_colors is None:
+                max_colors = 16
+            
+            # Optionally reduce colors: palette derived from the resized image, mapped through its LUT
+            palette_image = None
+            if max_colors is not None:
+                palette = color_quantizer.derive_palette([resized_image], max_colors)
+                quantizer = color_quantizer.get_quantizer(palette)
+                palette_image = quantizer.quantize(resized_image, dither)
+                resized_image = palette_image.convert('RGB')
             
             result = {
-                "pixel_matrix": pixel_matrix,
                 "width": target_width,
                 "height": target_height,
                 "original_size": {
@@ -1581,7 +3068,30 @@ class MugService:
                 }
             }
             
-            self.logger.info(f"Successfully converted image from {original_size} to {target_width}x{target_height} pixel matrix")
+            # Encode pixels in the requested output format
+            if output_format == "matrix":
+                result["pixel_matrix"] = self._image_to_pixel_matrix(resized_image)
+            elif output_format == "palette":
+                flat_palette = palette_image.getpalette()[:3 * len(palette)]
+                indices = palette_image.tobytes()
+                result["palette"] = ["#" + bytes(flat_palette[i:i + 3]).hex() for i in range(0, len(flat_palette), 3)]
+                result["pixels"] = [list(indices[row_start:row_start + target_width])
+                                    for row_start in range(0, target_width * target_height, target_width)]
+                result["format_info"]["converted_mode"] = "P"
+                result["format_info"]["pixel_format"] = "palette_indices"
+            else:
+                rgb = resized_image.tobytes()
+                if output_format == "rgb565":
+                    rgb = self._pack_rgb565(rgb)
+                result["pixel_data"] = base64.b64encode(rgb).decode('ascii')
+                result["pixel_format"] = output_format
+                result["format_info"]["pixel_format"] = output_format
+            result["output_format"] = output_format
+            if max_colors is not None:
+                result["format_info"]["max_colors"] = max_colors
+                result["format_info"]["dither"] = dither
+            
+            self.logger.info(f"Successfully converted image from {original_size} to {target_width}x{target_height} {output_format} output")
             return result
             
         except Exception as e:
@@ -1608,6 +3118,7 @@ class MugService:
             
             # Send request to get device status
             resp = client.DescribeDevice(req)
+            self._record_presence(product_id, [(device_name, self._presence_state(resp.Device))])
             
             result = {
                 "status": "success",
@@ -1635,7 +3146,24 @@ class MugService:
             self.logger.error(f"Failed to get device status: {str(e)}")
             raise
 
-    def send_display_text(self, product_id: str, device_name: str, text: str, use_direct_credentials: bool = True) -> Dict[str, Any]:
+    def get_device_profile(self, product_id: Optional[str] = None) -> Dict[str, Any]:
+        """Return the display profile used to render assets for a product"""
+        profile = device_profiles.get_profile(product_id)
+        result = profile.to_dict()
+        result["product_id"] = product_id
+        result["is_default"] = profile is device_profiles.get_device_profile_registry().DEFAULT_PROFILE
+        return result
+
+    def get_asset_cache_stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and tier sizes of the rendered-asset cache, with speculative render
+        and device command queue stats"""
+        stats = asset_cache.get_asset_cache().get_stats()
+        stats["speculation"] = speculation.get_speculator().get_stats()
+        stats["command_queue"] = command_queue.get_command_queue().get_stats()
+        return stats
+
+    def send_display_text(self, product_id: str, device_name: str, text: str, use_direct_credentials: bool = True,
+                          offline_policy: str = "ignore") -> Dict[str, Any]:
         """Send text to display on smart mug screen via CallDeviceActionAsync
         
         Args:
@@ -1643,7 +3171,18 @@ class MugService:
             device_name: Device name
             text: Text to display
             use_direct_credentials: If True, use sub-account credentials directly without STS
+            offline_policy: "ignore", "fail" or "defer" when the device is known to be offline
         """
+        deferred = self._check_offline_policy(product_id, device_name, offline_policy, lambda: self.send_display_text(
+            product_id, device_name, text, use_direct_credentials))
+        if deferred:
+            return deferred
+        return self._queued_send(product_id, device_name, lambda: self._send_display_text_now(
+            product_id, device_name, text, use_direct_credentials))
+
+    def _send_display_text_now(self, product_id: str, device_name: str, text: str,
+                               use_direct_credentials: bool) -> Dict[str, Any]:
+        """Encode and send display text right away (runs on the device's queue)"""
         try:
             # 1. Handle text input (could be str or bytes)
             processed_text = None
@@ -1721,7 +3260,12 @@ class MugService:
             req.from_json_string(json.dumps(params))
             
             # Send request to device
-            resp = client.CallDeviceActionAsync(req)
+            try:
+                resp = client.CallDeviceActionAsync(req)
+            except Exception as e:
+                self._note_action_error(product_id, device_name, e)
+                raise
+            self._track_action(client, product_id, device_name, resp.ClientToken, "run_display_text")
             
             result = {
                 "status": "success",
@@ -2079,6 +3623,35 @@ if FASTAPI_AVAILABLE:
                 detail=f"Failed to send display text: {str(e)}"
             )
     
+    @app.post("/device/event")
+    async def device_event_endpoint(
+        pid: str = Query(..., description="Product ID"),
+        dn: str = Query(..., description="Device name"),
+        event: str = Query(..., description="online, offline or a device event ID"),
+        data: Optional[str] = Query(None, description="Event data (JSON), completes the action whose client_token it carries")
+    ):
+        """
+        Receive device events forwarded by the IoT Explorer rule engine
+        
+        Keeps the device presence cache current, so sends with offline_policy
+        fail fast or defer without querying the device first.
+        """
+        try:
+            result = mug_service.handle_device_event(pid, dn, event, data)
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "code": 0,
+                    "message": "Device event applied",
+                    "data": result
+                }
+            )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Parameter error: {str(e)}"
+            )
+    
     @app.get("/health")
     async def health_check():
         """Health check endpoint"""
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Playlist Scheduler Module
+Server-side timed content rotation for many devices
+
+Each device can have a playlist of items (a display command plus how long
+it stays on screen). All playlists share one min-heap of due times and a
+single timer thread that sleeps until the earliest slot, so an idle
+scheduler costs nothing and each push costs O(log n) however many devices
+are scheduled. Due items are handed to a small worker pool; the timer
+thread never waits on the network. Slots are planned from the previous
+slot's due time, not from when its push finished, so rotations do not
+drift; a scheduler that fell behind by more than a slot skips ahead
+instead of bursting.
+
+Replacing or clearing a playlist bumps its generation; heap entries of
+older generations are discarded lazily when they come up.
+
+Configuration:
+    PLAYLIST_WORKERS  concurrent pushes (default 8)
+"""
+
+import os
+import time
+import heapq
+import logging
+import datetime
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Hashable, List, Optional, Tuple
+
+
+class PlaylistScheduler:
+    """Per-device playlists driven by one heap-based timer thread"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        Args:
+            max_workers: Concurrent pushes (default: PLAYLIST_WORKERS or 8)
+        """
+        self.logger = logging.getLogger(__name__)
+        if max_workers is None:
+            max_workers = int(os.getenv("PLAYLIST_WORKERS", "8"))
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="playlist")
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[float, int, Hashable, int]] = []  # (due, seq, key, generation)
+        self._seq = itertools.count()
+        self._generations = itertools.count(1)
+        self._playlists: Dict[Hashable, Dict[str, Any]] = {}
+        self._stats = {"pushes": 0, "errors": 0, "max_late_ms": 0.0}
+        self._timer: Optional[threading.Thread] = None
+
+    def set_playlist(self, key: Hashable, items: List[Dict[str, Any]], dispatch: Callable[[Dict[str, Any]], Any],
+                     loop: bool = True, start_delay_sec: float = 0):
+        """
+        Install (or replace) a device's playlist
+
+        Args:
+            key: Device key, e.g. (product_id, device_name)
+            items: Items with at least "duration_sec"; passed to dispatch as is
+            dispatch: Callable pushing one item to the device, run on a worker thread
+            loop: Start over after the last item
+            start_delay_sec: Delay before the first item
+        """
+        due = time.monotonic() + max(0.0, start_delay_sec)
+        with self._cond:
+            generation = next(self._generations)
+            self._playlists[key] = {
+                "items": list(items),
+                "dispatch": dispatch,
+                "loop": loop,
+                "generation": generation,
+                "index": 0,
+                "next_due": due,
+                "finished": False,
+                "pushes": 0,
+                "errors": 0,
+                "last_push": None
+            }
+            heapq.heappush(self._heap, (due, next(self._seq), key, generation))
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run, name="playlist-timer", daemon=True)
+                self._timer.start()
+            self._cond.notify()
+
+    def clear_playlist(self, key: Hashable) -> bool:
+        """Stop and remove a playlist; True if there was one"""
+        with self._cond:
+            # Its heap entry becomes stale and is dropped when it comes up
+            return self._playlists.pop(key, None) is not None
+
+    def get_playlist(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """Return a playlist's position and push counters, None if there is none"""
+        with self._cond:
+            playlist = self._playlists.get(key)
+            if playlist is None:
+                return None
+            return {
+                "item_count": len(playlist["items"]),
+                "loop": playlist["loop"],
+                "next_index": playlist["index"],
+                "next_due_in_sec": None if playlist["finished"] else round(max(0.0, playlist["next_due"] - time.monotonic()), 3),
+                "finished": playlist["finished"],
+                "pushes": playlist["pushes"],
+                "errors": playlist["errors"],
+                "last_push": dict(playlist["last_push"]) if playlist["last_push"] else None
+            }
+
+    def _run(self):
+        """Timer thread: sleep until the earliest due slot, hand it out, plan the next one"""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, key, generation = self._heap[0]
+                playlist = self._playlists.get(key)
+                if playlist is None or playlist["generation"] != generation:
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                self._stats["max_late_ms"] = max(self._stats["max_late_ms"], round((now - due) * 1000, 1))
+                index = playlist["index"]
+                item = playlist["items"][index]
+                self._executor.submit(self._push, key, generation, index, item, playlist["dispatch"])
+
+                next_index = index + 1
+                if next_index >= len(playlist["items"]):
+                    if not playlist["loop"]:
+                        playlist["finished"] = True
+                        continue
+                    next_index = 0
+                next_due = due + item["duration_sec"]
+                if next_due <= now:
+                    # Fell behind by a whole slot: skip ahead rather than burst
+                    next_due = now + item["duration_sec"]
+                playlist["index"] = next_index
+                playlist["next_due"] = next_due
+                heapq.heappush(self._heap, (next_due, next(self._seq), key, generation))
+
+    def _push(self, key: Hashable, generation: int, index: int, item: Dict[str, Any], dispatch: Callable):
+        """Push one item (worker thread) and record the outcome on the playlist"""
+        push = {"index": index, "at": datetime.datetime.utcnow().isoformat() + "Z"}
+        try:
+            result = dispatch(item)
+            push["status"] = result.get("status", "success") if isinstance(result, dict) else "success"
+        except Exception as e:
+            self.logger.warning(f"Playlist push {key} #{index} failed: {str(e)}")
+            push.update(status="error", error=str(e))
+
+        with self._cond:
+            self._stats["errors" if push["status"] == "error" else "pushes"] += 1
+            playlist = self._playlists.get(key)
+            if playlist is not None and playlist["generation"] == generation:
+                playlist["errors" if push["status"] == "error" else "pushes"] += 1
+                playlist["last_push"] = push
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return playlist and push counters"""
+        with self._cond:
+            return dict(self._stats, playlists=len(self._playlists),
+                        active=sum(1 for playlist in self._playlists.values() if not playlist["finished"]),
+                        scheduled=len(self._heap))
+
+
+# Global instance
+_playlist_scheduler = None
+_playlist_scheduler_lock = threading.Lock()
+
+
+def get_playlist_scheduler() -> PlaylistScheduler:
+    """Get the playlist scheduler singleton"""
+    global _playlist_scheduler
+    with _playlist_scheduler_lock:
+        if _playlist_scheduler is None:
+            _playlist_scheduler = PlaylistScheduler()
+        return _playlist_scheduler
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Render Engine Module
+Runs CPU-bound image work (decode, resize, quantize, GIF encode) in a
+pre-warmed process pool so concurrent requests are not serialized by the GIL
+
+Jobs only exchange compact data with the workers: encoded image bytes in,
+GIF bytes or packed RGB frames out; hex pixel matrices never cross the
+process boundary.
+
+Worker count comes from RENDER_WORKERS (default: CPU count - 1, at most 4);
+0 runs every job inline in the calling process.
+"""
+
+import os
+import sys
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional, Union
+
+# 导入GIF缩放模块（mug_service在任务中延迟导入，避免循环导入）
+try:
+    from . import gif_resizer
+except ImportError:
+    # 如果相对导入失败，尝试绝对导入（适用于直接运行脚本的情况）
+    import gif_resizer
+
+
+def _default_worker_count() -> int:
+    """Worker count from RENDER_WORKERS, or CPU count - 1 capped at 4"""
+    configured = os.getenv("RENDER_WORKERS")
+    if configured is not None and configured.strip() != "":
+        return max(0, int(configured))
+    return max(0, min(4, (os.cpu_count() or 1) - 1))
+
+
+# ----------------------------------------------------------------------
+# Worker-side jobs (module level so they can be pickled by name)
+# ----------------------------------------------------------------------
+
+def _init_worker():
+    """Import PIL and the rendering modules once per worker process"""
+    # stdout may be the JSON-RPC channel of a stdio server; worker output goes to stderr
+    sys.stdout = sys.stderr
+    from PIL import Image
+    Image.init()
+    from mug_service import mug_service  # noqa: F401  (imports gif_resizer, color_quantizer, ...)
+
+
+def _ping() -> int:
+    """Warm-up task, returns the worker PID"""
+    return os.getpid()
+
+
+def _job_create_gif(frames: List[Dict[str, Any]], frame_delay: int, loop_count: int, profile) -> bytes:
+    from mug_service import mug_service
+    return mug_service._create_gif_from_frames(frames, frame_delay, loop_count, profile)
+
+
+def _job_process_frames(image_data: Union[str, bytes], target_width: int, target_height: int) -> List[Dict[str, Any]]:
+    from mug_service import mug_service
+    return mug_service._process_gif_to_frames(image_data, target_width, target_height, packed=True)
+
+
+def _job_render_frames_gif(image_data: Union[str, bytes], target_width: int, target_height: int,
+                           frame_delay: int, loop_count: int, profile) -> Dict[str, Any]:
+    from mug_service import mug_service
+    return mug_service._render_frames_to_gif(image_data, target_width, target_height, frame_delay, loop_count, profile)
+
+
+def _job_resize_gif(gif_bytes: bytes, profile) -> bytes:
+    # Only the decode/encode runs in the worker; the cache and counters live in the parent's resizer
+    return gif_resizer.get_gif_resizer(profile).render_resized(gif_bytes)
+
+
+def _job_convert_image(image_data: Union[str, bytes], *args) -> Dict[str, Any]:
+    from mug_service import mug_service
+    return mug_service.convert_image_to_pixels(image_data, *args)
+
+
+class RenderEngine:
+    """Process pool for rendering jobs, with inline fallback"""
+
+    def __init__(self, workers: Optional[int] = None, start_method: Optional[str] = None):
+        """
+        Args:
+            workers: Number of worker processes, 0 for inline execution
+                (default: RENDER_WORKERS or CPU count - 1, at most 4)
+            start_method: multiprocessing start method (default: RENDER_START_METHOD or "spawn")
+        """
+        self.logger = logging.getLogger(__name__)
+        self.workers = _default_worker_count() if workers is None else max(0, workers)
+        self.start_method = start_method or os.getenv("RENDER_START_METHOD", "spawn")
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._stats = {"pool_jobs": 0, "inline_jobs": 0, "pool_restarts": 0}
+
+    def start(self) -> "RenderEngine":
+        """Start the pool and wait until every worker has imported PIL"""
+        if self.workers == 0:
+            return self
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.start_method)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                     initializer=_init_worker)
+                executor = self._executor
+            else:
+                return self
+        pids = {future.result() for future in [executor.submit(_ping) for _ in range(self.workers)]}
+        self.logger.info(f"Render engine started with {len(pids)} warm worker(s) ({self.start_method})")
+        return self
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def submit(self, fn, *args) -> Future:
+        """Run a job in the pool (or inline when disabled) and return its future"""
+        if self.workers == 0:
+            return self._run_inline(fn, *args)
+        self.start()
+        try:
+            future = self._executor.submit(fn, *args)
+            self._count("pool_jobs")
+            return future
+        except (BrokenProcessPool, RuntimeError, AttributeError) as e:
+            # A crashed worker breaks the whole pool: replace it and run this job inline
+            self.logger.warning(f"Render pool unavailable ({str(e)}), restarting and running job inline")
+            self.shutdown(wait=False)
+            self._count("pool_restarts")
+            return self._run_inline(fn, *args)
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _run_inline(self, fn, *args) -> Future:
+        future = Future()
+        self._count("inline_jobs")
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _run(self, fn, *args):
+        future = self.submit(fn, *args)
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            self.logger.warning(f"Render worker died ({str(e)}), retrying job inline")
+            self.shutdown(wait=False)
+            self._count("pool_restarts")
+            return self._run_inline(fn, *args).result()
+
+    def _portable(self, image_data: Union[str, bytes, Dict[str, Any]]) -> Union[str, bytes, Dict[str, Any]]:
+        """Normalized inputs (with an open PIL image) are reused inline, sent to workers as raw bytes"""
+        if self.workers and isinstance(image_data, dict):
+            return image_data["bytes"]
+        return image_data
+
+    # ------------------------------------------------------------------
+    # Jobs
+    # ------------------------------------------------------------------
+
+    def create_gif(self, frames: List[Dict[str, Any]], frame_delay: int = 100, loop_count: int = 0, profile=None) -> bytes:
+        """Encode frames (packed rgb / palette indices / pixel_matrix) into a device-sized GIF"""
+        return self._run(_job_create_gif, frames, frame_delay, loop_count, profile)
+
+    def process_frames(self, image_data: Union[str, bytes, Dict[str, Any]], target_width: int = 16,
+                       target_height: int = 16) -> List[Dict[str, Any]]:
+        """Decode an image/animation into resized frames with packed RGB bytes"""
+        return self._run(_job_process_frames, self._portable(image_data), target_width, target_height)
+
+    def render_frames_gif(self, image_data: Union[str, bytes, Dict[str, Any]], target_width: int = 16,
+                          target_height: int = 16, frame_delay: int = 100, loop_count: int = 0,
+                          profile=None) -> Dict[str, Any]:
+        """Decode an image/animation and stream its resized frames into a device GIF ({gif_bytes, frame_count})"""
+        return self._run(_job_render_frames_gif, self._portable(image_data), target_width, target_height,
+                         frame_delay, loop_count, profile)
+
+    def resize_gif(self, gif_bytes: bytes, profile=None, image=None, report: Optional[Dict[str, Any]] = None) -> bytes:
+        """Resize a GIF to the device profile's standard size (an already opened image is reused inline)
+
+        report, when given, receives the resizer's frame counts (see gif_resizer)
+        """
+        if self.workers == 0:
+            self._count("inline_jobs")
+            return gif_resizer.resize_gif_to_standard(gif_bytes, image=image, profile=profile, report=report)
+        resizer = gif_resizer.get_gif_resizer(profile)
+        return resizer.resize_gif_to_standard(gif_bytes, report=report,
+                                              render=lambda data: self._run(_job_resize_gif, data, profile))
+
+    def convert_image(self, image_data: Union[str, bytes, Dict[str, Any]], *args) -> Dict[str, Any]:
+        """convert_image_to_pixels in a worker (same arguments after image_data)"""
+        return self._run(_job_convert_image, self._portable(image_data), *args)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return worker configuration and job counters"""
+        return dict(self._stats, workers=self.workers, running=self._executor is not None)
+
+
+# Global instance
+_render_engine = None
+_render_engine_lock = threading.Lock()
+
+
+def get_render_engine() -> RenderEngine:
+    """Get the render engine singleton"""
+    global _render_engine
+    with _render_engine_lock:
+        if _render_engine is None:
+            _render_engine = RenderEngine()
+        return _render_engine
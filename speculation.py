@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Speculation Module
+Background pre-rendering of assets a client is likely to send next
+
+After convert_image_to_pixels the usual next call is send_pixel_image with
+the same picture. When SPECULATIVE_RENDER is enabled, the server renders
+that GIF (and, when the target device is known, uploads it) on a
+background thread, so the send finds the rendered-asset and COS caches warm.
+
+Speculative work never delays real requests:
+1. Jobs run one at a time on their own thread
+2. Only the newest SPECULATION_MAX_PENDING jobs are kept; older queued ones are cancelled
+3. Jobs not started within SPECULATION_TTL_SEC are cancelled; results not claimed
+   within it are counted as wasted and evicted through the job's evict callback
+   (the rendered GIF is dropped from the asset cache; a pre-upload to COS stays)
+
+Hit rate is claimed results over produced results (a job can produce several).
+
+Configuration:
+    SPECULATIVE_RENDER     enable speculation (default false)
+    SPECULATION_TTL_SEC    how long speculative work stays useful (default 30)
+    SPECULATION_MAX_PENDING  queued jobs kept (default 2)
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+
+class Speculator:
+    """Runs speculative jobs and tracks whether their results get used"""
+
+    def __init__(self, enabled: Optional[bool] = None, ttl_sec: Optional[float] = None,
+                 max_pending: Optional[int] = None):
+        """
+        Args:
+            enabled: Run speculative jobs (default: SPECULATIVE_RENDER)
+            ttl_sec: Lifetime of queued jobs and unclaimed results (default: SPECULATION_TTL_SEC or 30)
+            max_pending: Queued jobs kept, older ones are cancelled (default: SPECULATION_MAX_PENDING or 2)
+        """
+        self.logger = logging.getLogger(__name__)
+        if enabled is None:
+            enabled = os.getenv("SPECULATIVE_RENDER", "false").lower() in ("true", "1", "yes")
+        if ttl_sec is None:
+            ttl_sec = float(os.getenv("SPECULATION_TTL_SEC", "30"))
+        if max_pending is None:
+            max_pending = int(os.getenv("SPECULATION_MAX_PENDING", "2"))
+
+        self.enabled = enabled
+        self.ttl_sec = ttl_sec
+        self.max_pending = max(1, max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculation")
+        self._lock = threading.Lock()
+        self._pending = deque()  # (future, submitted_at, state), oldest first
+        # key -> (completed_at, evict), unclaimed only
+        self._produced: "OrderedDict[str, Tuple[float, Optional[Callable[[str], Any]]]]" = OrderedDict()
+        self._stats = {"submitted": 0, "completed": 0, "cancelled": 0, "failed": 0,
+                       "produced": 0, "hits": 0, "wasted": 0}
+
+    def submit(self, job: Callable[[Callable[[], bool]], List[str]],
+               evict: Optional[Callable[[str], Any]] = None) -> bool:
+        """
+        Queue a speculative job
+
+        Args:
+            job: Callable receiving an is_cancelled() check and returning the cache keys it produced
+            evict: Called with each produced key that goes unclaimed for the TTL
+
+        Returns:
+            True if queued, False when speculation is disabled
+        """
+        if not self.enabled:
+            return False
+
+        submitted_at = time.monotonic()
+        state = {"cancelled": False}
+
+        def is_cancelled() -> bool:
+            return state["cancelled"] or time.monotonic() - submitted_at > self.ttl_sec
+
+        def run():
+            if is_cancelled():
+                self._count("cancelled")
+                return
+            try:
+                keys = job(is_cancelled)
+            except Exception as e:
+                self.logger.warning(f"Speculative job failed: {str(e)}")
+                self._count("failed")
+                return
+            with self._lock:
+                self._stats["completed"] += 1
+                for key in keys or []:
+                    self._stats["produced"] += 1
+                    self._produced[key] = (time.monotonic(), evict)
+                    self._produced.move_to_end(key)
+
+        with self._lock:
+            self._stats["submitted"] += 1
+            wasted = self._expire()
+            # Newest speculation wins: cancel queued jobs beyond the limit
+            self._pending = deque(entry for entry in self._pending if not entry[0].done())
+            while len(self._pending) >= self.max_pending:
+                future, _, old_state = self._pending.popleft()
+                old_state["cancelled"] = True
+                if future.cancel():
+                    self._stats["cancelled"] += 1
+            self._pending.append((self._executor.submit(run), submitted_at, state))
+        self._evict(wasted)
+        return True
+
+    def claim(self, key: str) -> bool:
+        """Mark a speculatively produced key as used by a real request; True if it was speculative"""
+        with self._lock:
+            wasted = self._expire()
+            claimed = self._produced.pop(key, None) is not None
+            if claimed:
+                self._stats["hits"] += 1
+        self._evict(wasted)
+        return claimed
+
+    def _expire(self) -> List[Tuple[str, Callable[[str], Any]]]:
+        """Count unclaimed results older than the TTL as wasted, returns those to evict (lock held)"""
+        deadline = time.monotonic() - self.ttl_sec
+        wasted = []
+        while self._produced:
+            key, (completed_at, evict) = next(iter(self._produced.items()))
+            if completed_at >= deadline:
+                break
+            self._produced.popitem(last=False)
+            self._stats["wasted"] += 1
+            if evict is not None:
+                wasted.append((key, evict))
+        return wasted
+
+    def _evict(self, wasted: List[Tuple[str, Callable[[str], Any]]]):
+        """Evict wasted results (outside the lock)"""
+        for key, evict in wasted:
+            try:
+                evict(key)
+            except Exception as e:
+                self.logger.warning(f"Evicting speculative result {key} failed: {str(e)}")
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return job counters and the hit rate (claimed / produced results)"""
+        with self._lock:
+            wasted = self._expire()
+            stats = dict(self._stats, enabled=self.enabled, unclaimed=len(self._produced))
+        self._evict(wasted)
+        stats["hit_rate"] = stats["hits"] / stats["produced"] if stats["produced"] else 0.0
+        return stats
+
+
+# Global instance
+_speculator = None
+_speculator_lock = threading.Lock()
+
+
+def get_speculator() -> Speculator:
+    """Get the speculator singleton"""
+    global _speculator
+    with _speculator_lock:
+        if _speculator is None:
+            _speculator = Speculator()
+        return _speculator
@@ -3,13 +3,22 @@
 """
 Standard Input/Output MCP Server
 Communicates with clients through stdin/stdout
+
+Requests are handled concurrently. Responses are written in request order
+unless STDIO_ORDERED_RESPONSES=false, in which case each response is
+written as soon as it is ready and clients match them by id.
 """
 
+import os
 import sys
 import json
 import asyncio
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from mcp_server import MCPServer
+import render_engine
 
 
 class StdioServer:
@@ -18,6 +27,11 @@ class StdioServer:
     def __init__(self):
         self.mcp_server = MCPServer()
         self.logger = logging.getLogger(__name__)
+        self._stdout_lock = threading.Lock()
+        # stdin/stdout each get a dedicated thread, so busy request handlers can never starve them
+        self._stdin_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stdin")
+        self._stdout_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stdout")
+        self.ordered_responses = os.getenv("STDIO_ORDERED_RESPONSES", "true").lower() in ("true", "1", "yes")
         
         # Configure logging to stderr to avoid confusion with stdout communication
         self.setup_logging()
@@ -37,6 +51,14 @@ class StdioServer:
         """Run standard input/output server"""
         self.logger.info("PixelMug MCP Standard I/O Server started")
         
+        # Warm up the render worker pool in the background so the first request doesn't pay for it
+        threading.Thread(target=render_engine.get_render_engine().start, daemon=True).start()
+        
+        # Requests are handled concurrently, so rapid display commands for the same device
+        # can be coalesced by the device command queue; responses keep request order
+        # unless STDIO_ORDERED_RESPONSES is off
+        pending = set()
+        previous = None
         try:
             while True:
                 # Read request from stdin
@@ -44,17 +66,13 @@ class StdioServer:
                 if not line:
                     break
                 
-                try:
-                    # Process request
-                    response = await self.mcp_server.handle_request(line)
-                    
-                    # Send response to stdout
-                    await self._write_line(response)
-                    
-                except Exception as e:
-                    self.logger.error(f"Error occurred while processing request: {str(e)}")
-                    error_response = self._create_error_response(None, -32603, str(e))
-                    await self._write_line(error_response)
+                task = asyncio.ensure_future(self._process_line(line, previous if self.ordered_responses else None))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                previous = task
+            
+            if pending:
+                await asyncio.gather(*pending)
         
         except KeyboardInterrupt:
             self.logger.info("Received interrupt signal, shutting down server")
@@ -63,21 +81,38 @@ class StdioServer:
         finally:
             self.logger.info("Server closed")
     
+    async def _process_line(self, line: str, previous: "asyncio.Future" = None):
+        """Handle one request line and write its response (after the previous request's, if given)"""
+        try:
+            # Process request
+            response = await self.mcp_server.handle_request(line)
+        except Exception as e:
+            self.logger.error(f"Error occurred while processing request: {str(e)}")
+            response = self._create_error_response(None, -32603, str(e))
+        
+        if previous is not None:
+            # Keep responses in request order
+            await asyncio.wait([previous])
+        
+        # Send response to stdout
+        await self._write_line(response)
+    
     async def _read_line(self) -> str:
         """Read a line asynchronously"""
         loop = asyncio.get_event_loop()
-        line = await loop.run_in_executor(None, sys.stdin.readline)
+        line = await loop.run_in_executor(self._stdin_executor, sys.stdin.readline)
         return line.strip()
     
     async def _write_line(self, content: str):
         """Write a line asynchronously"""
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._write_stdout, content)
+        await loop.run_in_executor(self._stdout_executor, self._write_stdout, content)
     
     def _write_stdout(self, content: str):
         """Write to standard output"""
-        sys.stdout.write(content + '\n')
-        sys.stdout.flush()
+        with self._stdout_lock:
+            sys.stdout.write(content + '\n')
+            sys.stdout.flush()
     
     def _create_error_response(self, request_id, code: int, message: str) -> str:
         """Create error response"""
@@ -99,4 +134,7 @@ async def main():
 
 
 if __name__ == "__main__":
+    # Frozen (PyInstaller) builds: spawned render workers must run the worker
+    # bootstrap instead of re-executing the server entry point
+    multiprocessing.freeze_support()
     asyncio.run(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Task Graph Module
+Runs the steps of one device command as a small dependency graph
+
+Each step starts as soon as the steps it depends on have finished, so
+independent work (IoT client setup, rendering, ...) overlaps and a
+command takes as long as its critical path instead of the sum of its
+steps. Steps run on a shared thread pool sized by COMMAND_GRAPH_THREADS
+(default 8); CPU-heavy rendering is already offloaded to the render engine.
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
+
+
+class TaskGraph:
+    """Dependency graph of named steps; each step gets its dependencies' results as arguments"""
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        """
+        Args:
+            executor: Thread pool to run steps on (default: the shared command pool)
+        """
+        self._executor = executor or get_command_executor()
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._timings: Dict[str, float] = {}
+
+    def add(self, name: str, fn: Callable, *deps: str) -> "TaskGraph":
+        """
+        Add a step
+
+        Args:
+            name: Step name
+            fn: Callable receiving the results of deps in order
+            *deps: Names of steps that must finish first (added before this one)
+        """
+        if name in self._tasks:
+            raise ValueError(f"Duplicate task: {name}")
+        for dep in deps:
+            if dep not in self._tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+        self._tasks[name] = {"fn": fn, "deps": deps, "future": Future()}
+        return self
+
+    def _start(self, name: str):
+        task = self._tasks[name]
+        dep_futures = [self._tasks[dep]["future"] for dep in task["deps"]]
+        for dep_future in dep_futures:
+            if dep_future.exception() is not None:
+                task["future"].set_exception(dep_future.exception())
+                return
+
+        def run():
+            started = time.perf_counter()
+            try:
+                result = task["fn"](*[f.result() for f in dep_futures])
+            except BaseException as e:
+                self._timings[name] = round((time.perf_counter() - started) * 1000, 2)
+                task["future"].set_exception(e)
+                return
+            # Timing is recorded before completion so run() always returns it
+            self._timings[name] = round((time.perf_counter() - started) * 1000, 2)
+            task["future"].set_result(result)
+
+        self._executor.submit(run)
+
+    def run(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Start every step as its dependencies complete and wait for all of them
+
+        Returns:
+            Dict of step name to result
+
+        Raises:
+            The first failing step's exception (in insertion order)
+        """
+        lock = threading.Lock()
+        pending = {name: len(task["deps"]) for name, task in self._tasks.items()}
+        dependents: Dict[str, List[str]] = {name: [] for name in self._tasks}
+        for name, task in self._tasks.items():
+            for dep in task["deps"]:
+                dependents[dep].append(name)
+
+        def on_done(name):
+            def callback(_):
+                ready = []
+                with lock:
+                    for dependent in dependents[name]:
+                        pending[dependent] -= 1
+                        if pending[dependent] == 0:
+                            ready.append(dependent)
+                for dependent in ready:
+                    self._start(dependent)
+            return callback
+
+        for name, task in self._tasks.items():
+            task["future"].add_done_callback(on_done(name))
+        for name, count in list(pending.items()):
+            if count == 0:
+                self._start(name)
+
+        return {name: task["future"].result(timeout) for name, task in self._tasks.items()}
+
+    def get_timings(self) -> Dict[str, float]:
+        """Milliseconds spent in each finished step"""
+        return dict(self._timings)
+
+
+# Shared pool for command steps
+_command_executor = None
+_command_executor_lock = threading.Lock()
+
+
+def get_command_executor() -> ThreadPoolExecutor:
+    """Get the shared thread pool for command steps"""
+    global _command_executor
+    with _command_executor_lock:
+        if _command_executor is None:
+            workers = int(os.getenv("COMMAND_GRAPH_THREADS", "8"))
+            _command_executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="command-step")
+        return _command_executor
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for asset_cache.py
+Covers key stability, the memory/disk tiers and the cached render path of mug_service
+"""
+
+import io
+import os
+import stat
+import base64
+
+import pytest
+from PIL import Image
+
+import asset_cache
+from asset_cache import AssetCache, make_asset_key
+from mug_service import mug_service
+
+
+def test_asset_key_is_stable_and_parameter_sensitive(monkeypatch):
+    """Keys depend on content and parameters, not on dict ordering"""
+    pixels = {"palette": ["#000000", "#ffffff"], "pixels": [[0, 1], [1, 0]]}
+    reordered = {"pixels": [[0, 1], [1, 0]], "palette": ["#000000", "#ffffff"]}
+    key = make_asset_key("pixel_image", pixels, target_width=16, target_height=16)
+    assert key == make_asset_key("pixel_image", reordered, target_height=16, target_width=16)
+    assert key != make_asset_key("pixel_image", pixels, target_width=32, target_height=16)
+    assert key != make_asset_key("gif_animation", pixels, target_width=16, target_height=16)
+    assert make_asset_key("pixel_image", b"abc") != make_asset_key("pixel_image", "abc")
+    # Entries from an older renderer are never reused
+    monkeypatch.setattr(asset_cache, "RENDER_CACHE_VERSION", asset_cache.RENDER_CACHE_VERSION + 1)
+    assert key != make_asset_key("pixel_image", pixels, target_width=16, target_height=16)
+
+
+def test_memory_and_disk_tiers(tmp_path):
+    """Entries survive a memory eviction on disk and are promoted back on hit"""
+    cache = AssetCache(memory_bytes=100, disk_dir=str(tmp_path), disk_bytes=250)
+    cache.put("a", b"A" * 80, {"width": 32})
+    assert cache.get("a")["tier"] == "memory"
+
+    # "b" pushes "a" out of the 100-byte memory tier, the disk tier still has it
+    cache.put("b", b"B" * 80)
+    hit = cache.get("a")
+    assert hit["tier"] == "disk"
+    assert hit["gif_bytes"] == b"A" * 80
+    assert hit["metadata"] == {"width": 32}
+
+    # A new cache over the same directory reuses the files
+    reopened = AssetCache(memory_bytes=100, disk_dir=str(tmp_path), disk_bytes=250)
+    assert reopened.get("b")["tier"] == "disk"
+
+    # Disk budget evicts least recently used ("b" was read after "a" here)
+    reopened.put("c", b"C" * 80)
+    reopened.put("d", b"D" * 80)
+    assert reopened.get("a") is None
+    stats = reopened.get_stats()
+    assert stats["disk_evictions"] == 1
+    assert stats["disk_bytes"] <= 250
+    assert stats["misses"] == 1
+
+
+def test_orphaned_temp_files_removed(tmp_path):
+    """Temp files left by an interrupted write are cleaned up; fresh ones may still be in use"""
+    stale = tmp_path / "abc.gif.123.456.tmp"
+    fresh = tmp_path / "def.gif.123.789.tmp"
+    stale.write_bytes(b"partial")
+    fresh.write_bytes(b"partial")
+    old = stale.stat().st_mtime - 2 * AssetCache.ORPHAN_TEMP_AGE_SEC
+    os.utime(stale, (old, old))
+
+    cache = AssetCache(memory_bytes=100, disk_dir=str(tmp_path))
+    assert not stale.exists()
+    assert fresh.exists()
+    assert cache.get_stats()["disk_entries"] == 0
+
+
+def test_render_reuses_cached_gif(tmp_path, monkeypatch):
+    """Rendering the same image twice for the same profile encodes it once"""
+    monkeypatch.setattr(asset_cache, "_asset_cache", AssetCache(memory_bytes=1024 * 1024, disk_dir=str(tmp_path)))
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), (255, 0, 0)).save(buffer, format='PNG')
+    image_data = base64.b64encode(buffer.getvalue()).decode()
+
+    first = mug_service._render_pixel_image(None, image_data, 16, 16)
+    second = mug_service._render_pixel_image(None, image_data, 16, 16)
+    assert first["cache"] == "miss"
+    assert second["cache"] == "hit-memory"
+    assert second["gif_bytes"] == first["gif_bytes"]
+    assert (second["width"], second["height"]) == (first["width"], first["height"])
+
+    frames = [{"pixel_matrix": [["#00ff00"] * 4] * 4, "duration": 100}] * 2
+    assert mug_service._render_gif_animation(None, frames, 100, 0, 4, 4)["cache"] == "miss"
+    animation = mug_service._render_gif_animation(None, frames, 100, 0, 4, 4)
+    assert animation["cache"] == "hit-memory"
+    assert animation["frame_count"] == 2
+    assert mug_service._render_gif_animation(None, frames, 200, 0, 4, 4)["cache"] == "miss"
+
+
+def test_default_dir_is_private(tmp_path, monkeypatch):
+    """The default state dir is created 0700 and refused when others can access it"""
+    if not hasattr(os, "getuid"):
+        return
+    monkeypatch.setattr(asset_cache.tempfile, "gettempdir", lambda: str(tmp_path))
+    monkeypatch.delenv("ASSET_CACHE_DIR", raising=False)
+    cache = AssetCache(memory_bytes=1024)
+    assert cache.disk_dir == str(tmp_path / f"pixelmug-{os.getuid()}" / "asset_cache")
+    assert stat.S_IMODE(os.stat(tmp_path / f"pixelmug-{os.getuid()}").st_mode) == 0o700
+
+    os.chmod(tmp_path / f"pixelmug-{os.getuid()}", 0o777)
+    with pytest.raises(OSError, match="accessible to other users"):
+        asset_cache.private_state_dir()
+    assert AssetCache(memory_bytes=1024).disk_dir is None
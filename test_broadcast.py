@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for broadcast_pixel_image / broadcast_gif_animation in mug_service.py
+Uses a stand-in IoT client, no network access
+"""
+
+import json
+import time
+import threading
+import types
+
+import pytest
+
+import asset_cache
+from asset_cache import AssetCache
+from mug_service import mug_service
+
+
+class FakeIoTClient:
+    """Records CallDeviceActionAsync calls and the highest concurrency seen"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def CallDeviceActionAsync(self, req):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.calls.append((req.DeviceName, json.loads(req.InputParams)))
+        try:
+            time.sleep(0.02)
+            if req.DeviceName in self.failing:
+                raise RuntimeError("device offline")
+            return types.SimpleNamespace(ClientToken=f"token-{req.DeviceName}", Status="Sent", RequestId="req")
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def test_broadcast_renders_once_and_reports_per_device(tmp_path, monkeypatch):
+    monkeypatch.setattr(asset_cache, "_asset_cache", AssetCache(memory_bytes=1024 * 1024, disk_dir=str(tmp_path)))
+    client = FakeIoTClient(failing={"mug_003"})
+    monkeypatch.setattr(mug_service, "_create_iot_client_with_sts", lambda **kwargs: client)
+    renders = []
+    render = mug_service._render_pixel_image
+    monkeypatch.setattr(mug_service, "_render_pixel_image", lambda *args: renders.append(args) or render(*args))
+
+    devices = [f"mug_{i:03d}" for i in range(1, 9)] + ["mug_001"]
+    result = mug_service.broadcast_pixel_image("PRODUCT", devices, [["#ff0000"] * 4] * 4, 4, 4,
+                                               use_cos=False, max_parallel=3)
+
+    assert len(renders) == 1
+    assert result["status"] == "partial"
+    assert (result["device_count"], result["succeeded"], result["failed"]) == (8, 7, 1)
+    assert [item["device_name"] for item in result["results"]] == devices[:8]
+    assert result["results"][2] == {"device_name": "mug_003", "status": "error", "via": "action", "error": "device offline"}
+    assert result["results"][0]["client_token"] == "token-mug_001"
+    assert client.max_active <= 3
+    # Every device gets the same asset parameters
+    assert len({json.dumps(params, sort_keys=True) for _, params in client.calls}) == 1
+    assert result["image_info"]["width"] == 4
+
+
+def test_product_broadcast_against_stub(tmp_path, monkeypatch):
+    """One broadcast message, per-device fallback only for devices that do not acknowledge"""
+    from iot_stub import IoTStubServer
+
+    monkeypatch.setattr(asset_cache, "_asset_cache", AssetCache(memory_bytes=1024 * 1024, disk_dir=str(tmp_path)))
+    stub = IoTStubServer("H3PI4FBTV5", [f"mug_{i:03d}" for i in range(1, 7)],
+                         offline={"mug_005"}, silent={"mug_006"}).start()
+    try:
+        monkeypatch.setenv("IOT_EXPLORER_ENDPOINT", stub.endpoint)
+        monkeypatch.setenv("IOT_EXPLORER_SCHEME", "http")
+        monkeypatch.setenv("TC_SECRET_ID", "AKIDstub")
+        monkeypatch.setenv("TC_SECRET_KEY", "stub")
+        monkeypatch.setenv("BROADCAST_ACK_TIMEOUT_SEC", "0.2")
+        monkeypatch.setenv("BROADCAST_ACK_POLL_SEC", "0.1")
+
+        result = mug_service.broadcast_pixel_image("H3PI4FBTV5", None, [["#00ff00"] * 4] * 4, 4, 4,
+                                                   use_cos=False, delivery="product_broadcast")
+    finally:
+        stub.stop()
+
+    assert result["delivery"] == "product_broadcast"
+    by_device = {item["device_name"]: item for item in result["results"]}
+    assert [by_device[f"mug_{i:03d}"]["via"] for i in range(1, 5)] == ["broadcast"] * 4
+    assert by_device["mug_006"]["via"] == "fallback" and by_device["mug_006"]["status"] == "success"
+    assert by_device["mug_005"]["status"] == "error"
+    assert (result["succeeded"], result["failed"]) == (5, 1)
+    assert stub.count("PublishBroadcastMessage") == 1
+    assert stub.count("CallDeviceActionAsync") == 2
+
+
+def test_product_broadcast_rejects_device_subset():
+    """A product broadcast reaches every device, so it cannot be aimed at a subset"""
+    with pytest.raises(ValueError, match="omit device_names"):
+        mug_service.broadcast_pixel_image("H3PI4FBTV5", ["mug_001"], [["#00ff00"] * 4] * 4, 4, 4,
+                                          use_cos=False, delivery="product_broadcast")
+
+
+def test_mcp_product_broadcast_lists_devices_once(monkeypatch):
+    """The MCP handler authorizes the listed devices and hands that list to the service"""
+    import asyncio
+    import mcp_server
+
+    listed = []
+    delivered = []
+    monkeypatch.setattr(mug_service, "_list_product_device_names",
+                        lambda product_id, *args: listed.append(product_id) or ["mug_001", "mug_002"])
+    monkeypatch.setattr(mug_service, "_authorize", lambda *args: True)
+    monkeypatch.setattr(mug_service, "_create_iot_client_with_sts", lambda **kwargs: FakeIoTClient())
+    monkeypatch.setattr(mug_service, "_deliver_by_product_broadcast",
+                        lambda client, product_id, device_names, *args: delivered.append(device_names) or [
+                            {"device_name": name, "status": "success", "via": "broadcast"} for name in device_names])
+
+    server = mcp_server.MCPServer()
+    result = asyncio.run(server._handle_broadcast_pixel_image({
+        "product_id": "P", "image_data": [["#00ff00"] * 4] * 4, "target_width": 4, "target_height": 4,
+        "use_cos": False, "delivery": "product_broadcast"}))
+
+    assert listed == ["P"]
+    assert delivered == [["mug_001", "mug_002"]]
+    assert result["succeeded"] == 2
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for color_quantizer.py
+Checks exact palette mapping, dithering modes and the pure-Python fallback
+"""
+
+import io
+import base64
+
+from PIL import Image
+
+import color_quantizer
+from mug_service import mug_service
+
+
+PALETTE = [(0, 0, 0), (255, 255, 255), (255, 0, 0), (0, 128, 255)]
+
+
+def _gradient(width: int = 32, height: int = 16) -> Image.Image:
+    """Horizontal red gradient with a blue bottom half"""
+    image = Image.new('RGB', (width, height))
+    image.putdata([(x * 255 // (width - 1), 0, 200 if y >= height // 2 else 0)
+                   for y in range(height) for x in range(width)])
+    return image
+
+
+def _check_quantizer(quantizer: color_quantizer.LUTQuantizer):
+    """Palette colors map to themselves and every output index is valid"""
+    exact = bytes(component for color in PALETTE for component in color)
+    assert quantizer.map_pixels(exact, len(PALETTE), 1) == bytes(range(len(PALETTE)))
+
+    rgb = _gradient().tobytes()
+    for dither in color_quantizer.DITHER_MODES:
+        indices = quantizer.map_pixels(rgb, 32, 16, dither)
+        assert len(indices) == 32 * 16
+        assert max(indices) < len(PALETTE)
+
+    # Near-black and near-white pick the obvious entries without dithering
+    assert quantizer.map_pixels(bytes([10, 10, 10, 240, 240, 240]), 2, 1) == bytes([0, 1])
+
+
+def test_lut_quantizer_numpy_and_pure_python():
+    """Both lookup paths give exact matches and valid indices"""
+    _check_quantizer(color_quantizer.LUTQuantizer(PALETTE))
+
+    numpy_available = color_quantizer.NUMPY_AVAILABLE
+    color_quantizer.NUMPY_AVAILABLE = False
+    try:
+        _check_quantizer(color_quantizer.LUTQuantizer(PALETTE))
+    finally:
+        color_quantizer.NUMPY_AVAILABLE = numpy_available
+
+
+def test_shared_palette_keeps_exact_colors():
+    """Frames with few colors keep them exactly and share one palette"""
+    frames = [Image.new('RGB', (4, 4), (255, 0, 0)), Image.new('RGB', (4, 4), (0, 0, 255))]
+    quantized = color_quantizer.quantize_frames(frames)
+    assert all(frame.mode == 'P' for frame in quantized)
+    assert quantized[0].getpalette() == quantized[1].getpalette()
+    assert quantized[0].convert('RGB').tobytes() == frames[0].tobytes()
+    assert quantized[1].convert('RGB').tobytes() == frames[1].tobytes()
+
+    assert color_quantizer.get_quantizer(PALETTE) is color_quantizer.get_quantizer(PALETTE)
+
+
+def test_convert_image_with_max_colors():
+    """convert_image_to_pixels reduces colors and validates dither"""
+    buffer = io.BytesIO()
+    _gradient(64, 32).save(buffer, format='PNG')
+    image_b64 = base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    for dither in color_quantizer.DITHER_MODES:
+        result = mug_service.convert_image_to_pixels(image_b64, 16, 16, "area", max_colors=4, dither=dither)
+        colors = {color for row in result["pixel_matrix"] for color in row}
+        assert len(colors) <= 4
+        assert result["format_info"]["dither"] == dither
+
+    try:
+        mug_service.convert_image_to_pixels(image_b64, 16, 16, max_colors=4, dither="random")
+    except ValueError as e:
+        assert "dither must be one of" in str(e)
+    else:
+        raise AssertionError("invalid dither was accepted")
+
+
+if __name__ == "__main__":
+    test_lut_quantizer_numpy_and_pure_python()
+    test_shared_palette_keeps_exact_colors()
+    test_convert_image_with_max_colors()
+    print("✅ Color quantizer tests passed")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for command_queue.py
+Covers per-device ordering, last-writer-wins coalescing and cross-device concurrency
+"""
+
+import io
+import sys
+import types
+import asyncio
+import threading
+
+import pytest
+
+import command_queue
+import stdio_server
+from command_queue import CommandSuperseded, DeviceCommandQueue
+from mug_service import mug_service
+
+
+def test_superseded_commands_never_run():
+    queue = DeviceCommandQueue(max_workers=4)
+    started, release = threading.Event(), threading.Event()
+    ran = []
+
+    first = queue.submit("mug_001", lambda: started.set() or release.wait(5) and ran.append(1) or 1)
+    assert started.wait(5)
+    queued = [queue.submit("mug_001", lambda n=n: ran.append(n) or n) for n in (2, 3, 4)]
+    # A non-coalescable command keeps its place in the order
+    keep = queue.submit("mug_001", lambda: ran.append("keep") or "keep", coalesce=False)
+    last = queue.submit("mug_001", lambda: ran.append(5) or 5)
+    release.set()
+
+    assert first.result(5) == 1 and keep.result(5) == "keep" and last.result(5) == 5
+    for future in queued:
+        with pytest.raises(CommandSuperseded):
+            future.result(5)
+    assert ran == [1, "keep", 5]
+    stats = queue.get_stats()
+    assert (stats["executed"], stats["superseded"], stats["pending"]) == (3, 3, 0)
+
+
+def test_devices_run_concurrently_and_in_order():
+    queue = DeviceCommandQueue(max_workers=4, coalescing=False)
+    barrier = threading.Barrier(3, timeout=5)
+    order = {name: [] for name in ("a", "b", "c")}
+
+    futures = []
+    for name in order:
+        # Each device's first command waits for the others: only passes if they run in parallel
+        futures.append(queue.submit(name, barrier.wait))
+        futures += [queue.submit(name, lambda name=name, n=n: order[name].append(n)) for n in range(5)]
+    for future in futures:
+        future.result(5)
+
+    assert all(items == list(range(5)) for items in order.values())
+
+
+def test_send_reports_superseded(monkeypatch):
+    monkeypatch.setattr(command_queue, "_command_queue", DeviceCommandQueue(max_workers=2))
+    started, release = threading.Event(), threading.Event()
+    sent = []
+
+    def send_now(product_id, device_name, text, use_direct_credentials):
+        started.set()
+        release.wait(5)
+        sent.append(text)
+        return {"status": "success", "text": text}
+
+    monkeypatch.setattr(mug_service, "_send_display_text_now", send_now)
+    results = {}
+    threads = [threading.Thread(target=lambda: results.setdefault("first", mug_service.send_display_text("P", "mug_001", "first")))]
+    threads[0].start()
+    assert started.wait(5)
+    for text in ("second", "third"):
+        thread = threading.Thread(target=lambda text=text: results.setdefault(text, mug_service.send_display_text("P", "mug_001", text)))
+        thread.start()
+        threads.append(thread)
+        while command_queue.get_command_queue().get_stats()["submitted"] < len(threads):
+            pass
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert sent == ["first", "third"]
+    assert results["second"]["status"] == "superseded"
+    assert results["third"] == {"status": "success", "text": "third"}
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_stdio_response_order(monkeypatch, capsys, ordered):
+    monkeypatch.setenv("STDIO_ORDERED_RESPONSES", str(ordered).lower())
+    # Keep the server's stderr log handler off the root logger (it would outlive capsys)
+    monkeypatch.setattr(stdio_server.StdioServer, "setup_logging", lambda self: None)
+    server = stdio_server.StdioServer()
+
+    async def handle_request(line):
+        # The first request finishes last
+        await asyncio.sleep(0.2 if line == "1" else 0.01)
+        return line
+
+    monkeypatch.setattr(server.mcp_server, "handle_request", handle_request)
+    monkeypatch.setattr(stdio_server.render_engine, "get_render_engine", lambda: types.SimpleNamespace(start=lambda: None))
+    monkeypatch.setattr(sys, "stdin", io.StringIO("1\n2\n3\n"))
+    asyncio.run(server.run())
+
+    lines = capsys.readouterr().out.split()
+    assert lines == (["1", "2", "3"] if ordered else ["2", "3", "1"])
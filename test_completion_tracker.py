@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for completion_tracker.py
+Batch polling against the local IoT Explorer stub, pushed events and timeouts
+"""
+
+import json
+
+import pytest
+
+import completion_tracker
+from completion_tracker import CompletionTracker
+from iot_stub import IoTStubServer
+from mug_service import mug_service
+
+
+def test_sends_complete_through_batch_polling(monkeypatch):
+    tracker = CompletionTracker(enabled=True, poll_sec=0.05, timeout_sec=30)
+    monkeypatch.setattr(completion_tracker, "_completion_tracker", tracker)
+    stub = IoTStubServer("H3PI4FBTV5", [f"mug_{i:03d}" for i in range(1, 6)]).start()
+    try:
+        monkeypatch.setenv("IOT_EXPLORER_ENDPOINT", stub.endpoint)
+        monkeypatch.setenv("IOT_EXPLORER_SCHEME", "http")
+        monkeypatch.setenv("TC_SECRET_ID", "AKIDstub")
+        monkeypatch.setenv("TC_SECRET_KEY", "stub")
+
+        tokens = [mug_service.send_display_text("H3PI4FBTV5", f"mug_{i:03d}", "hi")["client_token"] for i in range(1, 6)]
+        result = mug_service.wait_for_completion(tokens + ["nope"], timeout_sec=5)
+    finally:
+        stub.stop()
+
+    assert (result["completed"], result["unknown"], result["pending"]) == (5, 1, 0)
+    record = mug_service.get_action_result(tokens[0])
+    assert record["status"] == "completed" and record["completed_via"] == "poll"
+    assert record["action_id"] == "run_display_text" and record["latency_ms"] >= 0
+    # One listing per poll for the whole product, not one per action
+    stats = mug_service.get_delivery_stats("H3PI4FBTV5")
+    assert stats["polls"] == stub.count("ListEventHistory") < len(tokens)
+    assert stats["devices"]["H3PI4FBTV5/mug_003"]["samples"] == 1
+
+
+def test_pushed_events_and_timeouts(monkeypatch):
+    tracker = CompletionTracker(enabled=True, poll_sec=60, timeout_sec=0.2)
+    monkeypatch.setattr(completion_tracker, "_completion_tracker", tracker)
+    tracker.register("P", "mug_001", "token-1", "run_display_gif", lambda start_time: [])
+    tracker.register("P", "mug_002", "token-2", "run_display_gif", lambda start_time: [])
+
+    event = mug_service.handle_device_event("P", "mug_001", "display_ack", {"client_token": "token-1"})
+    assert event["completed_actions"] == ["token-1"] and event["presence"] == "online"
+    # The token has to come from the same device
+    assert mug_service.handle_device_event("P", "mug_001", "display_ack", json.dumps({"client_token": "token-2"}))["completed_actions"] == []
+
+    result = mug_service.wait_for_completion(["token-1", "token-2"], timeout_sec=2)
+    assert result["status"] == "incomplete"
+    assert [record["status"] for record in result["results"]] == ["completed", "timeout"]
+    assert tracker.get("token-1")["completed_via"] == "event"
+    assert tracker.get_stats()["timed_out"] == 1
+
+
+def test_tracking_is_opt_in(monkeypatch):
+    monkeypatch.delenv("COMPLETION_TRACKING", raising=False)
+    tracker = CompletionTracker()
+    monkeypatch.setattr(completion_tracker, "_completion_tracker", tracker)
+
+    mug_service._track_action(None, "P", "mug_001", "token-1", "run_display_gif")
+    assert tracker.get_stats()["tracked"] == 0 and not tracker.get_stats()["enabled"]
+    with pytest.raises(ValueError, match="COMPLETION_TRACKING"):
+        mug_service.wait_for_completion(["token-1"])
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for content-addressed COS uploads in mug_service.py
+Uses an in-memory stand-in for CosS3Client, no network access
+"""
+
+import time
+import types
+
+import cos_asset_index
+import mug_service as mug_service_module
+from cos_asset_index import COSAssetIndex
+from mug_service import mug_service
+
+
+class FakeCosClient:
+    """Keeps objects in a dict and records put_object calls"""
+
+    objects = {}
+    puts = []
+    heads = 0
+    signs = 0
+
+    def __init__(self, config):
+        pass
+
+    def head_object(self, Bucket, Key):
+        FakeCosClient.heads += 1
+        if Key not in self.objects:
+            raise mug_service_module.CosServiceError("HEAD", {"code": "NoSuchKey", "message": "", "resource": Key,
+                                                              "requestid": "", "traceid": ""}, 404)
+        return {"X-Cos-Meta-Sha256": self.objects[Key]["x-cos-meta-sha256"]}
+
+    def put_object(self, Bucket, Body, Key, Metadata, **kwargs):
+        self.objects[Key] = Metadata
+        self.puts.append(Key)
+
+    def get_object_url(self, Bucket, Key):
+        return f"https://{Bucket}.cos.example.com/{Key}"
+
+    def get_presigned_url(self, Bucket, Key, Method, Expired):
+        FakeCosClient.signs += 1
+        return f"https://{Bucket}.cos.example.com/{Key}?sign={FakeCosClient.signs}&expired={Expired}"
+
+
+def _patch_cos(monkeypatch, index=None):
+    FakeCosClient.objects = {}
+    FakeCosClient.puts = []
+    FakeCosClient.heads = 0
+    FakeCosClient.signs = 0
+    monkeypatch.setattr(mug_service, "_signed_url_cache", type(mug_service._signed_url_cache)(1024 * 1024))
+    monkeypatch.setattr(cos_asset_index, "_cos_asset_index", index)
+    monkeypatch.setenv("COS_ASSET_INDEX_PATH", "" if index is None else index.path)
+    monkeypatch.setattr(mug_service_module, "CosS3Client", FakeCosClient)
+    monkeypatch.setattr(mug_service_module, "CosConfig", lambda **kwargs: None)
+    monkeypatch.setattr(mug_service, "_get_base_credentials",
+                        lambda: types.SimpleNamespace(secret_id="id", secret_key="key"))
+
+
+def _push(asset: bytes, ttl_sec: int = 300):
+    return mug_service._push_asset_to_cos("PRODUCT", "mug_001", asset, "gif",
+                                          mug_service._generate_short_filename(asset), {"width": 32, "height": 16},
+                                          ttl_sec)
+
+
+def test_short_filename_is_content_derived():
+    """Same content, same 6-character name; candidates differ per attempt"""
+    name = mug_service._generate_short_filename(b"GIF89a-asset")
+    assert name == mug_service._generate_short_filename(b"GIF89a-asset")
+    assert len(name) == 6 and name.isalnum()
+    assert name != mug_service._generate_short_filename(b"GIF89a-other")
+    assert name != mug_service._generate_short_filename(b"GIF89a-asset", attempt=1)
+
+
+def test_repeated_asset_skips_upload(monkeypatch):
+    """The second push of identical bytes reuses the existing object"""
+    _patch_cos(monkeypatch)
+    first = _push(b"GIF89a-asset")
+    second = _push(b"GIF89a-asset")
+    assert first["uploaded"] and first["uploaded_bytes"] == len(b"GIF89a-asset")
+    assert not second["uploaded"] and second["uploaded_bytes"] == 0
+    assert second["key"] == first["key"]
+    assert FakeCosClient.puts == [first["key"]]
+
+
+def test_name_collision_moves_to_next_candidate(monkeypatch):
+    """A different asset already stored under the preferred name is not overwritten"""
+    _patch_cos(monkeypatch)
+    asset = b"GIF89a-asset"
+    preferred = f"mug_001/{mug_service._generate_short_filename(asset)}.gif"
+    FakeCosClient.objects[preferred] = {"x-cos-meta-sha256": "0" * 64}
+
+    result = _push(asset)
+    assert result["uploaded"]
+    assert result["key"] == f"mug_001/{mug_service._generate_short_filename(asset, attempt=1)}.gif"
+    assert FakeCosClient.objects[preferred] == {"x-cos-meta-sha256": "0" * 64}
+
+
+def test_asset_index_skips_head_and_survives_restart(monkeypatch, tmp_path):
+    """Indexed assets need no network round trip, also after reopening the database"""
+    path = str(tmp_path / "index.sqlite3")
+    _patch_cos(monkeypatch, COSAssetIndex(path))
+    first = _push(b"GIF89a-asset")
+    assert first["uploaded"] and not first["index_hit"]
+    heads = FakeCosClient.heads
+
+    # Simulate a restart: a fresh index over the same file
+    monkeypatch.setattr(cos_asset_index, "_cos_asset_index", COSAssetIndex(path))
+    second = _push(b"GIF89a-asset")
+    assert second["index_hit"] and not second["uploaded"]
+    assert second["key"] == first["key"] and second["url"] == first["url"]
+    assert FakeCosClient.heads == heads
+
+
+def test_asset_index_open_failure_is_remembered(monkeypatch, tmp_path):
+    """An index that cannot be opened is not retried (and logged) on every upload"""
+    opens = []
+
+    def failing_index(path):
+        opens.append(path)
+        raise OSError("read-only file system")
+
+    monkeypatch.setattr(cos_asset_index, "_cos_asset_index", None)
+    monkeypatch.setattr(cos_asset_index, "_cos_asset_index_disabled", False)
+    monkeypatch.setattr(cos_asset_index, "COSAssetIndex", failing_index)
+    monkeypatch.setenv("COS_ASSET_INDEX_PATH", str(tmp_path / "index.sqlite3"))
+    assert cos_asset_index.get_cos_asset_index() is None
+    assert cos_asset_index.get_cos_asset_index() is None
+    assert len(opens) == 1
+
+
+def test_asset_index_retention():
+    """Entries expire by upload time however often they are used; over-limit entries go LRU first"""
+    index = COSAssetIndex(":memory:", retention_days=1, max_entries=2)
+    old = time.time() - 2 * 86400
+    index.record("bucket", "mug", "a" * 64, "p", "mug/a.gif", "url-a", 10)
+    index.record("bucket", "mug", "b" * 64, "p", "mug/b.gif", "url-b", 10)
+    index.record("bucket", "mug", "c" * 64, "p", "mug/c.gif", "url-c", 10)
+    assert index.lookup("bucket", "mug", "c" * 64, "p")["key"] == "mug/c.gif"
+    assert index.lookup("bucket", "mug", "c" * 64, "other-profile") is None
+
+    assert index.prune() == 1
+    assert index.lookup("bucket", "mug", "a" * 64, "p") is None
+
+    # Uploaded two days ago: expired although just looked up
+    index.record("bucket", "mug", "b" * 64, "p", "mug/b.gif", "url-b", 10, uploaded_at=old)
+    assert index.lookup("bucket", "mug", "b" * 64, "p")["expired"]
+    assert index.prune() == 1
+    assert index.get_stats()["entries"] == 1
+
+    # Retention is capped below the bucket lifecycle
+    assert COSAssetIndex(":memory:", retention_days=30, lifecycle_days=7).retention_sec == 6 * 86400
+
+
+def test_stale_index_hit_is_forgotten_and_uploaded_again(monkeypatch):
+    """An expired index entry is not trusted: the object is checked and uploaded again"""
+    index = COSAssetIndex(":memory:", retention_days=1)
+    _patch_cos(monkeypatch, index)
+    first = _push(b"GIF89a-asset")
+    with index._lock:
+        index._conn.execute("UPDATE assets SET uploaded_at = ?", (time.time() - 2 * 86400,))
+    # The bucket lifecycle deleted the object
+    FakeCosClient.objects.clear()
+
+    second = _push(b"GIF89a-asset")
+    assert not second["index_hit"] and second["uploaded"]
+    assert FakeCosClient.puts == [first["key"], first["key"]]
+    with index._lock:
+        assert index._conn.execute("SELECT uploaded_at FROM assets").fetchone()[0] > time.time() - 60
+
+
+def test_signed_urls_are_cached_until_near_expiry(monkeypatch):
+    """Re-sent assets reuse the signed URL; short-lived ones are re-signed"""
+    _patch_cos(monkeypatch)
+    first = _push(b"GIF89a-asset", ttl_sec=900)
+    second = _push(b"GIF89a-asset", ttl_sec=900)
+    assert "expired=900" in first["url"]
+    assert second["url"] == first["url"]
+    assert FakeCosClient.signs == 1
+
+    # Within the refresh margin (at least 60 s) a fresh signature is made
+    _push(b"GIF89a-other", ttl_sec=30)
+    _push(b"GIF89a-other", ttl_sec=30)
+    assert FakeCosClient.signs == 3
+
+    monkeypatch.setenv("COS_SIGNED_URLS", "false")
+    assert "sign=" not in _push(b"GIF89a-asset")["url"]
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for get_devices_status in mug_service.py
+Runs against the local IoT Explorer stub
+"""
+
+import time
+
+import pytest
+
+import device_presence
+from device_presence import PresenceCache
+from iot_stub import IoTStubServer
+from mug_service import mug_service
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(device_presence, "_presence_cache", PresenceCache(ttl_sec=60))
+    server = IoTStubServer("H3PI4FBTV5", [f"mug_{i:03d}" for i in range(250)],
+                           offline={"mug_007", "mug_200"}).start()
+    monkeypatch.setenv("IOT_EXPLORER_ENDPOINT", server.endpoint)
+    monkeypatch.setenv("IOT_EXPLORER_SCHEME", "http")
+    monkeypatch.setenv("TC_SECRET_ID", "AKIDstub")
+    monkeypatch.setenv("TC_SECRET_KEY", "stub")
+    monkeypatch.setenv("DEVICE_LIST_PAGE_SIZE", "50")
+    yield server
+    server.stop()
+
+
+def test_product_sweep_then_cache(stub):
+    """Whole product in one paged sweep, later queries served from the presence cache"""
+    result = mug_service.get_devices_status("H3PI4FBTV5")
+
+    assert result["device_count"] == 250
+    assert (result["online_count"], result["offline_count"]) == (248, 2)
+    assert result["api_calls"] == 5 == stub.count("GetDeviceList")
+    assert stub.count("DescribeDevice") == 0
+
+    names = [f"mug_{i:03d}" for i in range(0, 250, 10)] + ["mug_999"]
+    cached = mug_service.get_devices_status("H3PI4FBTV5", names)
+    # Only the unknown device costs an API call
+    assert cached["api_calls"] == 1 == stub.count("DescribeDevice")
+    assert cached["device_count"] == 25
+    assert all(device["cached"] for device in cached["devices"])
+    assert cached["not_found"] == ["mug_999"]
+    assert [device["device_name"] for device in cached["devices"]] == names[:-1]
+
+
+def test_few_devices_use_describe(stub):
+    result = mug_service.get_devices_status("H3PI4FBTV5", ["mug_007", "mug_008", "mug_007"])
+
+    assert result["api_calls"] == 2 == stub.count("DescribeDevice")
+    assert stub.count("GetDeviceList") == 0
+    assert [(device["device_name"], device["online"]) for device in result["devices"]] == [
+        ("mug_007", False), ("mug_008", True)]
+
+    # max_age_sec=0 bypasses the cache
+    assert mug_service.get_devices_status("H3PI4FBTV5", ["mug_008"], max_age_sec=0)["api_calls"] == 1
+    assert mug_service.get_devices_status("H3PI4FBTV5", ["mug_008"])["api_calls"] == 0
+
+
+def test_offline_policy_short_circuits_sends(stub, monkeypatch):
+    """Known-offline devices fail fast or defer before rendering; coming online replays the send"""
+    renders = []
+    render = mug_service._render_pixel_image
+    monkeypatch.setattr(mug_service, "_render_pixel_image", lambda *args: renders.append(args) or render(*args))
+    monkeypatch.setattr(mug_service, "_deferred_sends", {})
+    mug_service.get_devices_status("H3PI4FBTV5", ["mug_007"])
+
+    with pytest.raises(ValueError, match="offline"):
+        mug_service.send_display_text("H3PI4FBTV5", "mug_007", "hi", offline_policy="fail")
+    deferred = mug_service.send_pixel_image("H3PI4FBTV5", "mug_007", [["#ff0000"] * 4] * 4, 4, 4,
+                                            use_cos=False, offline_policy="defer")
+    assert deferred["status"] == "deferred"
+    assert renders == [] and stub.count("CallDeviceActionAsync") == 0
+
+    stub.offline.discard("mug_007")
+    event = mug_service.handle_device_event("H3PI4FBTV5", "mug_007", "online")
+    assert (event["presence"], event["deferred_send"]) == ("online", "replayed")
+    deadline = time.time() + 5
+    while stub.count("CallDeviceActionAsync") == 0 and time.time() < deadline:
+        time.sleep(0.02)
+    assert stub.count("CallDeviceActionAsync") == 1
+    assert len(renders) == 1
+
+    # An action rejected as offline updates the cache; other events invalidate it
+    with pytest.raises(Exception):
+        mug_service.send_display_text("H3PI4FBTV5", "mug_200", "hi")
+    assert device_presence.get_presence_cache().get("H3PI4FBTV5", "mug_200")["online"] is False
+    assert mug_service.handle_device_event("H3PI4FBTV5", "mug_200", "display_ack")["presence"] == "invalidated"
+    assert device_presence.get_presence_cache().get("H3PI4FBTV5", "mug_200") is None
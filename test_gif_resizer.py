@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for gif_resizer.py
+Covers the standard-size pass-through and the resized output cache
+"""
+
+import io
+
+from PIL import Image
+
+import device_profiles
+import frame_batch
+from gif_blocks import count_frames
+from gif_resizer import GIFResizer
+
+
+def _make_gif(width: int, height: int, colors) -> bytes:
+    """Build an animated GIF with one solid frame per color"""
+    frames = [Image.new('RGB', (width, height), color) for color in colors]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=80, loop=0)
+    return buffer.getvalue()
+
+
+def test_standard_gif_passes_through():
+    """A 32x16 GIF without transparency is returned unchanged"""
+    resizer = GIFResizer(cache_bytes=1024 * 1024)
+    gif_bytes = _make_gif(32, 16, [(255, 0, 0), (0, 0, 255)])
+    assert resizer.resize_gif_to_standard(gif_bytes) is gif_bytes
+    assert resizer.get_cache_stats()["passthrough_count"] == 1
+
+    # Resizer output already meets the standard, so re-sending it is free
+    resized = resizer.resize_gif_to_standard(_make_gif(64, 64, [(0, 255, 0), (255, 255, 0)]))
+    assert resizer.resize_gif_to_standard(resized) is resized
+
+    # Transparency on the first frame would expose the background
+    single = _make_gif(32, 16, [(255, 0, 0)])
+    assert resizer._is_standard_gif(single)
+    transparent = single.replace(b"\x21\xf9\x04\x00", b"\x21\xf9\x04\x01", 1)
+    assert not resizer._is_standard_gif(transparent)
+    assert not resizer._is_standard_gif(_make_gif(32, 32, [(255, 0, 0)]))
+    assert not resizer._is_standard_gif(gif_bytes[:-1])
+
+
+def test_resized_output_is_cached():
+    """Identical input is served from the byte-budgeted cache"""
+    resizer = GIFResizer(cache_bytes=1024 * 1024)
+    gif_bytes = _make_gif(48, 48, [(255, 0, 0), (0, 0, 255)])
+    first = resizer.resize_gif_to_standard(gif_bytes)
+    second = resizer.resize_gif_to_standard(bytes(gif_bytes))
+    assert second is first
+    stats = resizer.get_cache_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert Image.open(io.BytesIO(first)).size == (32, 16)
+
+    # A budget smaller than the output disables caching for it
+    tiny = GIFResizer(cache_bytes=10)
+    tiny.resize_gif_to_standard(gif_bytes)
+    assert tiny.get_cache_stats()["entries"] == 0
+
+
+def test_scale_plan_matches_pil_nearest():
+    """Precomputed index maps sample the same pixels as PIL's NEAREST resize"""
+    source = Image.new('RGB', (37, 23))
+    source.putdata([(x * 6, y * 11, 0) for y in range(23) for x in range(37)])
+    plan = device_profiles.compute_scale_plan(37, 23, 32, 16)
+    assert (plan["scaled_width"], plan["scaled_height"]) == (25, 16)
+    assert (plan["paste_x"], plan["paste_y"]) == (3, 0)
+
+    resized = source.resize((plan["scaled_width"], plan["scaled_height"]), Image.NEAREST)
+    expected = [source.getpixel((x, y)) for y in plan["y_map"] for x in plan["x_map"]]
+    assert list(resized.tobytes()) == [c for pixel in expected for c in pixel]
+
+
+def test_profile_drives_resize_and_limits():
+    """A registered profile sets resolution, colors, frame delay and frame count"""
+    registry = device_profiles.DeviceProfileRegistry()
+    profile = registry.register_profile("TESTPROFILE", device_profiles.DeviceProfile(
+        "test-16x8", width=16, height=8, max_colors=16, min_frame_delay_ms=100, max_frames=2))
+    assert registry.get_profile("TESTPROFILE") is profile
+    assert registry.get_profile("UNKNOWN") is registry.DEFAULT_PROFILE
+
+    resizer = GIFResizer(cache_bytes=0, profile=profile)
+    report = {}
+    output = resizer.resize_gif_to_standard(_make_gif(32, 32, [(255, 0, 0), (0, 0, 255), (0, 255, 0)]), report=report)
+    result = Image.open(io.BytesIO(output))
+    assert result.size == (16, 8)
+    assert result.n_frames == 2
+    assert result.info["duration"] == 100
+    # The third frame is over the limit: dropped and counted
+    assert resizer.get_cache_stats()["truncated_count"] == 1
+    assert report == {"source_frames": 3, "frame_count": 2, "frames_dropped": 1}
+    assert count_frames(_make_gif(8, 8, [(255, 0, 0), (0, 0, 255), (0, 255, 0)])) == 3
+    assert count_frames(_make_gif(8, 8, [(255, 0, 0), (0, 0, 255), (0, 255, 0)]), stop_after=2) == 2
+    assert count_frames(b"not a gif") == 0
+
+    # 80ms frames are faster than this profile allows, so no pass-through
+    assert not resizer._is_standard_gif(_make_gif(16, 8, [(255, 0, 0), (0, 0, 255)]))
+
+    tiny = device_profiles.DeviceProfile("tiny-file", max_file_bytes=50)
+    try:
+        GIFResizer(cache_bytes=0, profile=tiny).resize_gif_to_standard(_make_gif(40, 20, [(255, 0, 0)]))
+    except ValueError as e:
+        assert "tiny-file" in str(e)
+    else:
+        raise AssertionError("file size limit was not enforced")
+
+
+def test_batch_resize_matches_per_frame_path():
+    """The NumPy batch path produces the same GIF as the per-frame PIL path"""
+    if not frame_batch.NUMPY_AVAILABLE:
+        return
+    frames = []
+    for i in range(5):
+        frame = Image.new('RGB', (45, 37), (40 * i, 10, 200))
+        frame.paste((255, 255, 0), (i * 5, 3, i * 5 + 12, 30))
+        frame.putpixel((44, 36), (0, 255, 0))
+        frames.append(frame)
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=60, loop=0)
+    gif_bytes = buffer.getvalue()
+
+    batch_output = GIFResizer(cache_bytes=0).resize_gif_to_standard(gif_bytes)
+    frame_batch.NUMPY_AVAILABLE = False
+    try:
+        per_frame_output = GIFResizer(cache_bytes=0).resize_gif_to_standard(gif_bytes)
+    finally:
+        frame_batch.NUMPY_AVAILABLE = True
+    assert batch_output == per_frame_output
+
+    stretched = frame_batch.resize_frames([frames[0].tobytes()], 45, 37, 16, 16)[0]
+    assert stretched == frames[0].resize((16, 16), Image.NEAREST).tobytes()
+
+
+if __name__ == "__main__":
+    test_standard_gif_passes_through()
+    test_resized_output_is_cached()
+    test_scale_plan_matches_pil_nearest()
+    test_profile_drives_resize_and_limits()
+    test_batch_resize_matches_per_frame_path()
+    print("✅ GIF resizer tests passed")
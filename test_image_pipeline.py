@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for the image/GIF processing pipeline in mug_service.py
+Runs fully offline - no Tencent Cloud credentials required
+"""
+
+import io
+import time
+import zlib
+import base64
+import struct
+
+from PIL import Image
+
+import image_guard
+from mug_service import mug_service
+
+
+def _make_gif(frame_count: int, width: int = 8, height: int = 8) -> bytes:
+    """Build an animated GIF whose frames alternate between red and blue"""
+    frames = []
+    for i in range(frame_count):
+        color = (255, 0, 0) if i % 2 == 0 else (0, 0, 255)
+        frames.append(Image.new('RGB', (width, height), color))
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=50, loop=0)
+    return buffer.getvalue()
+
+
+def test_gif_frames_are_decoded_lazily():
+    """Frames come out resized and in order"""
+    gif_b64 = base64.b64encode(_make_gif(3)).decode('ascii')
+    frames = mug_service._process_gif_to_frames(gif_b64, 4, 2)
+
+    assert len(frames) == 3
+    assert [f["frame_index"] for f in frames] == [0, 1, 2]
+    assert frames[0]["pixel_matrix"] == [["#ff0000"] * 4] * 2
+    assert frames[1]["pixel_matrix"] == [["#0000ff"] * 4] * 2
+    assert frames[0]["duration"] == 50
+
+
+def test_gif_frame_budget():
+    """An animation with too many frames is rejected"""
+    gif_b64 = base64.b64encode(_make_gif(6)).decode('ascii')
+    try:
+        mug_service._process_gif_to_frames(gif_b64, 4, 4, max_frames=5)
+    except ValueError as e:
+        assert "more than 5 frames" in str(e)
+    else:
+        raise AssertionError("frame budget was not enforced")
+
+
+def test_gif_pixel_budget():
+    """An animation whose summed frame area is too large is rejected"""
+    gif_b64 = base64.b64encode(_make_gif(4, 10, 10)).decode('ascii')
+    try:
+        mug_service._process_gif_to_frames(gif_b64, 4, 4, max_total_pixels=250)
+    except ValueError as e:
+        assert "pixel budget" in str(e)
+    else:
+        raise AssertionError("pixel budget was not enforced")
+
+
+def test_decode_image_input_sniffs_once():
+    """Input is decoded and sniffed once, and the result is reusable downstream"""
+    png_buffer = io.BytesIO()
+    Image.new('RGB', (6, 6), (0, 255, 0)).save(png_buffer, format='PNG')
+    png_b64 = base64.b64encode(png_buffer.getvalue()).decode('ascii')
+
+    decoded = mug_service._decode_image_input(png_b64)
+    assert decoded["format"] == "PNG"
+    assert decoded["bytes"] == png_buffer.getvalue()
+    assert mug_service._decode_image_input(decoded) is decoded
+
+    gif_decoded = mug_service._decode_image_input(_make_gif(2))
+    assert gif_decoded["format"] == "GIF"
+
+    frames = mug_service._process_gif_to_frames(decoded, 2, 2)
+    assert frames[0]["pixel_matrix"] == [["#00ff00"] * 2] * 2
+
+
+def test_pixel_matrix_packing_and_errors():
+    """Bulk row validation packs valid rows and keeps precise error positions"""
+    packed = mug_service._pack_pixel_matrix([["#FF0000", "#00ff00"], [[0, 0, 255], [1, 2, 3, 4]]], 2, 2)
+    assert packed == bytes.fromhex("ff000000ff000000ff010203")
+    # Raw frames also take "#rrggbbaa" (alpha ignored), in bulk and in mixed rows
+    frame = [["FF000080", "#00ff00ff"], ["#0000ff", "010203"]]
+    assert mug_service._pack_pixel_matrix(frame, 2, 2, require_hash=False) == packed
+    try:
+        mug_service._pack_pixel_matrix([["#ff000080", "#00ff00"]], 2, 1)
+    except ValueError as e:
+        assert "[0][0]: #ff000080" in str(e)
+    else:
+        raise AssertionError("8-digit hex accepted outside raw frames")
+
+    bad_patterns = {
+        "Invalid color format at [1][0]: #12345": [["#000000", "#ffffff"], ["#12345", "#ffffff"]],
+        "Invalid color format at [0][1]: 000000": [["#000000", "000000"], ["#ffffff", "#ffffff"]],
+        "Invalid RGB component at [1][1]: 300": [[[0, 0, 0], [0, 0, 0]], [[0, 0, 0], [0, 300, 0]]],
+        "Row 1 width 1 doesn't match specified width 2": [["#000000", "#000000"], ["#000000"]],
+    }
+    for expected, pattern in bad_patterns.items():
+        try:
+            mug_service._validate_pixel_pattern(pattern, 2, 2)
+        except ValueError as e:
+            assert str(e) == expected
+        else:
+            raise AssertionError(f"pattern was accepted: {pattern}")
+
+
+def test_convert_large_jpeg_with_draft_and_area():
+    """Large JPEG input is reduced while decoding and still reports its original size"""
+    jpeg_buffer = io.BytesIO()
+    Image.new('RGB', (1600, 1200), (200, 40, 40)).save(jpeg_buffer, format='JPEG')
+    jpeg_b64 = base64.b64encode(jpeg_buffer.getvalue()).decode('ascii')
+
+    for resize_method in ("nearest", "area", "bicubic"):
+        result = mug_service.convert_image_to_pixels(jpeg_b64, 16, 12, resize_method)
+        assert result["original_size"] == {"width": 1600, "height": 1200}
+        assert len(result["pixel_matrix"]) == 12
+        assert len(result["pixel_matrix"][0]) == 16
+        r, g, b = bytes.fromhex(result["pixel_matrix"][6][8][1:])
+        assert abs(r - 200) < 8 and abs(g - 40) < 8 and abs(b - 40) < 8
+
+
+def test_convert_compact_output_formats():
+    """Palette and packed outputs decode back to the matrix output"""
+    image = Image.new('RGB', (8, 4), (255, 0, 0))
+    image.paste((0, 0, 255), (4, 0, 8, 4))
+    png_buffer = io.BytesIO()
+    image.save(png_buffer, format='PNG')
+    png_b64 = base64.b64encode(png_buffer.getvalue()).decode('ascii')
+
+    matrix = mug_service.convert_image_to_pixels(png_b64, 8, 4)["pixel_matrix"]
+    expected_rgb = mug_service._pack_pixel_matrix(matrix, 8, 4)
+
+    palette_result = mug_service.convert_image_to_pixels(png_b64, 8, 4, output_format="palette")
+    assert "pixel_matrix" not in palette_result
+    assert sorted(palette_result["palette"]) == ["#0000ff", "#ff0000"]
+    packed = mug_service._process_palette_pixel_art(palette_result, 8, 4)
+    palette_rgb = b"".join(bytes.fromhex(palette_result["palette"][i][1:]) for i in packed["indices"])
+    assert palette_rgb == expected_rgb
+
+    rgb888 = mug_service.convert_image_to_pixels(png_b64, 8, 4, output_format="rgb888")
+    assert mug_service._decode_packed_pixels(rgb888, 16, 16)["rgb"] == expected_rgb
+
+    rgb565 = mug_service.convert_image_to_pixels(png_b64, 8, 4, output_format="rgb565")
+    assert len(base64.b64decode(rgb565["pixel_data"])) == 8 * 4 * 2
+    assert mug_service._decode_packed_pixels(rgb565, 16, 16)["rgb"] == expected_rgb
+
+    try:
+        mug_service._decode_packed_pixels(dict(rgb565, width=7), 16, 16)
+    except ValueError as e:
+        assert "expected 56" in str(e)
+    else:
+        raise AssertionError("mismatched pixel_data length was accepted")
+
+
+def _make_png_header_bomb(width: int, height: int) -> bytes:
+    """Build a tiny PNG whose header claims huge dimensions"""
+    buffer = io.BytesIO()
+    Image.new('1', (1, 1)).save(buffer, format='PNG')
+    data = bytearray(buffer.getvalue())
+    # IHDR data starts after the 8-byte signature and 8-byte chunk header
+    data[16:24] = struct.pack(">II", width, height)
+    data[29:33] = struct.pack(">I", zlib.crc32(bytes(data[12:29])))
+    return bytes(data)
+
+
+def test_image_guard_rejects_before_decode():
+    """Oversized headers and frame counts are rejected without decoding"""
+    bomb_b64 = base64.b64encode(_make_png_header_bomb(20000, 20000)).decode('ascii')
+    started = time.time()
+    try:
+        mug_service.convert_image_to_pixels(bomb_b64, 16, 16)
+    except ValueError as e:
+        assert "exceeds" in str(e)
+    else:
+        raise AssertionError("oversized image was accepted")
+    assert time.time() - started < 1.0
+
+    image_guard.get_image_guard().configure_limits("test_guard", max_frames=3)
+    assert mug_service._decode_image_input(_make_gif(3), "test_guard")["format"] == "GIF"
+    try:
+        mug_service._decode_image_input(_make_gif(4), "test_guard")
+    except ValueError as e:
+        assert "more than 3 frames" in str(e)
+    else:
+        raise AssertionError("frame limit was not enforced")
+
+
+if __name__ == "__main__":
+    test_gif_frames_are_decoded_lazily()
+    test_gif_frame_budget()
+    test_gif_pixel_budget()
+    test_decode_image_input_sniffs_once()
+    test_pixel_matrix_packing_and_errors()
+    test_convert_large_jpeg_with_draft_and_area()
+    test_convert_compact_output_formats()
+    test_image_guard_rejects_before_decode()
+    print("✅ Image pipeline tests passed")
@@ -4,7 +4,9 @@
 Test script for palette-based pixel art format support
 """
 
+import io
 import json
+from PIL import Image
 from mug_service import mug_service
 
 def test_palette_format():
@@ -219,5 +221,53 @@ def test_palette_format():
     print("- Palette-based format with color indices")
     print("- Palette-based GIF animations")
 
+def test_palette_fast_path_keeps_exact_colors():
+    """Palette input goes straight to a 'P' mode GIF without re-quantization"""
+    palette = ["#fefefe", "#ff0001", "#00fe00"]
+    animation = {
+        "width": 2,
+        "height": 2,
+        "palette": palette,
+        "frames": [
+            {"pixels": [[0, 1], [1, 0]]},
+            {"pixels": [[2, 2], [1, 1]], "duration": 300}
+        ]
+    }
+    
+    frames = mug_service._process_palette_gif_animation(animation, 2, 2)
+    assert frames[0]["indices"] == bytes([0, 1, 1, 0])
+    assert frames[1]["duration"] == 300
+    
+    gif_bytes = mug_service._create_gif_from_frames(frames, 100, 0)
+    gif_image = Image.open(io.BytesIO(gif_bytes))
+    output_colors = set()
+    for frame_index in range(gif_image.n_frames):
+        gif_image.seek(frame_index)
+        # 2x2 art is scaled to 16x16 and centered on the 32x16 canvas
+        rgb = gif_image.convert('RGB').crop((8, 0, 24, 16)).tobytes()
+        output_colors.update(rgb[i:i + 3] for i in range(0, len(rgb), 3))
+    assert output_colors == {bytes.fromhex(color[1:]) for color in palette}
+
+
+def test_palette_index_errors_are_precise():
+    """Bulk validation still reports the exact offending position"""
+    animation = {
+        "width": 2,
+        "height": 2,
+        "palette": ["#000000", "#ffffff"],
+        "frames": [
+            {"pixels": [[0, 1], [1, 0]]},
+            {"pixels": [[0, 1], [5, 0]]}
+        ]
+    }
+    try:
+        mug_service._process_palette_gif_animation(animation, 2, 2)
+    except ValueError as e:
+        assert str(e) == "Invalid pixel index in frame 1 at [1][0]: 5"
+    else:
+        raise AssertionError("invalid index was accepted")
+
 if __name__ == "__main__":
     test_palette_format()
+    test_palette_fast_path_keeps_exact_colors()
+    test_palette_index_errors_are_precise()
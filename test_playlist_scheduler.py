@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for playlist_scheduler.py
+Covers rotation order across many devices, replacement, clearing and set_playlist validation
+"""
+
+import time
+
+import pytest
+
+import playlist_scheduler
+from mug_service import mug_service
+from playlist_scheduler import PlaylistScheduler
+
+
+def test_rotates_many_devices_in_order():
+    scheduler = PlaylistScheduler(max_workers=4)
+    pushed = {}
+    items = [{"name": "a", "duration_sec": 0.05}, {"name": "b", "duration_sec": 0.05}]
+    for i in range(300):
+        scheduler.set_playlist(i, items, lambda item, i=i: pushed.setdefault(i, []).append(item["name"]))
+    scheduler.set_playlist("once", items, lambda item: pushed.setdefault("once", []).append(item["name"]), loop=False)
+
+    time.sleep(0.32)
+    for i in range(300):
+        scheduler.clear_playlist(i)
+    time.sleep(0.05)
+    counts = {key: len(names) for key, names in pushed.items()}
+    time.sleep(0.15)
+
+    assert all(names == ["a", "b"] * (len(names) // 2) + ["a"] * (len(names) % 2) for names in pushed.values())
+    assert all(3 <= counts[i] <= 9 for i in range(300))
+    # Cleared playlists stop, the one-shot playlist finished after one pass
+    assert {key: len(names) for key, names in pushed.items()} == counts
+    assert pushed["once"] == ["a", "b"]
+    assert scheduler.get_playlist("once")["finished"]
+    assert scheduler.get_stats()["errors"] == 0
+
+
+def test_set_playlist_pushes_through_send_methods(monkeypatch):
+    monkeypatch.setattr(playlist_scheduler, "_playlist_scheduler", PlaylistScheduler(max_workers=2))
+    monkeypatch.setattr(mug_service, "PLAYLIST_MIN_DURATION_SEC", 0.01)
+    calls = []
+    monkeypatch.setattr(mug_service, "send_display_text",
+                        lambda *args, **kwargs: calls.append((args, kwargs)) or {"status": "success"})
+
+    with pytest.raises(ValueError, match="missing required param text"):
+        mug_service.set_playlist("P", "mug_001", [{"method": "send_display_text", "params": {}, "duration_sec": 5}])
+    with pytest.raises(ValueError, match="method must be one of"):
+        mug_service.set_playlist("P", "mug_001", [{"method": "issue_sts", "duration_sec": 5}])
+
+    state = mug_service.set_playlist("P", "mug_001", [
+        {"method": "send_display_text", "params": {"text": "one"}, "duration_sec": 0.05},
+        {"method": "send_display_text", "params": {"text": "two"}, "duration_sec": 10},
+    ])
+    assert state["item_count"] == 2
+    time.sleep(0.2)
+
+    assert calls == [(("P", "mug_001"), {"offline_policy": "fail", "text": "one"}),
+                     (("P", "mug_001"), {"offline_policy": "fail", "text": "two"})]
+    state = mug_service.get_playlist("P", "mug_001")
+    assert (state["pushes"], state["next_index"], state["last_push"]["index"]) == (2, 0, 1)
+    assert mug_service.clear_playlist("P", "mug_001")["removed"]
+    with pytest.raises(ValueError):
+        mug_service.get_playlist("P", "mug_001")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for render_engine.py
+Runs the same jobs inline and in a worker pool and compares the output
+"""
+
+import io
+import base64
+
+from PIL import Image
+
+import device_profiles
+import gif_resizer
+from render_engine import RenderEngine
+
+
+def _make_gif(frame_count: int, width: int = 40, height: int = 20) -> bytes:
+    """Build an animated GIF with a moving yellow block"""
+    frames = []
+    for i in range(frame_count):
+        frame = Image.new('RGB', (width, height), (20, 20, 120))
+        frame.paste((255, 255, 0), (i * 4, 2, i * 4 + 8, 12))
+        frames.append(frame)
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=70, loop=0)
+    return buffer.getvalue()
+
+
+def test_inline_engine_jobs():
+    """With no workers every job runs in-process"""
+    engine = RenderEngine(workers=0)
+    gif_bytes = _make_gif(3)
+
+    frames = engine.process_frames(gif_bytes, 8, 4)
+    assert [frame["frame_index"] for frame in frames] == [0, 1, 2]
+    assert len(frames[0]["rgb"]) == 8 * 4 * 3
+    assert "pixel_matrix" not in frames[0]
+
+    output = engine.create_gif(frames, 100, 0, device_profiles.get_profile())
+    assert Image.open(io.BytesIO(output)).size == (32, 16)
+    # Streaming the frames into the encoder gives the same GIF as the frame array
+    assert engine.render_frames_gif(gif_bytes, 8, 4, 100, 0, device_profiles.get_profile()) == {
+        "gif_bytes": output, "frame_count": 3}
+    assert engine.get_stats()["inline_jobs"] == 3
+    assert engine.get_stats()["pool_jobs"] == 0
+
+
+def test_pool_matches_inline():
+    """Pool workers produce the same bytes as inline rendering"""
+    gif_bytes = _make_gif(4)
+    image_b64 = base64.b64encode(gif_bytes).decode('ascii')
+    inline = RenderEngine(workers=0)
+    pool = RenderEngine(workers=2).start()
+    try:
+        assert pool.resize_gif(gif_bytes) == inline.resize_gif(gif_bytes)
+        frames = pool.process_frames(gif_bytes, 16, 8)
+        assert frames == inline.process_frames(gif_bytes, 16, 8)
+        assert pool.create_gif(frames, 100, 0) == inline.create_gif(frames, 100, 0)
+        assert pool.render_frames_gif(gif_bytes, 16, 8) == inline.render_frames_gif(gif_bytes, 16, 8)
+        assert pool.convert_image(image_b64, 8, 8) == inline.convert_image(image_b64, 8, 8)
+
+        try:
+            pool.convert_image(image_b64, 0, 8)
+        except ValueError as e:
+            assert "target_width" in str(e)
+        else:
+            raise AssertionError("worker error was not propagated")
+        assert pool.get_stats()["pool_jobs"] >= 5
+    finally:
+        pool.shutdown()
+
+
+def test_pool_resize_uses_parent_cache_and_counters():
+    """Only the render runs in a worker; the parent's resizer keeps the cache and truncation count"""
+    profile = device_profiles.DeviceProfile("pool-resize", max_frames=2)
+    resizer = gif_resizer.get_gif_resizer(profile)
+    truncated_before = resizer.truncated_count
+    gif_bytes = _make_gif(4)
+    pool = RenderEngine(workers=1).start()
+    try:
+        report = {}
+        first = pool.resize_gif(gif_bytes, profile, report=report)
+        pool_jobs = pool.get_stats()["pool_jobs"]
+        assert pool_jobs == 1
+        assert report["frames_dropped"] == 2
+        assert resizer.truncated_count == truncated_before + 1
+        # The second request is a parent cache hit and never reaches the pool
+        assert pool.resize_gif(gif_bytes, profile) == first
+        assert pool.get_stats()["pool_jobs"] == pool_jobs
+        assert resizer.get_cache_stats()["hits"] >= 1
+
+        resizer.clear_cache()
+        assert RenderEngine(workers=0).resize_gif(gif_bytes, profile) == first
+    finally:
+        pool.shutdown()
+        resizer.clear_cache()
+
+
+if __name__ == "__main__":
+    test_inline_engine_jobs()
+    test_pool_matches_inline()
+    test_pool_resize_uses_parent_cache_and_counters()
+    print("✅ Render engine tests passed")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for speculation.py
+Covers the convert -> send pre-render path and cancellation of stale jobs
+"""
+
+import io
+import time
+import types
+import base64
+import asyncio
+import threading
+
+from PIL import Image
+
+import asset_cache
+import speculation
+from asset_cache import AssetCache
+from mug_service import mug_service
+from speculation import Speculator
+
+
+def _wait_idle(speculator: Speculator):
+    speculator._executor.submit(lambda: None).result(timeout=10)
+
+
+def test_convert_prerenders_following_send(tmp_path, monkeypatch):
+    """Both the original image and the conversion result hit the cache afterwards"""
+    monkeypatch.setattr(asset_cache, "_asset_cache", AssetCache(memory_bytes=1024 * 1024, disk_dir=str(tmp_path)))
+    speculator = Speculator(enabled=True)
+    monkeypatch.setattr(speculation, "_speculator", speculator)
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), (0, 0, 255)).save(buffer, format='PNG')
+    image_data = base64.b64encode(buffer.getvalue()).decode()
+    result = mug_service.convert_image_to_pixels(image_data, 16, 16)
+
+    assert mug_service.speculate_pixel_image(image_data, result, 16, 16)
+    _wait_idle(speculator)
+
+    assert mug_service._render_pixel_image(None, image_data, 16, 16)["cache"] == "hit-memory"
+    assert mug_service._render_pixel_image(None, result["pixel_matrix"], 16, 16)["cache"] == "hit-memory"
+    stats = speculator.get_stats()
+    assert stats["completed"] == 1
+    # Hit rate counts each produced render, not each job
+    assert (stats["produced"], stats["hits"], stats["hit_rate"]) == (2, 2, 1.0)
+    assert stats["unclaimed"] == 0
+
+
+def test_preupload_pushes_each_produced_render(tmp_path, monkeypatch):
+    """Only renders the job produced are uploaded, each with its own bytes"""
+    monkeypatch.setattr(asset_cache, "_asset_cache", AssetCache(memory_bytes=1024 * 1024, disk_dir=str(tmp_path)))
+    speculator = Speculator(enabled=True)
+    monkeypatch.setattr(speculation, "_speculator", speculator)
+    uploads = []
+    monkeypatch.setattr(mug_service, "_upload_gif_asset",
+                        lambda product_id, device_name, gif_bytes, *args: uploads.append(gif_bytes))
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), (255, 0, 0)).save(buffer, format='PNG')
+    image_data = base64.b64encode(buffer.getvalue()).decode()
+    # The (edited) conversion result is already cached: the last candidate is a hit, not produced
+    result = {"pixel_matrix": [["#00ff00"] * 16 for _ in range(16)]}
+    mug_service._render_pixel_image(None, result["pixel_matrix"], 16, 16)
+
+    assert mug_service.speculate_pixel_image(image_data, result, 16, 16, "P", "mug_001")
+    _wait_idle(speculator)
+
+    assert uploads == [mug_service._render_pixel_image("P", image_data, 16, 16)["gif_bytes"]]
+
+
+def test_stale_jobs_are_cancelled():
+    """Queued jobs beyond the limit are dropped, unclaimed results expire as wasted"""
+    speculator = Speculator(enabled=True, ttl_sec=0.2, max_pending=1)
+    release = threading.Event()
+    ran = []
+
+    evicted = []
+    speculator.submit(lambda is_cancelled: release.wait(5) and ["first"], evict=evicted.append)
+    speculator.submit(lambda is_cancelled: ran.append("second") or ["second"])
+    speculator.submit(lambda is_cancelled: ran.append("third") or ["third"])
+    release.set()
+    _wait_idle(speculator)
+
+    assert ran == ["third"]
+    time.sleep(0.25)
+    stats = speculator.get_stats()
+    assert stats["cancelled"] == 1
+    assert stats["wasted"] == 2
+    # Wasted results are evicted through the job's callback
+    assert evicted == ["first"]
+    assert not speculator.claim("third")
+
+    assert not Speculator(enabled=False).submit(lambda is_cancelled: [])
+
+
+def test_convert_preuploads_only_for_authorized_device(monkeypatch):
+    """Without access to the device, convert still pre-renders but never pre-uploads"""
+    import mcp_server
+    calls = []
+    monkeypatch.setattr(mug_service, "_authorize", lambda user_id, product_id, device_name: False)
+    monkeypatch.setattr(mug_service, "speculate_pixel_image", lambda *args: calls.append(args[4:]))
+    monkeypatch.setattr(mcp_server.render_engine, "get_render_engine",
+                        lambda: types.SimpleNamespace(convert_image=lambda *args: {"pixel_matrix": []}))
+
+    server = mcp_server.MCPServer()
+    asyncio.run(server._handle_convert_image_to_pixels({"image_data": "x", "product_id": "P", "device_name": "mug_001"}))
+    assert calls == [("P", None)]
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Test script for task_graph.py
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from task_graph import TaskGraph
+
+
+def test_independent_steps_overlap():
+    """Wall time follows the critical path, dependents get their inputs"""
+    graph = TaskGraph(ThreadPoolExecutor(max_workers=4))
+    graph.add("client", lambda: time.sleep(0.2) or "client")
+    graph.add("render", lambda: time.sleep(0.2) or b"gif")
+    graph.add("upload", lambda gif: time.sleep(0.1) or len(gif), "render")
+    graph.add("send", lambda client, size: (client, size), "client", "upload")
+
+    started = time.perf_counter()
+    results = graph.run()
+    elapsed = time.perf_counter() - started
+
+    assert results["send"] == ("client", 3)
+    assert elapsed < 0.45
+    assert set(graph.get_timings()) == {"client", "render", "upload", "send"}
+
+
+def test_failure_propagates_to_dependents():
+    """A failing step fails everything downstream and run() raises it"""
+    graph = TaskGraph(ThreadPoolExecutor(max_workers=2))
+    graph.add("render", lambda: (_ for _ in ()).throw(ValueError("bad image")))
+    graph.add("upload", lambda gif: gif, "render")
+    with pytest.raises(ValueError, match="bad image"):
+        graph.run()
+
+    with pytest.raises(ValueError):
+        TaskGraph().add("upload", lambda gif: gif, "render")